@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-ins for CellConfig in the tests that run without Cantera. make_cell
+builds cathode, sep and anode objects with the SV layout of cathode_config,
+sep_config and anode_config in li_s_battery_init, for the electrolyte
+species of the shipped CTI file.
+"""
+
+import numpy as np
+import pytest
+from types import SimpleNamespace
+
+species = ['C3H4O3(e)', 'C4H6O3(e)', 'Li+(e)', 'PF6-(e)', 'S8(e)', 'S8-(e)',
+           'S6-(e)', 'S4-(e)', 'S2-(e)', 'S-(e)']
+
+"============================================================================="
+
+def component(npoints, ptr, start, H):
+    nVars = max(int(np.max(p)) for p in ptr.values()) + 1
+    
+    return SimpleNamespace(npoints=npoints, nVars=nVars, nSV=npoints*nVars, ptr=ptr,
+                           offsets=np.arange(start, start + npoints*nVars, nVars),
+                           H=H, dy=H/npoints, dy_vec=np.full([npoints], H/npoints))
+
+def cell(npoints_cathode=1, npoints_sep=1, npoints_anode=1, **overrides):
+    """Cell with the given node counts. overrides are set on its inputs."""
+    n = len(species)
+    rho = np.arange(0, n)
+    
+    cathode = component(npoints_cathode, {'eps_S8': 0, 'eps_Li2S': 1, 'rho_k_el': 2 + rho,
+                        'phi_dl': n + 2, 'phi_ed': n + 3, 'np_S8': n + 4,
+                        'np_Li2S': n + 5}, 0, 40e-6)
+    cathode.eps_C_0 = 0.1
+    sep = component(npoints_sep, {'rho_k_el': rho, 'phi': n}, cathode.nSV, 25e-6)
+    anode = component(npoints_anode, {'rho_k_el': rho, 'phi_dl': n, 'phi_ed': n + 1},
+                      cathode.nSV + sep.nSV, 10e-6)
+    
+    inputs = type('inputs', (), dict({'ctifile': 'sulfur_cathode_prelim.cti',
+                  'C_rate': 0.1, 'mesh_tol': 0.05, 'npoints_cathode_min': 1,
+                  'npoints_cathode_max': 100, 'npoints_cathode': npoints_cathode,
+                  'npoints_sep': npoints_sep, 'npoints_anode': npoints_anode},
+                  **overrides))
+    
+    return SimpleNamespace(inputs=inputs, cathode=cathode, sep=sep, anode=anode,
+                           overrides=overrides)
+
+@pytest.fixture
+def make_cell():
+    return cell
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the model hot paths on pinned reference cells: 1, 10 and 50
+cathode nodes at 0.02C, 0.1C and 1C (configs). Each cell times
+    res_fun             - the residual IDA calls (res_fun_vec or res_fun,
+                          from inputs.flag_res_vec) on a fixed SV
+    res_fun_loop        - cc_cycling.res_fun, for the 1-node cells it supports
+    label_columns       - labeling a fixed trajectory of n_rows rows
+    tag_strings
+    conservation_balances - on the same trajectory, without the plots of
+                            conservation_tests
+    main                - equilibration and discharge through main(), with
+                          the equilibrium cache off
+Results are written as JSON baselines and compared with a threshold:
+
+    python li_s_battery_bench.py run -o base.json
+    python li_s_battery_bench.py run -o new.json --skip main
+    python li_s_battery_bench.py compare base.json new.json --threshold 0.1
+"""
+
+import numpy as np
+import platform
+import timeit
+import json
+import time
+import sys
+
+# Reference cells, name: overrides. The meshed cells need the vectorized
+#   residual, the 1-node cells use the one set in inputs
+configs = {'cat{}_{}C'.format(n, C_rate): dict({'npoints_cathode': n, 'C_rate': C_rate},
+                                               **({'flag_res_vec': 1} if n > 1 else {}))
+           for n in [1, 10, 50] for C_rate in [0.02, 0.1, 1.0]}
+
+benchmarks = ['res_fun', 'res_fun_loop', 'label_columns', 'tag_strings',
+              'conservation_balances', 'main']
+
+# Rows of the fixed trajectory for the post-processing benchmarks
+n_rows = 1000
+
+"============================================================================="
+
+def fixed_state(cell, seed=0):
+    """SV_0 of cell with a fixed 1% perturbation, and SV_dot = 0."""
+    rs = np.random.RandomState(seed)
+    SV = cell.sol_init.SV_0*(1 + 0.01*rs.rand(cell.sol_init.SV_0.size))
+    
+    return SV, np.zeros_like(SV)
+
+"============================================================================="
+
+def fixed_trajectory(cell, seed=0):
+    """n_rows states around fixed_state, one second apart."""
+    SV, SV_dot = fixed_state(cell, seed)
+    rs = np.random.RandomState(seed + 1)
+    
+    return np.arange(0, n_rows, dtype=float), SV*(1 + 1e-3*rs.rand(n_rows, SV.size))
+
+"============================================================================="
+
+def best_time(fun, repeat=5):
+    """Best time per call [s] of fun over repeat runs of timeit's autorange,
+    which calls fun often enough to take at least 0.2 s."""
+    timer = timeit.Timer(fun)
+    number, t = timer.autorange()
+    times = [t] + timer.repeat(repeat - 1, number)
+    
+    return min(times)/number
+
+"============================================================================="
+
+def run_config(name, overrides, skip=(), repeat=5):
+    """Times of every benchmark of one reference cell, {benchmark: s}."""
+    from li_s_battery_init import CellConfig
+    from li_s_battery_model import main, cc_cycling, problem
+    from li_s_battery_post import label_columns, tag_strings, conservation_balances
+    
+    cell = CellConfig(**dict(overrides, flag_eq_cache=0, flag_checkpoint=0,
+                             flag_profile=0))
+    cat, sep, an = cell.cathode, cell.sep, cell.anode
+    results = {}
+    
+    SV, SV_dot = fixed_state(cell)
+    cat.set_i_ext(cat.i_ext_amp)
+    try:
+        if 'res_fun' not in skip:
+            bat = problem(cell, SV, SV_dot)
+            results['res_fun'] = best_time(lambda: bat.res(0., SV, SV_dot), repeat)
+        
+        # The node loop only handles one node per component
+        if 'res_fun_loop' not in skip and cat.npoints == sep.npoints == an.npoints == 1:
+            results['res_fun_loop'] = best_time(lambda: cc_cycling.res_fun(0., SV, SV_dot, cell),
+                                                repeat)
+    finally:
+        cat.set_i_ext(0)
+    
+    t, SV_t = fixed_trajectory(cell)
+    df = label_columns(t, SV_t, an.npoints, sep.npoints, cat.npoints, cell)
+    tags = tag_strings(df, cell)
+    if 'label_columns' not in skip:
+        results['label_columns'] = best_time(lambda: label_columns(t, SV_t, an.npoints,
+                                             sep.npoints, cat.npoints, cell), repeat)
+    if 'tag_strings' not in skip:
+        results['tag_strings'] = best_time(lambda: tag_strings(df, cell), repeat)
+    if 'conservation_balances' not in skip:
+        results['conservation_balances'] = best_time(lambda: conservation_balances(df, tags,
+                                                     cell), repeat)
+    
+    # One run of the full pipeline, which takes long enough to time directly
+    if 'main' not in skip:
+        t_0 = time.perf_counter()
+        main(cell, plot=False)
+        results['main'] = time.perf_counter() - t_0
+    
+    print(name, ' '.join(k + '=' + '{:.4g}'.format(v) for k, v in results.items()))
+    
+    return results
+
+"============================================================================="
+
+def run(path=None, names=None, skip=(), repeat=5):
+    """Run the benchmarks of the named configs (all by default) and write
+    the baseline to path. Returns the baseline as a dict."""
+    from li_s_battery_inputs import inputs
+    
+    names = list(configs) if names is None else names
+    results = {}
+    for name in names:
+        for bench, t in run_config(name, configs[name], skip, repeat).items():
+            results[name + '/' + bench] = t
+    
+    baseline = {'meta': {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                         'python': platform.python_version(),
+                         'numpy': np.__version__,
+                         'machine': platform.platform() + ' ' + platform.processor(),
+                         'flag_res_vec': inputs.flag_res_vec,
+                         'flag_jac': inputs.flag_jac,
+                         'flag_kin_kernel': inputs.flag_kin_kernel,
+                         'n_rows': n_rows},
+                'results': results}
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(baseline, f, indent=1)
+    
+    return baseline
+
+"============================================================================="
+
+def compare(base, new, threshold=0.1):
+    """Compare two baselines (dicts or paths) benchmark by benchmark. Prints
+    the ratio new/base of each and returns the benchmarks that are slower
+    than base by more than threshold (0.1 = 10 %)."""
+    if isinstance(base, str):
+        with open(base) as f:
+            base = json.load(f)
+    if isinstance(new, str):
+        with open(new) as f:
+            new = json.load(f)
+    
+    slower = {}
+    for key in sorted(set(base['results']) & set(new['results'])):
+        ratio = new['results'][key]/base['results'][key]
+        flag = ''
+        if ratio > 1 + threshold:
+            slower[key] = ratio
+            flag = '  SLOWER'
+        elif ratio < 1/(1 + threshold):
+            flag = '  faster'
+        print('{:40s} {:10.4g} {:10.4g} {:7.3f}{}'.format(key, base['results'][key],
+              new['results'][key], ratio, flag))
+    
+    for key in sorted(set(base['results']) ^ set(new['results'])):
+        print('{:40s} only in {}'.format(key, 'base' if key in base['results'] else 'new'))
+    
+    # Times from different machines or settings are not comparable
+    differ = [k for k in base['meta'] if k != 'date' and base['meta'][k] != new['meta'].get(k)]
+    if differ:
+        print('Baselines differ in', differ)
+    
+    return slower
+
+"============================================================================="
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command')
+    
+    run_args = commands.add_parser('run', help='run the benchmarks')
+    run_args.add_argument('-o', '--output', default='li_s_bench.json',
+                          help='baseline file to write')
+    run_args.add_argument('--configs', nargs='+', choices=list(configs),
+                          help='reference cells to run (all by default)')
+    run_args.add_argument('--skip', nargs='+', default=[], choices=benchmarks,
+                          help='benchmarks to leave out')
+    run_args.add_argument('--repeat', type=int, default=5)
+    
+    compare_args = commands.add_parser('compare', help='compare two baselines')
+    compare_args.add_argument('base')
+    compare_args.add_argument('new')
+    compare_args.add_argument('--threshold', type=float, default=0.1,
+                              help='flag slowdowns above this fraction')
+    
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args.output, args.configs, args.skip, args.repeat)
+    elif args.command == 'compare':
+        slower = compare(args.base, args.new, args.threshold)
+        if slower:
+            print(len(slower), 'benchmarks slower by more than', args.threshold)
+            sys.exit(1)
+    else:
+        parser.print_help()
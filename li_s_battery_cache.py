@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of equilibrated states. The final state of an equilibration
+(t, SV, SV_dot) is stored as a .npz file named by a hash of everything the
+equilibration depends on: the inputs of the cell, the contents of the CTI
+file, the SV layout and any rate multipliers. The cache directory is kept
+under a size limit by removing the least recently used files.
+"""
+
+import numpy as np
+import hashlib
+import os
+
+# Inputs that do not change the equilibrated state: plotting, diagnostics,
+#   file settings, and the solver settings and residual forms, which solve 
+#   the same equations to the same tolerances. The kinetics kernel is kept 
+#   in the key until it is verified against Cantera for every CTI file
+ignored = ['flag_plot_profiles', 'flag_potential', 'flag_electrode',
+           'flag_electrolyte', 'flag_capacity', 'flag_jac_check', 'flag_eq_cache',
+           'cache_dir', 'cache_size', 'flag_checkpoint', 'checkpoint_file', 
+           'checkpoint_wall', 'mesh_tol', 'npoints_cathode_min', 
+           'npoints_cathode_max', 'flag_profile', 'profile_file', 'flag_jac',
+           'linear_solver', 'flag_res_vec']
+
+"============================================================================="
+
+def state_key(cell, multipliers=None):
+    """Hash of the inputs, CTI file and SV layout of a cell, and the rate
+    multipliers in use."""
+    h = hashlib.sha256()
+    
+    def add(name, value):
+        h.update(name.encode())
+        if isinstance(value, np.ndarray):
+            h.update(str((value.dtype, value.shape)).encode())
+            h.update(np.ascontiguousarray(value).tobytes())
+        else:
+            h.update(repr(value).encode())
+    
+    # Inputs, including those inherited from the inputs class
+    for name in sorted(dir(cell.inputs)):
+        value = getattr(cell.inputs, name)
+        if name.startswith('__') or name in ignored or callable(value):
+            continue
+        add(name, value)
+    
+    with open(cell.inputs.ctifile, 'rb') as f:
+        h.update(f.read())
+    
+    # Solution vector layout
+    for domain in [cell.cathode, cell.sep, cell.anode]:
+        add('npoints', domain.npoints)
+        add('nVars', domain.nVars)
+        add('offsets', np.asarray(domain.offsets))
+        for name in sorted(domain.ptr):
+            add(name, np.asarray(domain.ptr[name]))
+    
+    for name in sorted(multipliers or {}):
+        add(name, multipliers[name])
+    
+    return h.hexdigest()
+
+"============================================================================="
+
+def load_state(key, cache_dir):
+    """Cached (t, SV, SV_dot) for key, or None. A hit marks the file as
+    recently used."""
+    path = os.path.join(cache_dir, key + '.npz')
+    if not os.path.exists(path):
+        return None
+    
+    try:
+        with np.load(path) as data:
+            state = (data['t'], data['SV'], data['SV_dot'])
+    except (OSError, ValueError, KeyError):
+        return None
+    os.utime(path)
+    
+    return state
+
+"============================================================================="
+
+def save_state(key, t, SV, SV_dot, cache_dir, max_bytes):
+    """Store (t, SV, SV_dot) under key and evict old entries so the cache
+    stays under max_bytes. The file is written under a temporary name and
+    renamed so parallel runs never read a partial file."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + '.npz')
+    tmp = os.path.join(cache_dir, key + '.' + str(os.getpid()) + '.tmp.npz')
+    
+    np.savez(tmp, t=t, SV=SV, SV_dot=SV_dot)
+    os.replace(tmp, path)
+    
+    evict(cache_dir, max_bytes)
+    
+    return path
+
+"============================================================================="
+
+def evict(cache_dir, max_bytes):
+    """Remove the least recently used cache files until the directory holds
+    at most max_bytes."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith('.npz') and '.tmp' not in name:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    
+    entries.sort()
+    total = sum(e[1] for e in entries)
+    for mtime, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+    
+    return total
+
+"============================================================================="
+
+def clear(cache_dir):
+    """Remove every cached state."""
+    if os.path.isdir(cache_dir):
+        evict(cache_dir, 0)
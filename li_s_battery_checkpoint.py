@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints of long integrations. A checkpoint holds the trajectory of the
+running stage so far (t, SV, SV_dot), the stage name, the external current,
+the solver settings and what is needed to rebuild the cell (the inputs
+overrides, rate multipliers and the state key of li_s_battery_cache). It is
+written to one .npz file that is replaced on every write, so a run stopped
+at any point leaves the latest complete checkpoint behind. The run is picked
+up again with li_s_battery_model.resume. Dict fields are stored as JSON text
+and the file is loaded without pickle, so reading a checkpoint never runs
+code from it.
+"""
+
+import numpy as np
+import json
+import os
+
+"============================================================================="
+
+def to_json(value):
+    """JSON form of the NumPy values in a dict field, arrays tagged with
+    their dtype so from_json gives them back as arrays."""
+    if isinstance(value, np.ndarray):
+        return {'__ndarray__': value.tolist(), 'dtype': value.dtype.str}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(type(value).__name__ + ' cannot be stored in a checkpoint')
+
+def from_json(obj):
+    if '__ndarray__' in obj:
+        return np.array(obj['__ndarray__'], dtype=obj['dtype'])
+    
+    return obj
+
+"============================================================================="
+
+def save_checkpoint(path, **fields):
+    """Write the fields to path. The file is written under a temporary name
+    and renamed, so an interrupted write never replaces a good checkpoint."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, '.' + os.path.basename(path) + '.'
+                       + str(os.getpid()) + '.tmp.npz')
+    
+    # Dicts are stored as JSON strings, listed in json_fields
+    dicts = [name for name, value in fields.items() if isinstance(value, dict)]
+    np.savez(tmp, json_fields=np.array(dicts, dtype=str),
+             **{name: np.array(json.dumps(value, default=to_json))
+                if name in dicts else value for name, value in fields.items()})
+    os.replace(tmp, path)
+    
+    return path
+
+"============================================================================="
+
+def load_checkpoint(path):
+    """Fields of the checkpoint at path as a dict."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            fields = {name: data[name] for name in data.files}
+    except ValueError:
+        raise ValueError(path + ' holds pickled data, which is not loaded. '
+                         'Checkpoints of earlier versions cannot be resumed')
+    
+    dicts = fields.pop('json_fields', np.array([], dtype=str)).tolist()
+    for name, value in fields.items():
+        if name in dicts:
+            fields[name] = json.loads(str(value), object_hook=from_json)
+        elif value.ndim == 0:
+            fields[name] = value.item()
+    
+    return fields
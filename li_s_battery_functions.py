@@ -5,52 +5,213 @@ Created on Tue Dec 10 08:26:06 2019
 @author: dkorff
 """
 
-import cantera as ct
 import numpy as np
+import pandas as pd
 from li_s_battery_inputs import inputs
-from li_s_battery_init import cathode as cat
+from li_s_battery_profile import profiler
 
+# Physical constants are taken from Cantera as in li_s_battery_kinetics, so
+#   these functions also run without it
+try:
+    from cantera import faraday as F, gas_constant as R
+except ImportError:
+    F = 96485332.12331001       # [C/kmol]
+    R = 8314.46261815324        # [J/kmol/K]
+
+# np.trapz was renamed np.trapezoid in NumPy 2.0 and later removed
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+# Migration factor z_k*F/RT of the electrolyte species. Temperature and 
+#   charges are shared by all cells (CellConfig.shared)
+zFRT = inputs.z_k_el*F/R/inputs.T
+
+@profiler.timed('dst')
 def dst(s1, s2, D_eff, dyInv):
-    F = ct.faraday; R = ct.gas_constant; T = inputs.T
     
-    C_0 = (s1['C_tot'] + s2['C_tot'])*0.5
     C_k = (s1['C_k'] + s2['C_k'])*0.5
-    z_k = inputs.z_k_el
     
-    N_io = np.zeros_like(s1['C_k'])
     N_io = (-D_eff*(s2['C_k'] - s1['C_k'])*dyInv
-            -D_eff*C_k*(z_k*F/R/T)*(s2['phi_el'] - s1['phi_el'])*dyInv)
+            -D_eff*C_k*zFRT*(s2['phi_el'] - s1['phi_el'])*dyInv)
     
 #    N_io = N_io*np.array((1., 1., 1., 1., 0., 0., 0., 0., 0., 0.))
         
-    i_io = np.dot(N_io, z_k)*F
+    i_io = np.dot(N_io, inputs.z_k_el)*F
+    
+    return N_io, i_io
+
+"""========================================================================="""
+
+@profiler.timed('dst_jac')
+def dst_jac(s1, s2, D_eff, dyInv):
+    """Derivatives of the dst species flux N_io with respect to the species 
+    concentrations and electrolyte potentials on either side of the face. 
+    N_k only depends on C_k, so the concentration derivatives are returned as
+    the diagonal entries."""
+    C_k = (s1['C_k'] + s2['C_k'])*0.5
+    dphi = s2['phi_el'] - s1['phi_el']
+    
+    dN_dC1 = D_eff*dyInv - 0.5*D_eff*zFRT*dphi*dyInv
+    dN_dC2 = -D_eff*dyInv - 0.5*D_eff*zFRT*dphi*dyInv
+    dN_dphi1 = D_eff*C_k*zFRT*dyInv
+    dN_dphi2 = -dN_dphi1
+    
+    return dN_dC1, dN_dC2, dN_dphi1, dN_dphi2
+
+"""========================================================================="""
+
+@profiler.timed('dst')
+def dst_faces(C_k, phi_el, D_eff, dyInv):
+    """Species fluxes N_io and ionic currents i_io across every face of a 
+    chain of nodes in one call. C_k is (..., n_nodes, n_species) and phi_el
+    (..., n_nodes); face f lies between nodes f and f+1, with diffusion
+    coefficients D_eff (..., n_faces, n_species) and inverse node spacing 
+    dyInv (n_faces). Leading axes, e.g. time, are kept."""
+    C_avg = (C_k[..., 1:, :] + C_k[..., :-1, :])*0.5
+    dphi = phi_el[..., 1:] - phi_el[..., :-1]
+    
+    N_io = -D_eff*((C_k[..., 1:, :] - C_k[..., :-1, :]) 
+                   + C_avg*zFRT*dphi[..., None])*dyInv[:, None]
+    i_io = np.dot(N_io, inputs.z_k_el)*F
     
     return N_io, i_io
 
 """========================================================================="""
 
-def set_state(SV, offset, ptr):
+def chain_fluxes(SV, cell, eps_el):
+    """dst_faces over all nodes of the cell, cathode -> separator -> anode, 
+    with the face geometry of cell.faces. eps_el (..., cathode.npoints) is the
+    electrolyte volume fraction of the cathode nodes, which sets the 
+    effective diffusion coefficients of the cathode faces."""
+    faces = cell.faces
+    views = [StateView(SV, comp) for comp in [cell.cathode, cell.sep, cell.anode]]
+    C_k = np.concatenate([s.C_k for s in views], axis=-2)
+    phi_el = np.concatenate([s.phi_el for s in views], axis=-1)
+    
+    # Interior cathode faces take the mean of the nodes on either side, the
+    #   cathode/separator face that of the last cathode node
+    eps_face = np.concatenate((0.5*(eps_el[..., :-1] + eps_el[..., 1:]), 
+                               eps_el[..., -1:]), axis=-1)
+    scale = np.ones(eps_face.shape[:-1] + (faces.n,))
+    scale[..., :faces.n_cat] = eps_face**(1.5)
+    
+    return dst_faces(C_k, phi_el, faces.D_el*scale[..., None], faces.dyInv)
+
+"""========================================================================="""
+
+class StateView():
+    """Electrolyte and potential state of every node of one component 
+    (cathode, sep or anode) of SV. SV is one solution vector or rows of them
+    (n_times, nSV), which become the leading axes of each field. C_k 
+    (..., npoints, n_species), phi_ed and phi_dl (..., npoints) are views into
+    SV; C_tot, X_k and phi_el are computed once for all nodes. The separator
+    has no electrode, so phi_el is its 'phi' entry and phi_ed, phi_dl are None.
+    Fields can also be read as state['C_k'], as dst and dst_jac do."""
+    __slots__ = ['C_k', 'C_tot', 'X_k', 'phi_ed', 'phi_dl', 'phi_el']
+    
+    def __init__(self, SV, comp):
+        ptr = comp.ptr; start = int(comp.offsets[0])
+        SV_k = SV[..., start:start + comp.nSV]
+        SV_k = SV_k.reshape(SV_k.shape[:-1] + (comp.npoints, comp.nVars))
+        
+        # rho_k_el is a contiguous range, so a slice keeps C_k a view
+        rho = slice(ptr['rho_k_el'][0], ptr['rho_k_el'][-1] + 1)
+        self.C_k = SV_k[..., rho]
+        self.C_tot = self.C_k.sum(axis=-1)
+        self.X_k = self.C_k/self.C_tot[..., None]
+        
+        if 'phi' in ptr:
+            self.phi_ed = None
+            self.phi_dl = None
+            self.phi_el = SV_k[..., ptr['phi']]
+        else:
+            self.phi_ed = SV_k[..., ptr['phi_ed']]
+            self.phi_dl = SV_k[..., ptr['phi_dl']]
+            self.phi_el = self.phi_ed - self.phi_dl
+    
+    def __getitem__(self, name):
+        return getattr(self, name)
+    
+    def node(self, j):
+        """State of node j alone, as views of this one."""
+        state = StateView.__new__(StateView)
+        for name in StateView.__slots__:
+            value = getattr(self, name)
+            if value is not None:
+                value = value[..., j, :] if name in ['C_k', 'X_k'] else value[..., j]
+            setattr(state, name, value)
+            
+        return state
+
+"""========================================================================="""
+
+def layout_config(cathode, sep, anode, species):
+    """Registry of the SV layout of a cell, built once from the ptr and
+    offsets tables. names[i] is the name of SV[i], index[name] its position,
+    fields[tag] the positions of one variable at every node (in node order)
+    and tags[tag] their names. columns labels [SV, t] rows. species are the
+    names of the electrolyte species."""
+    nSV = cathode.nSV + sep.nSV + anode.nSV
     
-    state = {}
+    # (component, ptr entry, tag, name of the variable at node j for species k)
+    table = [(cathode, 'eps_S8', 'eps_S8', 'eps_S8{j}'),
+             (cathode, 'eps_Li2S', 'eps_Li2S', 'eps_Li2S{j}'),
+             (cathode, 'rho_k_el', 'rho_el', 'rho_{k}_cat{j}'),
+             (cathode, 'phi_dl', 'phi_dl', 'Phi_dl{j}'),
+             (cathode, 'phi_ed', 'phi_ed', 'Phi_ed{j}'),
+             (cathode, 'np_S8', 'np_S8', 'np_S8{j}'),
+             (cathode, 'np_Li2S', 'np_Li2S', 'np_Li2S{j}'),
+             (sep, 'rho_k_el', 'rho_el_sep', 'rho_{k}_sep{j}'),
+             (sep, 'phi', 'phi_sep', 'Phi_sep{j}'),
+             (anode, 'rho_k_el', 'rho_el_an', 'rho_{k}_an{j}'),
+             (anode, 'phi_dl', 'phi_dl_an', 'Phi_an_dl{j}'),
+             (anode, 'phi_ed', 'phi_an', 'Phi_an{j}')]
     
-    state['phi_ed'] = SV[offset + ptr['phi_ed']]
-    state['phi_dl'] = SV[offset + ptr['phi_dl']]
-    state['phi_el'] = SV[offset + ptr['phi_ed']] - SV[offset + ptr['phi_dl']]
-    state['C_tot'] = sum(SV[offset + ptr['rho_k_el']])
-    state['C_k'] = SV[offset + ptr['rho_k_el']]
-    state['X_k'] = SV[offset + ptr['rho_k_el']]/sum(SV[offset + ptr['rho_k_el']])
+    sv_names = [None]*nSV
+    sv_fields = {}
+    for comp, key, tag, name in table:
+        ptr = np.atleast_1d(comp.ptr[key])
+        offsets = np.asarray(comp.offsets, dtype=int)
+        sv_fields[tag] = (offsets[:, None] + ptr[None, :]).ravel()
+        for j, offset in enumerate(offsets):
+            for k, i in enumerate(ptr):
+                sv_names[offset + i] = name.format(j=j+1, k=species[k])
     
-    return state
+    class layout():
+        
+        names = sv_names
+        columns = pd.Index(sv_names + ['Time'])
+        index = {name: i for i, name in enumerate(sv_names + ['Time'])}
+        fields = sv_fields
+        tags = {tag: [sv_names[i] for i in sv_fields[tag]] for tag in sv_fields}
+        
+    return layout
 
 """========================================================================="""
 
-def set_state_sep(SV, offset, ptr):
+def discharge_summary(SV_df, tags, cell):
+    """Compact summary of a discharge for sweeps: capacity [Ah/kg_sulfur], end
+    time [s] and voltage [V], and the capacity averaged cell voltage over the
+    whole discharge and over the upper and lower plateaus. The plateaus are
+    split at a quarter of the theoretical capacity of sulfur (S8 -> S4 2-)."""
+    cathode, anode, inputs = cell.cathode, cell.anode, cell.inputs
+    
+    t = SV_df['Time'].values
+    capacity = t*-cathode.i_ext_amp*inputs.A_cat/3600/(cathode.m_S_0 + cathode.m_S_el)
+    voltage = SV_df[tags['phi_ed'][0]].values - SV_df[tags['phi_an'][-1]].values
+    
+    def mean_voltage(select):
+        if np.count_nonzero(select) < 2:
+            return np.nan
+        return trapezoid(voltage[select], capacity[select])/np.ptp(capacity[select])
     
-    state = {}
+    upper = capacity <= 1675/4
     
-    state['phi_el'] = SV[offset + ptr['phi']]
-    state['C_tot'] = sum(SV[offset + ptr['rho_k_el']])
-    state['C_k'] = SV[offset + ptr['rho_k_el']]
-    state['X_k'] = SV[offset + ptr['rho_k_el']]/sum(SV[offset + ptr['rho_k_el']])
+    summary = {}
+    summary['capacity'] = capacity[-1]
+    summary['t_end'] = t[-1]
+    summary['V_end'] = voltage[-1]
+    summary['V_mean'] = mean_voltage(np.ones_like(upper))
+    summary['V_upper'] = mean_voltage(upper)
+    summary['V_lower'] = mean_voltage(~upper)
     
-    return state
\ No newline at end of file
+    return summary
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Golden trajectories: stored reference discharge curves of the reference
+cells of li_s_battery_bench.configs, to check that a change to the residual,
+kinetics or solver keeps the physics of the model. A discharge is reduced to
+curves against capacity [Ah/kg_sulfur] (curves):
+    voltage         - phi_ed of the cathode current collector less phi_ed of
+                      the anode current collector, as in discharge_summary
+    eps_S8, eps_Li2S - cathode averages
+    C_<species>     - mean electrolyte concentration in the cathode
+The averages are over the node thicknesses, so they do not depend on the
+mesh. compare interpolates a run and its reference onto a common capacity
+grid and checks each curve against the tolerances below:
+
+    python li_s_battery_golden.py record
+    python li_s_battery_golden.py check --configs cat1_0.1C
+
+References are recorded with the baseline model (baseline: node loop 
+residual, IDA's finite difference Jacobian on the dense solver, Cantera 
+kinetics), which only handles the 1-node cells, and these settings are stored
+with them. check runs the current settings against them. It needs the full
+Cantera and Assimulo install, reports the cells without a reference and fails
+if none are stored.
+
+No references are stored yet: they need that install and the CTI file of
+inputs.ctifile. Until they are recorded and the vectorized residual, analytic
+Jacobian and kinetics kernel pass check, the defaults in inputs are the
+baseline settings and the rest is opt-in.
+"""
+
+import numpy as np
+import json
+import os
+import sys
+
+from li_s_battery_inputs import inputs
+from li_s_battery_bench import configs
+
+# Directory of the reference curves, one <config>.npz each
+golden_dir = 'golden'
+
+# Settings the references are recorded with, the model before the
+#   vectorized residual, analytic Jacobian and kinetics kernel. The node loop
+#   needs one node per component, so only those cells have references
+baseline = {'flag_res_vec': 0, 'flag_jac': 0, 'linear_solver': 'DENSE',
+            'flag_kin_kernel': 0, 'flag_eq_steady': 0, 'flag_eq_event': 0}
+reference_cells = [name for name in configs if configs[name]['npoints_cathode'] == 1]
+
+# Points of the common capacity grid
+n_grid = 200
+
+# Tolerances (atol, rtol) of each curve, a point passes if it is within
+#   atol + rtol*max|reference| of the reference. dq is the capacity shift
+#   allowed, relative to the end capacity, so that steep parts of the
+#   curves (the plateau transition and the end of discharge) are compared
+#   across the shift rather than point by point
+tolerances = {'voltage': (2e-3, 0.), 'eps_S8': (1e-5, 1e-3),
+              'eps_Li2S': (1e-5, 1e-3), 'C_k': (1e-6, 1e-2), 'capacity': (0., 2e-3)}
+dq = 2e-3
+
+"============================================================================="
+
+def curves(SV_df, tags, cell):
+    """Reference curves of a labeled discharge DataFrame, {name: array},
+    including 'capacity'."""
+    from li_s_battery_init import elyte_obj
+    
+    cathode, inputs = cell.cathode, cell.inputs
+    species = elyte_obj.species_names
+    
+    t = SV_df['Time'].values
+    out = {'capacity': t*-cathode.i_ext_amp*inputs.A_cat/3600/(cathode.m_S_0
+                                                                + cathode.m_S_el)}
+    out['voltage'] = SV_df[tags['phi_ed'][0]].values - SV_df[tags['phi_an'][-1]].values
+    
+    # Node thickness weights of the cathode averages
+    w = cathode.dy_vec/cathode.dy_vec.sum()
+    eps_S8 = SV_df[tags['eps_S8']].values
+    eps_Li2S = SV_df[tags['eps_Li2S']].values
+    out['eps_S8'] = eps_S8.dot(w)
+    out['eps_Li2S'] = eps_Li2S.dot(w)
+    
+    # Electrolyte concentrations weighted by the electrolyte in each node
+    eps_el = (1 - cathode.eps_C_0 - eps_S8 - eps_Li2S)*w
+    rho = SV_df[tags['rho_el']].values.reshape(t.size, cathode.npoints, len(species))
+    C_k = np.einsum('tj,tjk->tk', eps_el, rho)/eps_el.sum(axis=1)[:, None]
+    for k, name in enumerate(species):
+        out['C_' + name] = C_k[:, k]
+    
+    return out
+
+"============================================================================="
+
+def save(path, ref, overrides):
+    """Store the curves ref of a run with overrides as path (.npz)."""
+    np.savez(path, overrides=json.dumps(overrides), **ref)
+
+def load(path):
+    """Curves and overrides stored by save."""
+    with np.load(path) as f:
+        ref = {name: f[name] for name in f.files if name != 'overrides'}
+        overrides = json.loads(str(f['overrides']))
+    
+    return ref, overrides
+
+"============================================================================="
+
+def compare(ref, new, tol=tolerances):
+    """Compare the curves new against the reference ref on a common capacity
+    grid up to the smaller end capacity. Returns {curve: error}, the largest
+    deviation of each curve relative to its tolerance; values above 1 fail.
+    Each new point is compared with the range of the reference within
+    +-dq*capacity of it."""
+    q_ref, q_new = ref['capacity'], new['capacity']
+    atol, rtol = tol['capacity']
+    errors = {'capacity': abs(q_new[-1] - q_ref[-1])/(atol + rtol*abs(q_ref[-1]))}
+    
+    q = np.linspace(0, min(q_ref[-1], q_new[-1]), n_grid)
+    shift = dq*q_ref[-1]*np.linspace(-1, 1, 5)
+    q_shift = np.clip(q[:, None] + shift[None, :], q_ref[0], q_ref[-1])
+    
+    for name in ref:
+        if name == 'capacity' or name not in new:
+            continue
+        atol, rtol = tol[name] if name in tol else tol['C_k']
+        y_ref = np.interp(q_shift, q_ref, ref[name])
+        y_new = np.interp(q, q_new, new[name])
+        
+        # Distance outside the band of the reference values around each point
+        dev = np.maximum(y_new - y_ref.max(axis=1), y_ref.min(axis=1) - y_new)
+        errors[name] = max(dev.max(), 0.)/(atol + rtol*np.abs(ref[name]).max())
+    
+    # A curve only in one of them fails
+    for name in set(ref) ^ set(new):
+        errors[name] = np.inf
+    
+    return errors
+
+"============================================================================="
+
+def run(name, settings=None):
+    """Discharge curves of the reference cell name, from main() with the
+    equilibrium cache and checkpoints off. settings override inputs as for
+    CellConfig, and those shared by all cells must already be set in 
+    inputs."""
+    from li_s_battery_init import CellConfig
+    from li_s_battery_model import main
+    
+    settings = {} if settings is None else settings
+    for key in CellConfig.shared:
+        if key in settings and getattr(inputs, key) != settings[key]:
+            raise ValueError('set inputs.' + key + ' = ' + repr(settings[key]))
+    cell = CellConfig(**dict(configs[name], flag_eq_cache=0, flag_checkpoint=0,
+                             **{k: v for k, v in settings.items() 
+                                if k not in CellConfig.shared}))
+    SV_eq_df, SV_dch_df, tags = main(cell, plot=False)
+    
+    return curves(SV_dch_df, tags, cell)
+
+"============================================================================="
+
+def record(names=None, path=golden_dir):
+    """Run the named reference cells (the 1-node cells by default) with the
+    baseline settings and store their curves in path as the new references,
+    with the cell overrides and the baseline settings."""
+    os.makedirs(path, exist_ok=True)
+    for name in (reference_cells if names is None else names):
+        save(os.path.join(path, name + '.npz'), run(name, baseline),
+             dict(configs[name], **baseline))
+        print('Recorded', name, '\n')
+
+"============================================================================="
+
+def stored(path=golden_dir):
+    """Names of the references stored in path, none if it does not exist."""
+    if not os.path.isdir(path):
+        return []
+    
+    return sorted(f[:-4] for f in os.listdir(path) if f.endswith('.npz'))
+
+def check(names=None, path=golden_dir):
+    """Run the named reference cells (all with a stored reference by default)
+    and compare them with their references. Returns {name: errors} of the
+    cells that fail, with errors None for cells without a stored reference,
+    which are reported and not run."""
+    refs = stored(path)
+    if names is None:
+        names = refs
+    if not names:
+        print('No reference curves in', os.path.abspath(path), '- record them with',
+              '"python li_s_battery_golden.py record"\n')
+    
+    failed = {}
+    for name in names:
+        if name not in refs:
+            print('{:20s} {:6s} no reference in {}'.format(name, 'NONE', path))
+            failed[name] = None
+            continue
+        
+        ref, overrides = load(os.path.join(path, name + '.npz'))
+        if overrides != dict(configs[name], **baseline):
+            print(name, ': reference was recorded with', overrides)
+        errors = compare(ref, run(name))
+        worst = max(errors, key=errors.get)
+        status = 'ok' if errors[worst] <= 1 else 'FAILED'
+        print('{:20s} {:6s} worst {} {:.3g}'.format(name, status, worst, errors[worst]))
+        if status != 'ok':
+            failed[name] = errors
+    
+    return failed
+
+"============================================================================="
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['record', 'check'])
+    parser.add_argument('--configs', nargs='+', choices=list(configs),
+                        help='reference cells (the 1-node cells to record, the stored '
+                        'ones to check by default)')
+    parser.add_argument('--dir', default=golden_dir, help='reference directory')
+    args = parser.parse_args()
+    
+    if args.command == 'record':
+        record(args.configs, args.dir)
+    else:
+        failed = check(args.configs, args.dir)
+        for name, errors in failed.items():
+            if errors is not None:
+                print(name, {k: np.round(v, 3) for k, v in errors.items() if v > 1})
+        # Nothing checked is not a pass
+        if failed or not stored(args.dir):
+            sys.exit(1)
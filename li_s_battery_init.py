@@ -12,11 +12,15 @@ run the simulations
 import numpy as np
 import cantera as ct
 import importlib
+import time
 from math import pi
 
 #import li_s_battery_inputs
 #importlib.reload(li_s_battery_inputs)
 from li_s_battery_inputs import inputs
+from li_s_battery_kinetics import load_kernel, kernel_rates, isothermal
+from li_s_battery_profile import profiler
+from li_s_battery_functions import layout_config
 
 
 "Import cantera objects - this step is the same regardless of test type"
@@ -40,6 +44,75 @@ lithium_el_s = ct.Interface(inputs.ctifile, inputs.anode_elyte_phase,
                              [lithium_obj, elyte_obj, conductor_obj])
 #Li2S_tpb = ct.Interface(inputs.ctifile, 'tpb', [Li2S_obj, Li2S_el_s, ])
 
+"Kinetics kernel generated from the CTI file, used in place of the interfaces"
+if inputs.flag_kin_kernel != 0:
+    kernel = load_kernel(inputs.ctifile, [inputs.sulfur_elyte_phase, 
+                         inputs.graphite_elyte_phase, inputs.Li2S_elyte_phase,
+                         inputs.anode_elyte_phase], inputs.flag_kin_kernel == 2)
+else:
+    kernel = None
+    
+isothermal.kernel = kernel
+if inputs.flag_kin_kernel != 0:
+    isothermal.update(elyte_obj.T)
+    
+def set_rate_multipliers(multipliers):
+    """Scale the forward and reverse rate constants of reactions by their CTI
+    id, e.g. {'C-E-1': 2.}, in the Cantera interfaces and the kinetics kernel.
+    Reactions not named are reset to a multiplier of 1."""
+    found = []
+    for surf in [sulfur_el_s, Li2S_el_s, carbon_el_s, lithium_el_s]:
+        for i in np.arange(0, surf.n_reactions):
+            rxn = surf.reaction(int(i))
+            rxn_id = getattr(rxn, 'id', None) or getattr(rxn, 'ID', '')
+            surf.set_multiplier(multipliers.get(rxn_id, 1.), int(i))
+            found.append(rxn_id)
+            
+    missing = [r for r in multipliers if r not in found]
+    if missing:
+        raise KeyError('No reactions with id ' + ', '.join(missing))
+        
+    isothermal.multipliers = dict(multipliers)
+    if kernel is not None:
+        isothermal.update(isothermal.T)
+        
+    return
+
+def kernel_phase_rates(surf, X_k, phi_ed, phi_el):
+    """Net production rates of each phase at the Cantera interface surf from
+    the generated kinetics kernel, as a dict keyed by phase name. The kernel
+    is evaluated at the temperature of the Cantera phases, with the rate 
+    constants cached in isothermal."""
+    k, FRT = isothermal.update(surf.T)
+    states = {'X_' + inputs.elyte_phase: X_k, 'phi_' + inputs.elyte_phase: phi_el,
+              'phi_' + inputs.metal_phase: phi_ed}
+    t_0 = time.perf_counter()
+    rates = kernel_rates(kernel, surf.name, k, FRT, **states)
+    if profiler.active:
+        profiler.add_time('kinetics:' + surf.name, time.perf_counter() - t_0)
+    
+    return dict(zip(kernel.PHASES[surf.name], rates))
+
+def cathode_faradaic(X_k, phi_ed, phi_el):
+    """Faradaic rate at the carbon interface alone, cathode_kinetics()[5],
+    for rows of states X_k (n, n_species), phi_ed and phi_el (n,). Post-
+    processing needs no other rate, so only this one is evaluated. It is 
+    defined here rather than in the model so that post-processing does not
+    need the solver."""
+    if inputs.flag_kin_kernel != 0:
+        return kernel_phase_rates(carbon_el_s, X_k, phi_ed, phi_el)[inputs.metal_phase][:, 0]
+    
+    sdot_Far = np.zeros([X_k.shape[0]])
+    for j in np.arange(0, X_k.shape[0]):
+        carbon_obj.electric_potential = phi_ed[j]
+        elyte_obj.electric_potential = phi_el[j]
+        conductor_obj.electric_potential = phi_ed[j]
+        elyte_obj.X = X_k[j]
+        
+        sdot_Far[j] = carbon_el_s.get_net_production_rates(conductor_obj)[0]
+        
+    return sdot_Far
+
 if hasattr(inputs, 'C_k_el_0'):
     elyte_obj.X = inputs.C_k_el_0/np.sum(inputs.C_k_el_0)
 
@@ -77,285 +150,410 @@ F = ct.faraday
        
 "============================================================================="
 
-class cathode():
-    # Set a flag to let the solver know whether to implement this class
-    flag = inputs.flag_cathode
-    F = ct.faraday
-    
-    # Number of nodes in the y-direction
-    npoints = inputs.npoints_cathode
-    
-    # Number of shells in the cathode particle
-#        nshells = inputs.nshells_cathode
-    
-    # Number of state variables per node
-    nVars = 2 + elyte_obj.n_species + 4
-    
-    # Pointers
-    ptr = {}
-    ptr['iFar'] = elyte_obj.species_index(inputs.Li_species_elyte)
-    
-    ptr['eps_S8'] = 0
-    ptr['eps_Li2S'] = 1
-    ptr['rho_k_el'] = 2 + np.arange(0, elyte_obj.n_species)
-    ptr['phi_dl'] = ptr['rho_k_el'][-1] + 1
-    ptr['phi_ed'] = ptr['rho_k_el'][-1] + 2
-    ptr['np_S8'] = ptr['rho_k_el'][-1] + 3
-    ptr['np_Li2S'] = ptr['rho_k_el'][-1] + 4
-    
-    nSV = npoints*nVars
-    offsets = np.arange(0, int(nSV), int(nVars))
-    
-    ptr_vec = {}
-    ptr_vec['eps_S8']   = ptr['eps_S8']   + offsets
-    ptr_vec['eps_Li2S'] = ptr['eps_Li2S'] + offsets
-    ptr_vec['rho_k_el'] = ptr['rho_k_el']
-    for i in offsets[1:]:
-        ptr_vec['rho_k_el'] = np.hstack((ptr_vec['rho_k_el'],i+ptr['rho_k_el']))
-    ptr_vec['phi_dl']  = ptr['phi_dl'] + offsets
-    ptr_vec['phi_ed']  = ptr['phi_ed']   + offsets
-    ptr_vec['np_S8']   = ptr['np_S8']   + offsets
-    ptr_vec['np_Li2S'] = ptr['np_Li2S'] + offsets
-    
-    # Store parameters as class attributes
-    T = inputs.T
-    C_dl = inputs.C_dl_cat
-    
-    # Geometric parameters
-    tau = inputs.tau_cat
-    r_p = inputs.r_p_cat
-    d_p = inputs.d_p_cat
-    dyInv = npoints/inputs.H_cat
-    dy = inputs.H_cat/npoints
-    H = inputs.H_cat
-    V_0 = inputs.H_cat*inputs.A_cat
-    
-    
-    if inputs.sulfur_method == 'bulk':
-        m_S = inputs.m_S_0/inputs.A_cat
-        m_S_0 = inputs.m_S_0
-    elif inputs.sulfur_method == 'loading':
-        m_S = inputs.m_S_0
-        m_S_0 = inputs.m_S_0*inputs.A_cat
-        
-        
-    omega_S = inputs.pct_w_S8_0/inputs.A_cat
-    omega_C = inputs.pct_w_C_0/inputs.A_cat
-    rho_S = sulfur_obj.density_mass
-    rho_C = carbon_obj.density_mass
-    m_solid = m_S/omega_S
-    
-    eps_S_0 = m_S/rho_S/H
-    eps_C_0 = m_solid*omega_C/rho_C/H
-    eps_L_0 = 1e-10; 
-    
-    A_S_0 = (3*eps_S_0)/((3*eps_S_0*V_0)/(2*pi*inputs.np_S8_init))**(1/3)
-    A_L_0 = (3*eps_L_0)/(3*eps_L_0*V_0/2/inputs.np_Li2S_init/pi)**(1/3)
-    
-    eps_el_0 = 1 - eps_S_0 - eps_C_0 - eps_L_0
-    eps_pore = 1 - eps_C_0
-    print(eps_el_0/eps_S_0)
-    
-    r_C = 3*eps_C_0/inputs.A_C_0
-    
-    i_S8 = elyte_obj.species_index(inputs.Max_sulfide)
-    n_S_atoms = np.zeros([len(elyte_obj.species_names[i_S8:])])    
-    for i, species in enumerate(elyte_obj.species_names[i_S8:]):
-        n_S_atoms[i] = elyte_obj.n_atoms(species, 'S')  
-        
-    n_S_0 = eps_el_0*H*np.dot(n_S_atoms, inputs.C_k_el_0[i_S8:]) \
-          + 8*sulfur_obj.density_mole*eps_S_0*H \
-          + Li2S_obj.density_mole*eps_L_0*H
-              
-    W_S_k = elyte_obj.molecular_weights[i_S8:]
-    m_S_el = inputs.A_cat*eps_el_0*H*np.dot(W_S_k, inputs.C_k_el_0[i_S8:])
-    
-    oneC = (2*eps_el_0*np.dot(n_S_atoms, inputs.C_k_el_0[i_S8:]) + \
-           16*(eps_S_0)*sulfur_obj.density_mole)*H*F/3600
-#    oneC_alt = eps_S_0*H*sulfur_obj.density_mass*1675
-    
-    def get_i_ext():
-        return cathode.i_ext
+def node_spacing(H, npoints, stretch=1., dy=None):
+    """Thickness of each of npoints nodes across a layer of thickness H [m].
+    Nodes are equal for stretch = 1, otherwise each is stretch times as thick 
+    as the one before it. dy gives relative thicknesses directly."""
+    if dy is not None:
+        dy = np.asarray(dy, dtype=float)
+        if dy.size != npoints:
+            raise ValueError(str(dy.size) + ' node thicknesses for ' 
+                             + str(npoints) + ' nodes')
+    else:
+        dy = float(stretch)**np.arange(0, npoints)
+    
+    return H*dy/dy.sum()
+
+"============================================================================="
+
+def cathode_config(inputs):
+    """Cathode geometry, pointers and parameters built from inputs."""
     
-    def set_i_ext(value):
-        cathode.i_ext = value
+    class cathode():
+        # Set a flag to let the solver know whether to implement this class
+        flag = inputs.flag_cathode
+        F = ct.faraday
+        
+        # Number of nodes in the y-direction
+        npoints = inputs.npoints_cathode
+        
+        # Number of shells in the cathode particle
+    #        nshells = inputs.nshells_cathode
+        
+        # Number of state variables per node
+        nVars = 2 + elyte_obj.n_species + 4
+        
+        # Pointers
+        ptr = {}
+        ptr['iFar'] = elyte_obj.species_index(inputs.Li_species_elyte)
+        
+        ptr['eps_S8'] = 0
+        ptr['eps_Li2S'] = 1
+        ptr['rho_k_el'] = 2 + np.arange(0, elyte_obj.n_species)
+        ptr['phi_dl'] = ptr['rho_k_el'][-1] + 1
+        ptr['phi_ed'] = ptr['rho_k_el'][-1] + 2
+        ptr['np_S8'] = ptr['rho_k_el'][-1] + 3
+        ptr['np_Li2S'] = ptr['rho_k_el'][-1] + 4
+        
+        nSV = npoints*nVars
+        offsets = np.arange(0, int(nSV), int(nVars))
+        
+        ptr_vec = {}
+        ptr_vec['eps_S8']   = ptr['eps_S8']   + offsets
+        ptr_vec['eps_Li2S'] = ptr['eps_Li2S'] + offsets
+        ptr_vec['rho_k_el'] = ptr['rho_k_el']
+        for i in offsets[1:]:
+            ptr_vec['rho_k_el'] = np.hstack((ptr_vec['rho_k_el'],i+ptr['rho_k_el']))
+        ptr_vec['phi_dl']  = ptr['phi_dl'] + offsets
+        ptr_vec['phi_ed']  = ptr['phi_ed']   + offsets
+        ptr_vec['np_S8']   = ptr['np_S8']   + offsets
+        ptr_vec['np_Li2S'] = ptr['np_Li2S'] + offsets
+        
+        # Store parameters as class attributes
+        T = inputs.T
+        C_dl = inputs.C_dl_cat
+        
+        # Geometric parameters
+        tau = inputs.tau_cat
+        r_p = inputs.r_p_cat
+        d_p = inputs.d_p_cat
+        dyInv = npoints/inputs.H_cat
+        dy = inputs.H_cat/npoints
+        H = inputs.H_cat
+        
+        # Thickness of each node and inverse distance between the centres of
+        #   neighbouring nodes, for uniform or stretched meshes [m], [1/m]
+        dy_vec = node_spacing(H, npoints, inputs.cathode_stretch, inputs.cathode_dy)
+        dyInv_vec = 1/dy_vec
+        dyInv_face = 1/(0.5*(dy_vec[:-1] + dy_vec[1:]))
+        V_0 = inputs.H_cat*inputs.A_cat
+        
+        
+        if inputs.sulfur_method == 'bulk':
+            m_S = inputs.m_S_0/inputs.A_cat
+            m_S_0 = inputs.m_S_0
+        elif inputs.sulfur_method == 'loading':
+            m_S = inputs.m_S_0
+            m_S_0 = inputs.m_S_0*inputs.A_cat
             
-    # Calculate the actual current density. 
-#    if inputs.flag_cathode == 1:
-    i_ext_amp = -inputs.C_rate*oneC
-    
-    sigma_eff = inputs.sigma_cat*eps_C_0/tau**3
-    
-#    u_Li_el = inputs.D_Li_el*eps_el_0/tau**3
-    
-#    D_el = inputs.D_Li_el*eps_el_0/tau**3
-    D_el = inputs.D_Li_el  #/tau**3
-    
-    def get_tflag():
-        return cathode.t_flag
-    
-    def set_tflag(value):
-        cathode.t_flag = value
-    
-"============================================================================="        
+            
+        omega_S = inputs.pct_w_S8_0/inputs.A_cat
+        omega_C = inputs.pct_w_C_0/inputs.A_cat
+        rho_S = sulfur_obj.density_mass
+        rho_C = carbon_obj.density_mass
+        m_solid = m_S/omega_S
         
-class sep():
-    # Set a flag to let the solver know whether to implement this class
-    flag = inputs.flag_sep
-    
-    # Number of nodes in the y-direction
-    npoints = inputs.npoints_sep
-    
-    # Number of variables per node
-    nVars = 1 + elyte_obj.n_species
-    
-    H = inputs.H_elyte  # Separator thickness [m]
-    
-    tau = inputs.tau_sep  # Tortuosity of separator
-    
-    # Geometric parameters
-    epsilon = inputs.epsilon_sep  # Volume fraction of separator material [-]
-    epsilon_el = 1 - epsilon      # Volume fraction of electrolyte [-]
-    dyInv = npoints/H             # Inverse of y-direction discretization [1/m]
-    dy = H/npoints
-    
-    # Mobility of electrolyte species
-    u_Li_el = inputs.D_Li_el*epsilon_el/ct.gas_constant/inputs.T/tau**3
-    
-    ptr = {}
-    ptr['rho_k_el'] = np.arange(0, elyte_obj.n_species)
-    ptr['phi'] = elyte_obj.n_species
-    
-    ptr_vec = {}
-    ptr_vec['rho_k_el'] = cathode.nSV + ptr['rho_k_el']
-    ptr_vec['phi'] = cathode.nSV + ptr['phi']
-    
-    for i in np.arange(1, npoints):
-        ptr_vec['rho_k_el'] = np.append(ptr_vec['rho_k_el'], 
-                                      cathode.nSV + ptr['rho_k_el'] + i*nVars)
-        ptr_vec['phi'] = np.append(ptr_vec['phi'], 
-                                   cathode.nSV + ptr['phi'] + i*nVars)
-        
-    # Set the length of the solution vector for the separator
-    nSV = npoints*nVars
-    
-    D_el = inputs.D_Li_el*epsilon_el**(1.)/tau**3
-    
-    offsets = np.arange(int(cathode.nSV), int(cathode.nSV) + int(nSV), int(nVars))
-    
-    n_S_0 = epsilon_el*H*np.dot(cathode.n_S_atoms, inputs.C_k_el_0[cathode.i_S8:])
-    
+        eps_S_0 = m_S/rho_S/H
+        eps_C_0 = m_solid*omega_C/rho_C/H
+        eps_L_0 = 1e-10; 
+        
+        A_S_0 = (3*eps_S_0)/((3*eps_S_0*V_0)/(2*pi*inputs.np_S8_init))**(1/3)
+        A_L_0 = (3*eps_L_0)/(3*eps_L_0*V_0/2/inputs.np_Li2S_init/pi)**(1/3)
+        
+        eps_el_0 = 1 - eps_S_0 - eps_C_0 - eps_L_0
+        eps_pore = 1 - eps_C_0
+        print(eps_el_0/eps_S_0)
+        
+        r_C = 3*eps_C_0/inputs.A_C_0
+        
+        i_S8 = elyte_obj.species_index(inputs.Max_sulfide)
+        n_S_atoms = np.zeros([len(elyte_obj.species_names[i_S8:])])    
+        for i, species in enumerate(elyte_obj.species_names[i_S8:]):
+            n_S_atoms[i] = elyte_obj.n_atoms(species, 'S')  
+            
+        n_S_0 = eps_el_0*H*np.dot(n_S_atoms, inputs.C_k_el_0[i_S8:]) \
+              + 8*sulfur_obj.density_mole*eps_S_0*H \
+              + Li2S_obj.density_mole*eps_L_0*H
+                  
+        W_S_k = elyte_obj.molecular_weights[i_S8:]
+        m_S_el = inputs.A_cat*eps_el_0*H*np.dot(W_S_k, inputs.C_k_el_0[i_S8:])
+        
+        oneC = (2*eps_el_0*np.dot(n_S_atoms, inputs.C_k_el_0[i_S8:]) + \
+               16*(eps_S_0)*sulfur_obj.density_mole)*H*F/3600
+    #    oneC_alt = eps_S_0*H*sulfur_obj.density_mass*1675
+        
+        def get_i_ext():
+            return cathode.i_ext
+        
+        def set_i_ext(value):
+            cathode.i_ext = value
+                
+        # Calculate the actual current density. 
+    #    if inputs.flag_cathode == 1:
+        i_ext_amp = -inputs.C_rate*oneC
+        
+        # Cell voltage held by a constant voltage step, None for a set current.
+        #   The current then follows a stiff potentiostat with gain G_hold,
+        #   1C of current per mV of error [A/m^2/V]
+        V_hold = None
+        G_hold = oneC/1e-3
+        
+        def set_v_hold(value):
+            cathode.V_hold = value
+        
+        sigma_eff = inputs.sigma_cat*eps_C_0/tau**3
+        
+    #    u_Li_el = inputs.D_Li_el*eps_el_0/tau**3
+        
+    #    D_el = inputs.D_Li_el*eps_el_0/tau**3
+        D_el = inputs.D_Li_el  #/tau**3
+        
+        def get_tflag():
+            return cathode.t_flag
+        
+        def set_tflag(value):
+            cathode.t_flag = value
+        
+    return cathode
+
 "============================================================================="
 
-class anode():
-    flag = inputs.flag_anode
-    
-    npoints = inputs.npoints_anode
-#    
-#    nshells = inputs.nshells_anode
-    
-    nVars = 2 + elyte_obj.n_species
-    
-    # Pointers
-    ptr = {}
-    ptr['iFar'] = elyte_obj.species_index(inputs.Li_species_elyte)
-    
-    ptr['rho_k_el'] = np.arange(0, elyte_obj.n_species)
-    ptr['phi_dl'] = ptr['rho_k_el'][-1] + 1
-    ptr['phi_ed'] = ptr['rho_k_el'][-1] + 2
-    
-    ptr_vec = {}
-    ptr_vec['rho_k_el'] = cathode.nSV + sep.nSV + ptr['rho_k_el']
-    
-    for i in np.arange(1, npoints):
-        ptr_vec['rho_k_el'] = np.append(ptr_vec['rho_k_el'],
-                                       cathode.nSV + sep.nSV + ptr['rho_k_el'] + i*nVars)
-    
-    # Set length of solution vector for anode
-    nSV = npoints*nVars
-    offsets = np.arange(int(cathode.nSV + sep.nSV), 
-                        int(cathode.nSV + sep.nSV) + int(nSV), int(nVars))
-    
-    # Geometric parameters
-    eps_el = 1 - inputs.epsilon_an
-    tau = inputs.tau_an
-    r_p = inputs.r_p_cat
-    dyInv = npoints/inputs.H_an
-    dy = inputs.H_an/npoints
-    H = inputs.H_an
-    
-    C_dl = inputs.C_dl_an
-    A_Li = 1e3
-    sigma_eff = inputs.sigma_an*inputs.epsilon_an/tau**3
-    
-    u_Li_el = inputs.D_Li_el*eps_el/tau**3
-    
-    D_el = inputs.D_Li_el*eps_el**(1.)/tau**3
-    
-    n_S_0 = eps_el*H*np.dot(cathode.n_S_atoms, inputs.C_k_el_0[cathode.i_S8:])
-    
-    print(cathode.n_S_0 + sep.n_S_0 + n_S_0)
+def sep_config(inputs, cathode):
+    """Separator geometry, pointers and parameters built from inputs."""
     
+    class sep():
+        # Set a flag to let the solver know whether to implement this class
+        flag = inputs.flag_sep
+        
+        # Number of nodes in the y-direction
+        npoints = inputs.npoints_sep
+        
+        # Number of variables per node
+        nVars = 1 + elyte_obj.n_species
+        
+        H = inputs.H_elyte  # Separator thickness [m]
+        
+        tau = inputs.tau_sep  # Tortuosity of separator
+        
+        # Geometric parameters
+        epsilon = inputs.epsilon_sep  # Volume fraction of separator material [-]
+        epsilon_el = 1 - epsilon      # Volume fraction of electrolyte [-]
+        dyInv = npoints/H             # Inverse of y-direction discretization [1/m]
+        dy = H/npoints
+        
+        # Mobility of electrolyte species
+        u_Li_el = inputs.D_Li_el*epsilon_el/ct.gas_constant/inputs.T/tau**3
+        
+        ptr = {}
+        ptr['rho_k_el'] = np.arange(0, elyte_obj.n_species)
+        ptr['phi'] = elyte_obj.n_species
+        
+        ptr_vec = {}
+        ptr_vec['rho_k_el'] = cathode.nSV + ptr['rho_k_el']
+        ptr_vec['phi'] = cathode.nSV + ptr['phi']
+        
+        for i in np.arange(1, npoints):
+            ptr_vec['rho_k_el'] = np.append(ptr_vec['rho_k_el'], 
+                                          cathode.nSV + ptr['rho_k_el'] + i*nVars)
+            ptr_vec['phi'] = np.append(ptr_vec['phi'], 
+                                       cathode.nSV + ptr['phi'] + i*nVars)
+            
+        # Set the length of the solution vector for the separator
+        nSV = npoints*nVars
+        
+        D_el = inputs.D_Li_el*epsilon_el**(1.)/tau**3
+        
+        offsets = np.arange(int(cathode.nSV), int(cathode.nSV) + int(nSV), int(nVars))
+        
+        n_S_0 = epsilon_el*H*np.dot(cathode.n_S_atoms, inputs.C_k_el_0[cathode.i_S8:])
+        
+    return sep
+
 "============================================================================="
 
-class sol_init():
-    
-    # Initialize solution vector 
-    SV_0 = np.zeros([anode.nSV + sep.nSV + cathode.nSV])
+def anode_config(inputs, cathode, sep):
+    """Anode geometry, pointers and parameters built from inputs."""
     
-    # Set up algebraic variable vector
-    algvar = np.zeros_like(SV_0)
-     
-    # Cathode
-    offsets = cathode.offsets
-    ptr = cathode.ptr
-    for j in np.arange(0, cathode.npoints):
-        
-        SV_0[offsets[j] + ptr['eps_S8']] = cathode.eps_S_0
-        algvar[offsets[j] + ptr['eps_S8']] = 1
-        
-        SV_0[offsets[j] + ptr['eps_Li2S']] = cathode.eps_L_0
-        algvar[offsets[j] + ptr['eps_Li2S']] = 1
-        
-        SV_0[offsets[j] + ptr['rho_k_el']] = inputs.C_k_el_0
-        algvar[offsets[j] + ptr['rho_k_el']] = 1
-        
-        SV_0[offsets[j]+ptr['phi_dl']] = inputs.Cell_voltage - inputs.Phi_el_init
-        algvar[offsets[j] + ptr['phi_dl']] = 1
-                                           
-        SV_0[offsets[j]+ptr['phi_ed']] = inputs.Cell_voltage
-#        algvar[offsets[j] + ptr['phi_ed']] = 1
-        
-        SV_0[offsets[j]+ptr['np_S8']]=inputs.np_S8_init
-        algvar[offsets[j] + ptr['np_S8']] = 1
-        
-        SV_0[offsets[j]+ptr['np_Li2S']] = inputs.np_Li2S_init
-        algvar[offsets[j] + ptr['np_Li2S']] = 1
-     
-    # Separator
-    offsets = sep.offsets
-    ptr = sep.ptr
-    for j in np.arange(0, sep.npoints):
-        
-        SV_0[offsets[j] + ptr['rho_k_el']] = inputs.C_k_el_0
-        algvar[offsets[j] + ptr['rho_k_el']] = 1
-        
-        SV_0[offsets[j] + ptr['phi']] = inputs.Phi_el_init
-     
-    # Anode
-    offsets = anode.offsets
-    ptr = anode.ptr
-    for j in np.arange(0, anode.npoints):
-        SV_0[offsets[j] + ptr['rho_k_el']] = inputs.C_k_el_0
-        algvar[offsets[j] + ptr['rho_k_el']] = 1
-        
-        SV_0[offsets[j] + ptr['phi_dl']] = inputs.Phi_an_init - inputs.Phi_el_init
-        algvar[offsets[j] + ptr['phi_dl']] = 1
-        
-        SV_0[offsets[j] + ptr['phi_ed']] = inputs.Phi_an_init
+    class anode():
+        flag = inputs.flag_anode
+        
+        npoints = inputs.npoints_anode
+    #    
+    #    nshells = inputs.nshells_anode
+        
+        nVars = 2 + elyte_obj.n_species
+        
+        # Pointers
+        ptr = {}
+        ptr['iFar'] = elyte_obj.species_index(inputs.Li_species_elyte)
+        
+        ptr['rho_k_el'] = np.arange(0, elyte_obj.n_species)
+        ptr['phi_dl'] = ptr['rho_k_el'][-1] + 1
+        ptr['phi_ed'] = ptr['rho_k_el'][-1] + 2
         
+        ptr_vec = {}
+        ptr_vec['rho_k_el'] = cathode.nSV + sep.nSV + ptr['rho_k_el']
+        
+        for i in np.arange(1, npoints):
+            ptr_vec['rho_k_el'] = np.append(ptr_vec['rho_k_el'],
+                                           cathode.nSV + sep.nSV + ptr['rho_k_el'] + i*nVars)
+        
+        # Set length of solution vector for anode
+        nSV = npoints*nVars
+        offsets = np.arange(int(cathode.nSV + sep.nSV), 
+                            int(cathode.nSV + sep.nSV) + int(nSV), int(nVars))
+        
+        # Geometric parameters
+        eps_el = 1 - inputs.epsilon_an
+        tau = inputs.tau_an
+        r_p = inputs.r_p_cat
+        dyInv = npoints/inputs.H_an
+        dy = inputs.H_an/npoints
+        H = inputs.H_an
+        
+        C_dl = inputs.C_dl_an
+        A_Li = 1e3
+        sigma_eff = inputs.sigma_an*inputs.epsilon_an/tau**3
+        
+        u_Li_el = inputs.D_Li_el*eps_el/tau**3
+        
+        D_el = inputs.D_Li_el*eps_el**(1.)/tau**3
+        
+        n_S_0 = eps_el*H*np.dot(cathode.n_S_atoms, inputs.C_k_el_0[cathode.i_S8:])
+        
+        print(cathode.n_S_0 + sep.n_S_0 + n_S_0)
+        
+    return anode
+
+"============================================================================="
+
+def sol_init_config(inputs, cathode, sep, anode):
+    """Initial solution vector and algebraic variable flags of a cell."""
     
-                                           
+    class sol_init():
+        
+        # Initialize solution vector 
+        SV_0 = np.zeros([anode.nSV + sep.nSV + cathode.nSV])
+        
+        # Set up algebraic variable vector
+        algvar = np.zeros_like(SV_0)
+         
+        # Cathode
+        offsets = cathode.offsets
+        ptr = cathode.ptr
+        for j in np.arange(0, cathode.npoints):
+            
+            SV_0[offsets[j] + ptr['eps_S8']] = cathode.eps_S_0
+            algvar[offsets[j] + ptr['eps_S8']] = 1
+            
+            SV_0[offsets[j] + ptr['eps_Li2S']] = cathode.eps_L_0
+            algvar[offsets[j] + ptr['eps_Li2S']] = 1
+            
+            SV_0[offsets[j] + ptr['rho_k_el']] = inputs.C_k_el_0
+            algvar[offsets[j] + ptr['rho_k_el']] = 1
+            
+            SV_0[offsets[j]+ptr['phi_dl']] = inputs.Cell_voltage - inputs.Phi_el_init
+            algvar[offsets[j] + ptr['phi_dl']] = 1
+                                               
+            SV_0[offsets[j]+ptr['phi_ed']] = inputs.Cell_voltage
+    #        algvar[offsets[j] + ptr['phi_ed']] = 1
+            
+            SV_0[offsets[j]+ptr['np_S8']]=inputs.np_S8_init
+            algvar[offsets[j] + ptr['np_S8']] = 1
+            
+            SV_0[offsets[j]+ptr['np_Li2S']] = inputs.np_Li2S_init
+            algvar[offsets[j] + ptr['np_Li2S']] = 1
+         
+        # Separator
+        offsets = sep.offsets
+        ptr = sep.ptr
+        for j in np.arange(0, sep.npoints):
+            
+            SV_0[offsets[j] + ptr['rho_k_el']] = inputs.C_k_el_0
+            algvar[offsets[j] + ptr['rho_k_el']] = 1
+            
+            SV_0[offsets[j] + ptr['phi']] = inputs.Phi_el_init
+         
+        # Anode
+        offsets = anode.offsets
+        ptr = anode.ptr
+        for j in np.arange(0, anode.npoints):
+            SV_0[offsets[j] + ptr['rho_k_el']] = inputs.C_k_el_0
+            algvar[offsets[j] + ptr['rho_k_el']] = 1
+            
+            SV_0[offsets[j] + ptr['phi_dl']] = inputs.Phi_an_init - inputs.Phi_el_init
+            algvar[offsets[j] + ptr['phi_dl']] = 1
+            
+            SV_0[offsets[j] + ptr['phi_ed']] = inputs.Phi_an_init
+        
+    return sol_init
+
+"============================================================================="
+
+def faces_config(cathode, sep, anode):
+    """Geometry of the faces between consecutive nodes of the cathode -> 
+    separator -> anode chain, for the batched flux kernel dst_faces. Face f 
+    lies between nodes f and f+1 of the chain. The first cathode.npoints faces
+    (cathode interior and cathode/separator) use the cathode bulk diffusion
+    coefficients, scaled by the local electrolyte volume fraction at run 
+    time, the others the effective coefficients of their component."""
+    
+    class faces():
+        
+        n = cathode.npoints + sep.npoints + anode.npoints - 1
+        n_cat = cathode.npoints
+        
+        # Inverse distance between the node centres on either side [1/m]
+        dyInv = np.hstack((cathode.dyInv_face,
+                           1/(0.5*(cathode.dy_vec[-1] + sep.dy)),
+                           np.full([sep.npoints - 1], sep.dyInv),
+                           1/(0.5*(sep.dy + anode.dy)),
+                           np.full([anode.npoints - 1], anode.dyInv)))
+        
+        # Diffusion coefficients of each face [m^2/s]
+        D_el = np.vstack((np.tile(cathode.D_el, (cathode.npoints, 1)),
+                          np.tile(sep.D_el, (sep.npoints, 1)),
+                          np.tile(anode.D_el, (anode.npoints - 1, 1))))
+        
+    return faces
+
+"============================================================================="
+
+class CellConfig():
+    """One cell design. Keyword arguments override attributes of inputs for
+    this cell only, e.g. CellConfig(C_rate=0.1, npoints_cathode=10), and the
+    cathode, sep, anode and sol_init objects are built from them. Cells are
+    independent of each other, including their external current, and share 
+    the Cantera objects and kinetics kernel of this module. Derived inputs 
+    (n_comps, npoints_* from the component flags, plotting flags) are not 
+    recomputed from overrides."""
+    
+    # Inputs tied to the module level Cantera objects, kinetics kernel and 
+    #   transport functions, which cannot differ between cells
+    shared = ['ctifile', 'cat_phase1', 'cat_phase2', 'cat_phase3', 'metal_phase',
+              'elyte_phase', 'an_phase', 'sulfur_elyte_phase', 'graphite_elyte_phase',
+              'Li2S_elyte_phase', 'tpb_phase', 'anode_elyte_phase', 
+              'Li_species_elyte', 'Max_sulfide', 'flag_kin_kernel', 'T', 'z_k_el']
+    
+    def __init__(self, **overrides):
+        for key in overrides:
+            if key in CellConfig.shared:
+                raise ValueError(key + ' is shared by all cells, set it in inputs')
+            if not hasattr(inputs, key):
+                raise AttributeError('inputs has no attribute ' + key)
+                
+        self.overrides = overrides
+        self.inputs = type('inputs', (inputs,), overrides)
+        self.cathode = cathode_config(self.inputs)
+        self.sep = sep_config(self.inputs, self.cathode)
+        self.anode = anode_config(self.inputs, self.cathode, self.sep)
+        self.sol_init = sol_init_config(self.inputs, self.cathode, self.sep, self.anode)
+        self.layout = layout_config(self.cathode, self.sep, self.anode,
+                                    elyte_obj.species_names)
+        self.faces = faces_config(self.cathode, self.sep, self.anode)
+        
+    def __repr__(self):
+        return ('CellConfig(' + ', '.join(k + '=' + repr(v) 
+                for k, v in self.overrides.items()) + ')')
+    
+# Default cell from inputs, used by code that works with a single design
+cell = CellConfig()
+cathode = cell.cathode
+sep = cell.sep
+anode = cell.anode
+sol_init = cell.sol_init
+layout = cell.layout
+
 "============================================================================="
 
 print("Initialization check")
\ No newline at end of file
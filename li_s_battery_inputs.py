@@ -31,6 +31,23 @@ class inputs():
     npoints_sep = 1*flag_sep
     npoints_cathode = 1*flag_cathode
     
+    # Cathode node spacing. With cathode_stretch = 1 the nodes are of equal
+    #   thickness, below 1 each node is cathode_stretch times as thick as the
+    #   one before it, which refines the mesh toward the separator. 
+    #   cathode_dy lists relative node thicknesses instead (scaled to H_cat),
+    #   as set by the adaptive mesh of li_s_battery_mesh.py
+    cathode_stretch = 1.
+    cathode_dy = None
+    
+    # Adaptive cathode mesh (li_s_battery_mesh.run_adaptive). Between cycles,
+    #   nodes are split where the jump of the solution to a neighbour is 
+    #   above mesh_tol, relative to the range of that variable, and merged
+    #   where it is below mesh_tol/4, keeping npoints_cathode_min to 
+    #   npoints_cathode_max nodes
+    mesh_tol = 0.05
+    npoints_cathode_min = 1
+    npoints_cathode_max = 100
+    
     # Set number of discretized shells in each particle
 #    nshells_anode = 5*flag_anode
     
@@ -58,6 +75,79 @@ class inputs():
     #       test_type = is_cycling
     test_type = 'cc_cycling'
     
+    # Set the form of the residual function used by the solver. To evaluate
+    #   all cathode nodes at once with array operations set to 1, to use the
+    #   node-by-node loop set to 0. The loop only handles cells with one node
+    #   in each of the cathode, separator and anode, so meshed cells need 1.
+    #   The vectorized residual is opt-in until it has been checked against
+    #   the golden references (li_s_battery_golden.py)
+    flag_res_vec = 0
+    
+    # To give the solver the analytic Jacobian (cc_cycling.jac) set to 1, to
+    #   build it by finite differences on a coloured node-coupling graph set
+    #   to 2, to let IDA build it by dense finite differences set to 0. The
+    #   analytic and coloured Jacobians are opt-in until jac_check and the 
+    #   golden references (li_s_battery_golden.py) have been run with them
+    flag_jac = 0
+    
+    # To compare the analytic and coloured Jacobians against dense finite 
+    #   differences before equilibrating set to 1, which on 1-node cells also
+    #   compares the loop and vectorized residuals. Only for small meshes
+    flag_jac_check = 0
+    
+    # Linear solver used in the Newton iterations of IDA. 'DENSE' factors the
+    #   full Jacobian, 'SPGMR' is an iterative solver that only needs products
+    #   with the sparse Jacobian. 'AUTO' picks between them from the Jacobian
+    #   bandwidth - SPGMR once the cathode is meshed with many nodes. SPGMR 
+    #   runs without a preconditioner on rows of very different scales and
+    #   has not been validated against dense runs of the meshed cells 
+    #   (li_s_battery_golden.py), so 'SPGMR' and 'AUTO' are opt-in
+    linear_solver = 'DENSE'
+    
+    # Interface kinetics in the residual. To call Cantera at every node set to
+    #   0, to use the NumPy kernel generated from the CTI file by 
+    #   li_s_battery_kinetics.py set to 1, to compile that kernel with numba
+    #   set to 2. The kernel is checked against Cantera before equilibrating
+    flag_kin_kernel = 0
+    
+    # To reuse equilibrated states from earlier runs with identical inputs,
+    #   CTI file and mesh set to 1. States are kept in cache_dir under the
+    #   working directory, which is held under cache_size [bytes] by removing
+    #   the least recently used. Running li_s_battery_model.py with --cache 
+    #   or --no-cache turns it on or off for that run
+    flag_eq_cache = 0
+    cache_dir = '.li_s_cache'
+    cache_size = 200e6
+    
+    # To equilibrate by integrating the cell at zero current for 3600/C_rate
+    #   seconds set to 0, to solve for the zero current steady state directly
+    #   by pseudo-transient continuation set to 1
+    flag_eq_steady = 0
+    
+    # To end the time integrated equilibration once the cell has settled set
+    #   to 1. It stops when the norm of the differential rates SV_dot, weighted
+    #   by the solver tolerances, stays under eq_steady_tol [1/s] for
+    #   eq_steady_window [s]
+    flag_eq_event = 0
+    eq_steady_tol = 1e-6
+    eq_steady_window = 600.
+    
+    # To write checkpoints of the equilibration and discharge in main() set 
+    #   to 1. The latest is kept in checkpoint_file, rewritten every 
+    #   checkpoint_wall [s] of wall time and at the end of each stage. Run
+    #   li_s_battery_model.py --resume to continue from it
+    flag_checkpoint = 0
+    checkpoint_file = 'li_s_checkpoint.npz'
+    checkpoint_wall = 600.
+    
+    # To profile main() and run_protocol set to 1: residual and Jacobian 
+    #   calls, IDA statistics and the time in the solver, kinetics, dst and
+    #   Python bookkeeping (li_s_battery_profile.py). The record is written 
+    #   to profile_file, as CSV if it ends in .csv and JSON otherwise. dst
+    #   is only timed when this is set here, not as a cell override
+    flag_profile = 0
+    profile_file = 'li_s_profile.json'
+    
     # Set temperature for isothermal testing
     T = 298.15  # [K]
     
@@ -88,7 +178,7 @@ class inputs():
     Phi_an_init = 0.0
     Phi_el_init = 1.0
     Cell_voltage = 2.3
-
+    
     # Cutoff values for charging and discharging of electrodes:
     Li_an_min = 0.01; Li_an_max = 1 - Li_an_min
     Li_cat_min = 0.01; Li_cat_max = 1 - Li_cat_min
@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""
+Code generator for the interface kinetics in the CTI file. The surface
+reactions of each interface are read from the CTI file and written out as a
+NumPy kernel that returns the net production rates of every phase at that
+interface for all nodes at once, from the electrolyte mole fractions and the
+electrolyte and electron potentials. This replaces the per-node Cantera calls
+(elyte.X = ..., get_net_production_rates) in the residual.
+
+The kernels follow Cantera's InterfaceKinetics for phases whose activity
+concentrations are dimensionless (metal phases and IdealSolidSolution with
+standard_concentration = "unity", as in sulfur_cathode_prelim.cti):
+
+    rop = k_f*exp(-beta*dE)*prod(X_r**nu_r) - k_r*exp((1 - beta)*dE)*prod(X_p**nu_p)
+
+with k_f the Arrhenius rate, k_r = k_f*exp(dG0/RT) and dE = sum(nu*z*phi)*F/RT.
+check_kernel compares a kernel with Cantera and is expected to agree to a
+relative tolerance of 1e-8 of the largest rate at each interface.
+
+The kernel for inputs.ctifile can be written to disk with
+    python li_s_battery_kinetics.py [ctifile] [outfile]
+"""
+
+import numpy as np
+import os
+import sys
+import types
+from fnmatch import fnmatch
+
+# Unit conversions to Cantera's SI units (kmol, m, s, J)
+_length = {'cm': 0.01, 'm': 1., 'mm': 0.001}
+_quantity = {'mol': 1e-3, 'kmol': 1., 'molec': 1e-3/6.02214076e23}
+_energy = {'J/mol': 1e3, 'kJ/mol': 1e6, 'cal/mol': 4184., 'kcal/mol': 4.184e6,
+           'J/kmol': 1., 'kJ/kmol': 1e3}
+_entropy = {'J/mol/K': 1e3, 'J/kmol/K': 1., 'cal/mol/K': 4184.}
+
+# Physical constants are taken from Cantera so the kernel reproduces its
+#   equilibrium constants exactly, CODATA 2018 values otherwise
+try:
+    from cantera import faraday as F, gas_constant as R
+except ImportError:
+    F = 96485332.12331001       # [C/kmol]
+    R = 8314.46261815324        # [J/kmol/K]
+
+"============================================================================="
+
+class _phase():
+    def __init__(self, kind, name, species='', reactions='none', phases='',
+                 standard_concentration=None, **kwargs):
+        self.kind = kind
+        self.name = name
+        self.species = species.split()
+        self.reactions = reactions.split()
+        self.phases = phases.split()
+        self.standard_concentration = standard_concentration
+    
+    def conc_dim(self):
+        # (quantity, length) dimensions of the activity concentrations, as
+        #   used by Cantera to set the units of the rate coefficients
+        if self.kind == 'metal':
+            return (0, 0)
+        elif self.kind == 'IdealSolidSolution' and self.standard_concentration == 'unity':
+            return (0, 0)
+        elif self.kind in ('ideal_interface', 'edge'):
+            return (1, -2)
+        else:
+            return (1, -3)
+
+"============================================================================="
+
+def read_cti(ctifile):
+    """Read the phases, species thermo and surface reactions from a CTI file.
+    CTI files are Python, so the file is executed with stand-ins for the CTI
+    functions that only record their arguments."""
+    cti = {'units': {'length': 'cm', 'quantity': 'mol', 'act_energy': 'J/mol'},
+           'phases': {}, 'species': {}, 'reactions': []}
+    
+    def units(**kwargs):
+        cti['units'].update(kwargs)
+    
+    def phase_fun(kind):
+        def add_phase(name, **kwargs):
+            cti['phases'][name] = _phase(kind, name, **kwargs)
+        return add_phase
+    
+    def species(name, atoms='', thermo=None, **kwargs):
+        elements = dict((a.split(':')[0], float(a.split(':')[1]))
+                        for a in atoms.split())
+        cti['species'][name] = {'charge': -elements.get('E', 0.), 'thermo': thermo}
+    
+    def const_cp(t0=298.15, h0=0., s0=0., cp0=0.):
+        def value(x, table, default):
+            return x[0]*table[x[1]] if isinstance(x, tuple) else x*table[default]
+        return {'t0': t0, 'h0': value(h0, _energy, 'J/mol'),
+                's0': value(s0, _entropy, 'J/mol/K'), 'cp0': value(cp0, _entropy, 'J/mol/K')}
+    
+    def surface_reaction(equation, kf, id='', beta=None, **kwargs):
+        cti['reactions'].append({'equation': equation, 'kf': kf, 'id': id,
+                                 'beta': beta})
+    
+    def recorder(*args, **kwargs):
+        return None
+    
+    namespace = {'units': units, 'species': species, 'const_cp': const_cp,
+                 'surface_reaction': surface_reaction, 'edge_reaction': surface_reaction,
+                 'state': recorder, 'constantIncompressible': recorder}
+    for kind in ('metal', 'IdealSolidSolution', 'ideal_interface', 'edge'):
+        namespace[kind] = phase_fun(kind)
+    
+    with open(ctifile) as f:
+        exec(compile(f.read(), ctifile, 'exec'), namespace)
+    
+    return cti
+
+"============================================================================="
+
+def parse_equation(equation):
+    """Split a reaction equation into reactant and product stoichiometry."""
+    for arrow in ('<=>', '=>', '='):
+        if arrow in equation:
+            sides = equation.split(arrow)
+            break
+    
+    stoich = []
+    for side in sides:
+        terms = {}
+        for term in side.split(' + '):
+            parts = term.split()
+            if len(parts) == 2:
+                terms[parts[1]] = terms.get(parts[1], 0.) + float(parts[0])
+            else:
+                terms[parts[0]] = terms.get(parts[0], 0.) + 1.
+        stoich.append(terms)
+    
+    return stoich[0], stoich[1]
+
+"============================================================================="
+
+def interface_reactions(cti, interface):
+    """Surface reactions of one interface with their stoichiometry, phases
+    and rate coefficients converted to SI units."""
+    surf = cti['phases'][interface]
+    phases = [cti['phases'][p] for p in surf.phases]
+    
+    def phase_of(species):
+        for ph in phases:
+            if species in ph.species:
+                return ph
+        raise ValueError('Species ' + species + ' not found on ' + interface)
+    
+    L = _length[cti['units']['length']]
+    Q = _quantity[cti['units']['quantity']]
+    E_act = _energy[cti['units'].get('act_energy', 'J/mol')]
+    
+    reactions = []
+    for rxn in cti['reactions']:
+        if not any(fnmatch(rxn['id'], pattern) for pattern in surf.reactions):
+            continue
+        reac, prod = parse_equation(rxn['equation'])
+        
+        # Units of the rate coefficient: rate per area divided by the units of
+        #   the reactant activity concentrations
+        n_Q = 1.; n_L = -2.
+        for sp, nu in reac.items():
+            ph = phase_of(sp)
+            n_Q -= nu*ph.conc_dim()[0]
+            n_L -= nu*ph.conc_dim()[1]
+            if ph.conc_dim() != (0, 0):
+                raise NotImplementedError('Only dimensionless activity '
+                    'concentrations are supported: ' + ph.name)
+        
+        A, b, E = rxn['kf']
+        reactions.append({'id': rxn['id'], 'equation': rxn['equation'],
+                          'reac': reac, 'prod': prod,
+                          'A': A*Q**n_Q*L**n_L, 'b': b, 'E': E*E_act,
+                          'beta': 0.5 if rxn['beta'] is None else rxn['beta']})
+    
+    return reactions, phases
+
+"============================================================================="
+
+def generate_kernel(ctifile, interfaces):
+    """Return the source of a kernel module for the listed interfaces."""
+    cti = read_cti(ctifile)
+    
+    src = ['# -*- coding: utf-8 -*-',
+           '"""',
+           'Interface kinetics kernel generated by li_s_battery_kinetics.py from',
+           os.path.basename(ctifile) + '. Do not edit by hand.',
+           '"""', '',
+           'import numpy as np', '',
+           'F = ' + repr(F),
+           'R = ' + repr(R), '',
+           'INTERFACES = ' + repr(tuple(interfaces)), '',
+           'PHASES = {}', 'ARGS = {}', 'REACTIONS = {}', 'THERMO = {}', 'ARRHENIUS = {}', '']
+    
+    for interface in interfaces:
+        reactions, phases = interface_reactions(cti, interface)
+        
+        # Phases that need mole fractions (multi-species solutions) or carry
+        #   charged species. Pure metals and single species solids have unit
+        #   activity.
+        X_phases = [ph for ph in phases if ph.kind == 'IdealSolidSolution'
+                    and len(ph.species) > 1]
+        phi_phases = [ph for ph in phases
+                      if any(cti['species'][sp]['charge'] != 0 for sp in ph.species)]
+        
+        # Standard state thermo of each reaction: dG0(T) = dH0 + dcp0*(T - t0)
+        #   - T*(dS0 + dcp0*ln(T/t0)), all species share t0 = 298.15 K. Cantera's
+        #   MetalPhase has zero standard chemical potentials whatever the
+        #   species thermo says, so species of metal phases add nothing
+        kind = dict((sp, ph.kind) for ph in phases for sp in ph.species)
+        thermo = []
+        for rxn in reactions:
+            d = np.zeros(3)
+            for sp, nu in list(rxn['prod'].items()) + [(s, -n) for s, n in rxn['reac'].items()]:
+                if kind[sp] == 'metal':
+                    continue
+                th = cti['species'][sp]['thermo']
+                d += nu*np.array([th['h0'], th['s0'], th['cp0']])
+            thermo.append(tuple(d))
+        
+        args = (['X_' + ph.name for ph in X_phases] + ['phi_' + ph.name for ph in phi_phases]
+                + ['k_f', 'k_r', 'FRT'])
+        src += ['PHASES[' + repr(interface) + '] = ' + repr(tuple(ph.name for ph in phases)),
+                'ARGS[' + repr(interface) + '] = ' + repr(tuple(args)),
+                'REACTIONS[' + repr(interface) + '] = ' + repr(tuple(r['id'] for r in reactions)),
+                'THERMO[' + repr(interface) + '] = ' + repr(thermo),
+                'ARRHENIUS[' + repr(interface) + '] = '
+                + repr([(r['A'], r['b'], r['E']) for r in reactions]), '']
+        
+        src += ['def ' + interface + '(' + ', '.join(args) + '):',
+                '    """Net production rates at ' + interface + ' for every node, '
+                'returned in the',
+                '    order of PHASES[' + repr(interface) + ']. Mole fractions are '
+                '(npoints, n_species),',
+                '    potentials are (npoints,). k_f and k_r come from rate_constants."""']
+        
+        if X_phases:
+            npts = 'X_' + X_phases[0].name + '.shape[0]'
+        else:
+            npts = 'phi_' + phi_phases[0].name + '.shape[0]'
+        for ph in X_phases:
+            # Cantera ignores negative mole fractions and normalizes the rest
+            src += ['    X_' + ph.name + ' = np.maximum(X_' + ph.name + ', 0.)',
+                    '    X_' + ph.name + ' = X_' + ph.name + '/X_' + ph.name
+                    + '.sum(axis=1).reshape(-1, 1)']
+        src += ['    rop = np.zeros((' + npts + ', ' + str(len(reactions)) + '))', '']
+        
+        def activity(sp, nu):
+            ph = [p for p in phases if sp in p.species][0]
+            if ph not in X_phases:
+                return None
+            term = 'X_' + ph.name + '[:, ' + str(ph.species.index(sp)) + ']'
+            return term if nu == 1 else term + '**' + repr(nu)
+        
+        for i, rxn in enumerate(reactions):
+            # Change in electrical energy, products minus reactants [F*V]
+            dE = {}
+            for sp, nu in list(rxn['prod'].items()) + [(s, -n) for s, n in rxn['reac'].items()]:
+                ph = [p for p in phases if sp in p.species][0]
+                z = cti['species'][sp]['charge']
+                if z != 0:
+                    dE[ph.name] = dE.get(ph.name, 0.) + nu*z
+            dE = dict((k, v) for k, v in dE.items() if v != 0)
+            
+            fwd = ['k_f[' + str(i) + ']']
+            rev = ['k_r[' + str(i) + ']']
+            if dE:
+                src += ['    # ' + rxn['id'] + ': ' + rxn['equation'],
+                        '    dE = (' + ' + '.join(repr(v) + '*phi_' + k
+                                              for k, v in dE.items()) + ')*FRT']
+                fwd.append('np.exp(' + repr(-rxn['beta']) + '*dE)')
+                rev.append('np.exp(' + repr(1 - rxn['beta']) + '*dE)')
+            else:
+                src += ['    # ' + rxn['id'] + ': ' + rxn['equation']]
+            fwd += [a for a in (activity(s, n) for s, n in rxn['reac'].items()) if a]
+            rev += [a for a in (activity(s, n) for s, n in rxn['prod'].items()) if a]
+            src += ['    rop[:, ' + str(i) + '] = (' + '*'.join(fwd),
+                    '                 - ' + '*'.join(rev) + ')', '']
+        
+        out = []
+        for ph in phases:
+            name = 'sdot_' + ph.name
+            out.append(name)
+            src += ['    ' + name + ' = np.zeros((' + npts + ', '
+                    + str(len(ph.species)) + '))']
+            for k, sp in enumerate(ph.species):
+                terms = []
+                for i, rxn in enumerate(reactions):
+                    nu = rxn['prod'].get(sp, 0.) - rxn['reac'].get(sp, 0.)
+                    if nu != 0:
+                        terms.append((' - ' if nu < 0 else ' + ') + repr(abs(nu))
+                                     + '*rop[:, ' + str(i) + ']')
+                if terms:
+                    expr = ''.join(terms)
+                    expr = expr[3:] if expr[1] == '+' else '-' + expr[3:]
+                    src += ['    ' + name + '[:, ' + str(k) + '] = ' + expr]
+        src += ['', '    return ' + ', '.join(out), '', '']
+    
+    src += ['def standard_gibbs(T):',
+            '    """Standard Gibbs energy change [J/kmol] of every reaction at T."""',
+            '    dG = {}',
+            '    for interface in INTERFACES:',
+            '        dH, dS, dcp = np.array(THERMO[interface]).T',
+            '        dG[interface] = dH + dcp*(T - 298.15) - T*(dS + dcp*np.log(T/298.15))',
+            '        ',
+            '    return dG', '', '',
+            'def rate_constants(T, dG=None):',
+            '    """Forward and reverse rate constants of every interface at T, '
+            'without the',
+            '    potential dependent terms. The reverse constants are k_f/K_c with',
+            '    K_c = exp(-dG/RT)."""',
+            '    if dG is None:',
+            '        dG = standard_gibbs(T)',
+            '    k = {}',
+            '    for interface in INTERFACES:',
+            '        A, b, E = np.array(ARRHENIUS[interface]).T',
+            '        k_f = A*T**b*np.exp(-E/R/T)',
+            '        k[interface] = (k_f, k_f*np.exp(dG[interface]/R/T))',
+            '        ',
+            '    return k', '']
+    
+    return '\n'.join(src)
+
+"============================================================================="
+
+_kernels = {}
+
+def load_kernel(ctifile, interfaces, use_numba=False):
+    """Generate, compile and cache the kernel module for a CTI file. With
+    use_numba the interface functions are compiled with numba.njit when numba
+    is installed."""
+    key = (os.path.abspath(ctifile), os.path.getmtime(ctifile), tuple(interfaces),
+           use_numba)
+    if key not in _kernels:
+        kernel = types.ModuleType('li_s_battery_kernel')
+        exec(compile(generate_kernel(ctifile, interfaces), ctifile + ' kernel', 'exec'),
+             kernel.__dict__)
+        if use_numba:
+            try:
+                import numba
+                for interface in interfaces:
+                    setattr(kernel, interface, numba.njit(getattr(kernel, interface)))
+            except ImportError:
+                print('numba not found, using the NumPy kinetics kernel')
+        _kernels[key] = kernel
+    
+    return _kernels[key]
+
+"============================================================================="
+
+def kernel_rates(kernel, interface, k, FRT, **states):
+    """Call the kernel of one interface. states holds the mole fractions
+    (X_<phase>) and potentials (phi_<phase>) named in kernel.ARGS, k is the
+    output of kernel.rate_constants."""
+    args = [states[name] for name in kernel.ARGS[interface][:-3]]
+    
+    return getattr(kernel, interface)(*(args + list(k[interface]) + [FRT]))
+
+"============================================================================="
+
+class isothermal():
+    # Temperature dependent parts of the kernel kinetics: standard Gibbs
+    #   energies, equilibrium constants and rate constants of each reaction.
+    #   The temperature is fixed for a run so these are computed once, and
+    #   only recomputed when update is called with a different temperature
+    #   or the rate multipliers have changed. kernel is set by li_s_battery_init
+    kernel = None
+    T = None
+    multipliers = {}
+    _multipliers = None
+    
+    def update(T):
+        kernel = isothermal.kernel
+        if T != isothermal.T or isothermal.multipliers != isothermal._multipliers:
+            isothermal.dG = kernel.standard_gibbs(T)
+            isothermal.K_c = dict((surf, np.exp(-dG/kernel.R/T))
+                                  for surf, dG in isothermal.dG.items())
+            isothermal.k = kernel.rate_constants(T, isothermal.dG)
+            for surf, (k_f, k_r) in isothermal.k.items():
+                m = np.array([isothermal.multipliers.get(r, 1.)
+                              for r in kernel.REACTIONS[surf]])
+                isothermal.k[surf] = (k_f*m, k_r*m)
+            isothermal.FRT = kernel.F/kernel.R/T
+            isothermal.T = T
+            isothermal._multipliers = dict(isothermal.multipliers)
+        
+        return isothermal.k, isothermal.FRT
+
+"============================================================================="
+
+def check_kernel(kernel, surfaces, elyte, conductor, X, phi_el, phi_ed, rtol=1e-8, 
+                 k=None):
+    """Compare kernel rates with Cantera for a set of states. surfaces maps
+    each interface name to its Cantera Interface object and the objects of the
+    phases it returns, in the order of kernel.PHASES. Solid phases are held at
+    the electrode potential as in the residual. Returns the largest difference
+    at each interface relative to its largest rate and raises if any exceeds
+    rtol. k are the rate constants of the kernel, those of the CTI file by
+    default; pass the scaled constants when the Cantera interfaces have rate
+    multipliers set."""
+    if k is None:
+        k = kernel.rate_constants(elyte.T)
+    FRT = kernel.F/kernel.R/elyte.T
+    states = {'X_' + elyte.name: X, 'phi_' + elyte.name: phi_el,
+              'phi_' + conductor.name: phi_ed}
+    
+    errors = {}
+    for interface, (surf, phase_objs) in surfaces.items():
+        rates = kernel_rates(kernel, interface, k, FRT, **states)
+        
+        err = 0.
+        for j in np.arange(0, X.shape[0]):
+            elyte.X = X[j]
+            elyte.electric_potential = phi_el[j]
+            for obj in phase_objs:
+                if obj is not elyte:
+                    obj.electric_potential = phi_ed[j]
+            for rate, obj in zip(rates, phase_objs):
+                ref = surf.get_net_production_rates(obj)
+                scale = max(np.max(np.abs(ref)), 1e-300)
+                err = max(err, np.max(np.abs(rate[j] - ref))/scale)
+        errors[interface] = err
+    
+    print('Kinetics kernel vs Cantera, max relative error:', errors)
+    if max(errors.values()) > rtol:
+        raise ValueError('Kinetics kernel differs from Cantera: ' + str(errors))
+    
+    return errors
+
+"============================================================================="
+
+if __name__ == "__main__":
+    from li_s_battery_inputs import inputs
+    
+    ctifile = sys.argv[1] if len(sys.argv) > 1 else inputs.ctifile
+    interfaces = [inputs.sulfur_elyte_phase, inputs.graphite_elyte_phase,
+                  inputs.Li2S_elyte_phase, inputs.anode_elyte_phase]
+    src = generate_kernel(ctifile, interfaces)
+    
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w') as f:
+            f.write(src)
+    else:
+        print(src)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive cathode mesh. The cathode nodes can be of any thickness
+(inputs.cathode_stretch, inputs.cathode_dy). Between cycles of a protocol the
+mesh is adapted to the solution:
+    mesh_error  - jump of the solution across each cathode face, relative to
+                  the range of each variable
+    refine      - new node thicknesses, splitting nodes next to faces above
+                  inputs.mesh_tol and merging neighbours well below it
+    transfer    - the state on the new mesh, with volume fractions and
+                  electrolyte species conserved
+    run_adaptive - a protocol repeated cycle by cycle on the adapted mesh
+    
+    results = run_adaptive(steps, cycles=20, SV_0=SV_eq)
+"""
+
+import numpy as np
+
+from li_s_battery_functions import StateView
+
+"============================================================================="
+
+def mesh_error(cell, SV):
+    """Error indicator of each cathode face for one state or rows of states
+    (n_times, nSV): the largest jump of a cathode variable between the nodes
+    on either side, relative to the range of that variable over the cathode
+    and all rows. Face f lies between nodes f and f+1. The last face is the
+    cathode/separator face, where only the electrolyte state is compared."""
+    cat, sep = cell.cathode, cell.sep
+    SV = np.atleast_2d(SV)
+    
+    # Electrolyte concentrations and potential continue into the separator
+    s_cat = StateView(SV, cat); s_sep = StateView(SV, sep).node(0)
+    u_el = np.concatenate((np.concatenate((s_cat.C_k, s_sep.C_k[:, None, :]), axis=1),
+                           np.append(s_cat.phi_el, s_sep.phi_el[:, None], axis=1)[..., None]),
+                          axis=2)
+    
+    # Solid phases and electrode potential only within the cathode
+    SV_cat = SV[:, cat.offsets[0]:cat.offsets[0] + cat.nSV].reshape(-1, cat.npoints, cat.nVars)
+    u_ed = SV_cat[..., [cat.ptr['eps_S8'], cat.ptr['eps_Li2S'], cat.ptr['phi_ed']]]
+    
+    def jumps(u):
+        scale = np.ptp(u, axis=(0, 1)) + 1e-6*np.abs(u).max(axis=(0, 1)) + 1e-300
+        return (np.abs(np.diff(u, axis=1))/scale).max(axis=(0, 2))
+    
+    err = jumps(u_el)
+    err[:-1] = np.maximum(err[:-1], jumps(u_ed))
+    
+    return err
+
+"============================================================================="
+
+def refine(cell, err):
+    """Cathode node thicknesses [m] adapted to the face errors err
+    (mesh_error). Nodes next to a face above inputs.mesh_tol are split in two,
+    pairs of neighbours whose faces are all below mesh_tol/4 are merged. The
+    node count is kept within inputs.npoints_cathode_min and _max, splitting
+    the nodes with the largest errors first."""
+    inputs = cell.inputs
+    dy = cell.cathode.dy_vec; n = dy.size; tol = inputs.mesh_tol
+    
+    # Error of each node, the larger of its two faces
+    err_node = np.maximum(err, np.append(0., err[:-1]))
+    split = err_node > tol
+    
+    merge = np.zeros([n], dtype=bool)
+    for j in np.arange(0, n - 1):
+        if (not merge[j-1] if j > 0 else True) and np.all(err[max(j-1, 0):j+2] < tol/4):
+            merge[j] = True
+    split[merge] = False; split[1:][merge[:-1]] = False
+    
+    # Stay within the node limits
+    if n + split.sum() - merge.sum() < inputs.npoints_cathode_min:
+        merge[:] = False
+    n_split = min(split.sum(), inputs.npoints_cathode_max - n + merge.sum())
+    split[:] = False
+    split[np.argsort(-err_node)[:max(n_split, 0)]] = True
+    split[merge] = False; split[1:][merge[:-1]] = False
+    split &= err_node > tol
+    
+    dy_new = []
+    j = 0
+    while j < n:
+        if merge[j]:
+            dy_new.append(dy[j] + dy[j+1]); j += 2
+        elif split[j]:
+            dy_new += [dy[j]/2, dy[j]/2]; j += 1
+        else:
+            dy_new.append(dy[j]); j += 1
+    
+    return np.array(dy_new)
+
+"============================================================================="
+
+def transfer(cell_old, cell_new, SV):
+    """State SV of cell_old on the cathode mesh of cell_new. Each new node
+    takes the average over the old nodes it overlaps; electrolyte species
+    are weighted by the electrolyte volume fraction, so the moles of each
+    species and the volume of each phase are kept. The separator and anode
+    are copied."""
+    cat_old, cat_new = cell_old.cathode, cell_new.cathode
+    ptr = cat_old.ptr
+    
+    # Overlap of each new node with each old node, per new node thickness
+    y_old = np.append(0., np.cumsum(cat_old.dy_vec))
+    y_new = np.append(0., np.cumsum(cat_new.dy_vec))
+    W = np.maximum(0., np.minimum(y_new[1:, None], y_old[None, 1:])
+                   - np.maximum(y_new[:-1, None], y_old[None, :-1]))
+    W = W/cat_new.dy_vec[:, None]
+    
+    SV_old = SV[cat_old.offsets[0]:cat_old.offsets[0] + cat_old.nSV].reshape(cat_old.npoints,
+                                                                             cat_old.nVars)
+    SV_cat = W.dot(SV_old)
+    
+    eps_el = 1 - cat_old.eps_C_0 - SV_old[:, ptr['eps_S8']] - SV_old[:, ptr['eps_Li2S']]
+    SV_cat[:, ptr['rho_k_el']] = (W.dot(eps_el[:, None]*SV_old[:, ptr['rho_k_el']])
+                                  /W.dot(eps_el)[:, None])
+    
+    SV_new = np.zeros([cat_new.nSV + cell_new.sep.nSV + cell_new.anode.nSV])
+    SV_new[:cat_new.nSV] = SV_cat.ravel()
+    SV_new[cat_new.nSV:] = SV[cat_old.offsets[0] + cat_old.nSV:]
+    
+    return SV_new
+
+"============================================================================="
+
+def run_adaptive(steps, cycles=1, cell=None, SV_0=None):
+    """Run the protocol steps (li_s_battery_protocol) cycles times, adapting
+    the cathode mesh to the solution of each cycle before the next, starting
+    from cell (the default cell of li_s_battery_init if None). Returns a
+    list of (cell, ResultStore) for each cycle; cells are CellConfigs with the
+    overrides of cell, the adapted npoints_cathode and cathode_dy and
+    flag_res_vec = 1."""
+    # The model is only imported here, so that the mesh functions above run
+    #   without Cantera and Assimulo
+    from li_s_battery_init import CellConfig
+    from li_s_battery_protocol import run_protocol
+    if cell is None:
+        from li_s_battery_init import cell
+    
+    results = []
+    SV = SV_0
+    for n in np.arange(0, cycles):
+        store = run_protocol(steps, cell, SV, None, cycles=1)
+        results.append((cell, store))
+        SV = store.SV[-1]
+        
+        dy = refine(cell, mesh_error(cell, store.SV))
+        if dy.size == cell.cathode.npoints and np.allclose(dy, cell.cathode.dy_vec):
+            continue
+        
+        # More than one node needs the vectorized residual
+        overrides = dict(cell.overrides, npoints_cathode=dy.size,
+                         cathode_dy=tuple(dy/dy.sum()), flag_res_vec=1)
+        cell_new = CellConfig(**overrides)
+        SV = transfer(cell, cell_new, SV)
+        print('Cycle', n + 1, ': cathode mesh', cell.cathode.npoints, '->',
+              cell_new.cathode.npoints, 'nodes\n')
+        cell = cell_new
+    
+    return results
@@ -10,6 +10,8 @@ model.
 
 import numpy as np
 import time
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
 import importlib
 import cantera as ct
 from matplotlib import pyplot as plt
@@ -25,185 +27,390 @@ from li_s_battery_init import anode as an
 from li_s_battery_init import sep
 from li_s_battery_init import cathode as cat
 from li_s_battery_init import sol_init
+from li_s_battery_init import cell
 
 from li_s_battery_post import label_columns
 from li_s_battery_post import tag_strings
 from li_s_battery_post import plot_sim
 from li_s_battery_post import plot_meanPS
+import li_s_battery_cache as cache
+from li_s_battery_checkpoint import save_checkpoint, load_checkpoint
 
-def main():
+def main(cell=cell, plot=True, resume=None):
     
-    res_class = eval(inputs.test_type)
+    cat, sep, an = cell.cathode, cell.sep, cell.anode
+    inputs = cell.inputs
     
 #    plt.close('all')
     t_count = time.time()
-        
-    SV_0 = sol_init.SV_0
-    SV_dot_0 = np.zeros_like(SV_0)
-    t_0 = 0.
-    t_f = 3600./inputs.C_rate
-    algvar = sol_init.algvar
-    atol = np.ones_like(SV_0)*1e-5
-    atol[cat.ptr_vec['eps_S8']] = 1e-25
-    atol[cat.ptr_vec['eps_Li2S']] = 1e-25
-    atol[cat.ptr_vec['rho_k_el']] = 1e-25
-#    atol = 1e-30; 
-    rtol = 1e-4; sim_output = 50
+    if inputs.flag_profile == 1:
+        profiler.start()
     
     rate_tag = str(inputs.C_rate)+"C"
     
-    fig, axes = plt.subplots(sharey="row", figsize=(9,12), nrows=3, ncols = 1)
-    plt.subplots_adjust(wspace = 0.15, hspace = 0.4)
-    fig.text(0.15, 0.8, rate_tag, fontsize=20, bbox=dict(facecolor='white', alpha = 0.5))
+    if plot:
+        fig, axes = plt.subplots(sharey="row", figsize=(9,12), nrows=3, ncols = 1)
+        plt.subplots_adjust(wspace = 0.15, hspace = 0.4)
+        fig.text(0.15, 0.8, rate_tag, fontsize=20, bbox=dict(facecolor='white', alpha = 0.5))
     
     # Set up user function to build figures based on inputs
     
     "----------Equilibration----------"
     
-    print('\nEquilibrating...')
-    
-    # Set external current to 0 for equilibration
-    cat.set_i_ext(0)
-    
-    # Create problem object
-    bat_eq = res_class(res_class.res_fun, SV_0, SV_dot_0, t_0)
-    bat_eq.external_event_detection = True
-    bat_eq.algvar = algvar
-    
-    # Create simulation object
-    sim_eq = IDA(bat_eq)
-    sim_eq.atol = atol
-    sim_eq.rtol = rtol
-    sim_eq.verbosity = sim_output
-    sim_eq.make_consistent('IDA_YA_YDP_INIT')
-    
-    t_eq, SV_eq, SV_dot_eq = sim_eq.simulate(t_f)
+    # A resumed discharge starts from the first state of its checkpoint
+    if resume is not None and resume['stage'] == 'discharge':
+        t_eq, SV_eq, SV_dot_eq = resume['t'][:1], resume['SV'][:1], resume['SV_dot'][:1]
+    else:
+        t_eq, SV_eq, SV_dot_eq = equilibrate(cell, resume)
     
     # Put solution into pandas dataframe with labeled columns
-    SV_eq_df = label_columns(t_eq, SV_eq, an.npoints, sep.npoints, cat.npoints)
+    SV_eq_df = label_columns(t_eq, SV_eq, an.npoints, sep.npoints, cat.npoints, cell)
 #    SV_eq_df = []
     
     # Obtain tag strings for dataframe columns
-    tags = tag_strings(SV_eq_df)
+    tags = tag_strings(SV_eq_df, cell)
     
 #    plot_sim(tags, SV_eq_df, 'Equilibrating', 0, fig, axes)
 #    print(SV_eq_df[tags['rho_el'][4:10]].iloc[-1])
     
-    print('Done equilibrating\n')
-    
     "------------Discharging-------------"
     
-    print('Discharging...')
-    
     # New initial conditions from previous simulation
-    SV_0 = SV_eq[-1, :]
-    SV_dot_0 = SV_dot_eq[-1, :]
-    
-    # Set external current
-    cat.set_i_ext(cat.i_ext_amp)
-    
-    # Update problem instance initial conditions
-    bat_dch = res_class(res_class.res_fun, SV_0, SV_dot_0, t_0)
-    bat_dch.external_event_detection = True
-    bat_dch.algvar = algvar
-        
-    # Re-initialize simulation object
-    sim_dch = IDA(bat_dch)
-    sim_dch.atol = atol
-    sim_dch.rtol = rtol
-    sim_dch.maxh = 5
-    sim_dch.verbosity = sim_output
-    sim_dch.make_consistent('IDA_YA_YDP_INIT')
-    
-    t_dch, SV_dch, SV_dot_dch = sim_dch.simulate(t_f)
+    if resume is None or resume['stage'] != 'discharge':
+        resume = None
+    t_dch, SV_dch, SV_dot_dch = discharge(cell, SV_eq[-1, :], SV_dot_eq[-1, :], resume)
     
 #    if hasattr(cathode, 'get_tflag'):
 #        t_flag_ch = cathode.get_tflag
         
-    SV_dch_df = label_columns(t_dch, SV_dch, an.npoints, sep.npoints, cat.npoints)
+    SV_dch_df = label_columns(t_dch, SV_dch, an.npoints, sep.npoints, cat.npoints, cell)
 #    SV_dch_df = []
     # Obtain tag strings for dataframe columns
 #    tags = tag_strings(SV_ch_df)
     
-    plot_sim(tags, SV_dch_df, 'Discharging', 1, fig, axes)
-    
-    plot_meanPS(SV_dch_df, tags)
+    if plot:
+        plot_sim(tags, SV_dch_df, 'Discharging', 1, fig, axes, cell)
+        
+        plot_meanPS(SV_dch_df, tags, cell)
     
     print('Done Discharging\n')
     
-    "--------Re-equilibration---------"
-    
-#    if inputs.flag_req == 1:
-#        
-#        print('Re-equilibrating...')
-#        
-#        # New initial conditions from previous simulation
-#        SV_0 = SV_ch[-1, :]
-#        SV_dot_0 = SV_dot_ch[-1, :]
-#        
-#        # Set external current
-#        cat.set_i_ext(0)
-#        
-#        # Update problem instance initial conditions
-#        bat_req = res_class(res_class.res_fun, SV_0, SV_dot_0, t_0)
-#        bat_req.external_event_detection = True
-#        bat_req.algvar = algvar
-#        
-#        # Re-initialize simulation object
-#        sim_req = IDA(bat_req)
-#        sim_req.atol = atol
-#        sim_req.rtol = rtol
-#        sim_req.verbosity = sim_output
-#        sim_req.make_consistent('IDA_YA_YDP_INIT')
-#        
-#        t_req, SV_req, SV_dot_req = sim_req.simulate(t_f)
-#        
-#        SV_req_df = label_columns(t_req, SV_req, an.npoints, sep.npoints, cat.npoints)
-#        
-##        plot_sim(tags, SV_req_df, 'Re-Equilibrating', 2-1, fig, axes)
-#    
-#        print('Done re-equilibrating\n')
-#    else:
-#        SV_req = SV_ch
-#        SV_dot_req = SV_dot_ch
-        
-    "-----------Charging-----------"
-    
-#    print('Charging...')
-#    
-#    SV_0 = SV_req[-1, :]
-#    SV_dot_0 = SV_dot_req[-1, :]
-#    
-#    cat.set_i_ext(-cat.i_ext_amp)
-#    
-#    # Update problem instance initial conditions
-#    bat_dch = res_class(res_class.res_fun, SV_0, SV_dot_0, t_0)
-#    bat_dch.external_event_detection = True
-#    bat_dch.algvar = algvar
-#    
-#    # Re-initialize simulation object
-#    sim_dch = IDA(bat_dch)
-#    sim_dch.atol = atol
-#    sim_dch.rtol = rtol
-#    sim_dch.verbosity = sim_output
-#    sim_dch.make_consistent('IDA_YA_YDP_INIT')
-#    
-#    t_dch, SV_dch, SV_dot_dch = sim_dch.simulate(t_f)
-#    
-##    if hasattr(cathode, 'get_tflag'):
-##        t_flag_dch = cathode.get_tflag
-#        
-#    SV_dch_df = label_columns(t_dch, SV_dch, an.npoints, sep.npoints, cat.npoints)
-#    
-#    plot_sim(tags, SV_dch_df, 'Charging', 3, fig, axes)
-#    
-#    print('Done Charging\n')
+    # Re-equilibration, charging and longer cycling protocols are run by
+    #   li_s_battery_protocol.run_protocol on a single solver instance
     
     t_elapsed = time.time() - t_count
     print('t_cpu=', t_elapsed, '\n')
     
+    if inputs.flag_profile == 1:
+        profiler.stop()
+        profiler.write(inputs.profile_file)
+        print(profiler.summary(), '\n')
+    
     return SV_eq_df, SV_dch_df, tags #SV_eq_df, SV_req_df #, SV_dch_df
     
+"============================================================================="
+
+def problem(cell, SV_0, SV_dot_0, t_0=0.):
+    """Problem object for inputs.test_type with the residual form chosen in
+    inputs, starting from SV_0 at t_0."""
+    inputs = cell.inputs
+    
+    res_class = eval(inputs.test_type)
+    if inputs.flag_res_vec == 1:
+        res_fun = res_class.res_fun_vec
+    else:
+        # The node loop pairs cathode and separator nodes one to one and has
+        #   no currents between cathode nodes
+        npoints = [cell.cathode.npoints, cell.sep.npoints, cell.anode.npoints]
+        if max(npoints) > 1:
+            raise ValueError('flag_res_vec = 0 needs one node per component, '
+                             'the mesh has ' + str(npoints) + ', set flag_res_vec = 1')
+        res_fun = res_class.res_fun
+        
+    bat = res_class(res_fun, SV_0, SV_dot_0, t_0, cell)
+    bat.external_event_detection = True
+    bat.algvar = cell.sol_init.algvar
+    
+    return bat
+
+"============================================================================="
+
+def tolerances(cell, SV_0):
+    """Absolute and relative tolerances of the solution vector."""
+    cat = cell.cathode
+    
+    atol = np.ones_like(SV_0)*1e-5
+    atol[cat.ptr_vec['eps_S8']] = 1e-25
+    atol[cat.ptr_vec['eps_Li2S']] = 1e-25
+    atol[cat.ptr_vec['rho_k_el']] = 1e-25
+#    atol = 1e-30; 
+    rtol = 1e-4
+    
+    return atol, rtol
+
+"============================================================================="
+
+def run_stage(cell, i_ext, SV_0, SV_dot_0, t_f, maxh=None, stage=None, 
+              resume=None, sink=None, steady_stop=False):
+    """Integrate the cell at a constant external current i_ext from SV_0 up to
+    t_f (or until an event stops it). Returns t, SV and SV_dot. 
+    
+    With inputs.flag_checkpoint and a stage name the integration runs in 
+    pieces of t_f/100, and the trajectory so far is written to 
+    inputs.checkpoint_file every inputs.checkpoint_wall seconds of wall time 
+    and when the stage ends. resume is a checkpoint of the same stage, which
+    is continued with the current, end time and solver settings stored in it.
+    
+    With a sink (li_s_battery_store.TrajectoryWriter) the solution is 
+    streamed to it as the solver accepts it, and only the final state is 
+    returned and checkpointed.
+    
+    With steady_stop the stage ends early once the cell has settled 
+    (cc_cycling.steady_event), as equilibrate asks for with 
+    inputs.flag_eq_event.
+    """
+    cat, inputs = cell.cathode, cell.inputs
+    
+    atol, rtol = tolerances(cell, SV_0)
+    lsolver = linear_solver(cell)
+    sim_output = 50
+    
+    t_0 = 0.; history = []
+    if resume is not None:
+        history.append((resume['t'], resume['SV'], resume['SV_dot']))
+        if resume['complete']:
+            return resume['t'], resume['SV'], resume['SV_dot']
+        i_ext, t_f = resume['i_ext'], resume['t_f']
+        maxh = None if np.isnan(resume['maxh']) else resume['maxh']
+        atol, rtol, lsolver = resume['atol'], resume['rtol'], resume['linear_solver']
+        t_0 = resume['t'][-1]; SV_0 = resume['SV'][-1]; SV_dot_0 = resume['SV_dot'][-1]
+    
+    # Set external current
+    cat.set_i_ext(i_ext)
+    
+    # Create problem and simulation objects
+    bat = problem(cell, SV_0, SV_dot_0, t_0)
+    bat.sink = sink
+    bat.steady_stop = steady_stop
+    sim = IDA(bat)
+    # The steady window is tracked on every accepted step, and a sink gets
+    #   the points as they are accepted, so the solver does not keep them
+    #   until simulate() returns
+    if steady_stop or sink is not None:
+        sim.report_continuously = True
+    sim.atol = atol
+    sim.rtol = rtol
+    sim.usejac = inputs.flag_jac != 0
+    sim.linear_solver = lsolver
+    if maxh is not None:
+        sim.maxh = maxh
+    sim.verbosity = sim_output
+    sim.make_consistent('IDA_YA_YDP_INIT')
+    
+    checkpoint = stage is not None and inputs.flag_checkpoint == 1
+    t_end = t_0; t_write = time.time()
+    while True:
+        t_next = min(t_end + t_f/100, t_f) if checkpoint else t_f
+        t, SV, SV_dot = [np.asarray(x) for x in sim.simulate(t_next)]
+        if sink is not None:
+            t, SV, SV_dot = sink.last
+            history = []
+        
+        # Keep the new points only, the solver may return earlier ones too
+        rows = t > t_end if history else t >= t_end
+        history.append((t[rows], SV[rows], SV_dot[rows]))
+        profiler.add_solver(sim, t[-1] - t_end)
+        t_end = t[-1]
+        
+        # The stage ends at t_f or when an event stops the solver early
+        done = t_end >= t_f or t_end < t_next
+        if checkpoint and (done or time.time() - t_write > inputs.checkpoint_wall):
+            t_ck, SV_ck, SV_dot_ck = [np.concatenate(x) for x in zip(*history)]
+            save_checkpoint(inputs.checkpoint_file, stage=stage, complete=done, 
+                            t=t_ck, SV=SV_ck, SV_dot=SV_dot_ck, i_ext=i_ext, t_f=t_f,
+                            maxh=np.nan if maxh is None else maxh, atol=atol, 
+                            rtol=rtol, linear_solver=lsolver, overrides=cell.overrides,
+                            multipliers=dict(isothermal.multipliers),
+                            key=cache.state_key(cell, isothermal.multipliers))
+            t_write = time.time()
+        if done:
+            break
+    
+    t, SV, SV_dot = [np.concatenate(x) for x in zip(*history)]
+    
+    return t, SV, SV_dot
+
+"============================================================================="
+
+def equilibrate(cell=cell, resume=None):
+    """Rest the cell at zero current from its initial state for 3600/C_rate
+    seconds, or with inputs.flag_eq_steady solve for the state it rests at 
+    (steady_state). The result does not depend on the discharge current, so it can
+    be shared by discharges at any C-rate. Returns t, SV and SV_dot. With
+    inputs.flag_eq_cache the final state is stored on disk, and a cached 
+    state for the same cell is returned (as a single time point) instead of
+    integrating again. resume is a checkpoint of an equilibration to 
+    continue."""
+    inputs = cell.inputs
+    
+    if inputs.flag_eq_cache == 1:
+        key = cache.state_key(cell, isothermal.multipliers)
+        state = cache.load_state(key, inputs.cache_dir)
+        if state is not None and resume is None:
+            print('\nEquilibrated state loaded from cache', key[:12], '\n')
+            t_eq, SV_eq, SV_dot_eq = state
+            return t_eq[None], SV_eq[None, :], SV_dot_eq[None, :]
+            
+    print('\nEquilibrating...')
+    
+    SV_0 = cell.sol_init.SV_0
+    SV_dot_0 = np.zeros_like(SV_0)
+    
+    if inputs.flag_kin_kernel != 0:
+        kinetics_check(SV_0, cell)
+        
+    if inputs.flag_jac_check == 1 and resume is None:
+        cell.cathode.set_i_ext(0)
+        jac_check(problem(cell, SV_0, SV_dot_0), 1., 0., SV_0, SV_dot_0)
+        res_check(cell, SV_0, SV_dot_0)
+        
+    if inputs.flag_eq_steady == 1:
+        t_eq, SV_eq, SV_dot_eq = steady_state(cell, SV_0, 3600./inputs.C_rate)
+    else:
+        t_eq, SV_eq, SV_dot_eq = run_stage(cell, 0, SV_0, SV_dot_0, 3600./inputs.C_rate,
+                                           stage='equilibrate', resume=resume,
+                                           steady_stop=inputs.flag_eq_event == 1)
+    
+    if inputs.flag_eq_cache == 1:
+        cache.save_state(key, t_eq[-1], SV_eq[-1, :], SV_dot_eq[-1, :], 
+                         inputs.cache_dir, inputs.cache_size)
+        
+    print('Done equilibrating\n')
+    
+    return t_eq, SV_eq, SV_dot_eq
+
+"============================================================================="
+
+def steady_state(cell, SV_0, t_rest, dt_0=1e-3, max_steps=500):
+    """Zero current steady state of the cell reached from SV_0, found by 
+    pseudo-transient continuation: backward Euler steps of the residual with 
+    a pseudo time step that grows as the state settles, each solved by Newton
+    iterations with the sparse Jacobian. Backward Euler keeps the nucleation
+    site counts and the species inventories (including the sulfur inventory 
+    n_S_0) of the starting state, which a plain Newton solve of res(SV, 0) 
+    would leave undetermined. The cathode electrolyte rate is scaled by the
+    ratio of old to new electrolyte volume fractions so that eps_el*C_k is 
+    conserved exactly over each step. The Newton Jacobian is that of the step
+    itself, with this scaling and the residual of inputs.flag_res_vec, by
+    coloured finite differences (jac_colored).
+    
+    Stops once the differential states would drift by less than the solver
+    tolerances over t_rest. Returns the pseudo times, states and rates of the
+    steps, with a zero rate for the final (steady) state."""
+    cat = cell.cathode
+    atol, rtol = tolerances(cell, SV_0)
+    algvar = cell.sol_init.algvar == 1
+    rho = cat.ptr_vec['rho_k_el']
+    
+    cat.set_i_ext(0)
+    bat = problem(cell, SV_0, np.zeros_like(SV_0))
+    pattern = jac_pattern(cell)
+    nonzero = pattern.nonzero(); colors = jac_colors(pattern)
+    
+    def wrms(v, SV):
+        return np.sqrt(np.mean((v/(rtol*np.abs(SV) + atol))**2))
+    
+    def eps_el(SV):
+        return (1 - cat.eps_C_0 - np.maximum(SV[cat.ptr_vec['eps_S8']], 1e-25) 
+                - np.maximum(SV[cat.ptr_vec['eps_Li2S']], 1e-25))
+    
+    def rate(SV, SV_n, dt):
+        SV_dot = (SV - SV_n)/dt
+        SV_dot[rho] *= np.repeat(eps_el(SV_n)/eps_el(SV), len(cat.ptr['rho_k_el']))
+        return SV_dot
+    
+    def drift(SV):
+        # Change of the differential states over t_rest at the current rates,
+        #   with the algebraic rows solved
+        return wrms(t_rest*bat.res(0., SV, np.zeros_like(SV))*algvar, SV)
+    
+    SV = np.array(SV_0, dtype=float)
+    t = 0.; dt = dt_0
+    t_ptc = [t]; SV_ptc = [SV.copy()]; SV_dot_ptc = [np.zeros_like(SV)]
+    for step in np.arange(0, max_steps):
+        if len(t_ptc) > 1 and drift(SV) < 1:
+            break
+        
+        # Backward Euler step from SV by Newton iterations
+        SV_n = SV; SV_k = SV.copy(); converged = False
+        for k in np.arange(0, 10):
+            def step_res(h):
+                return bat.res(t + dt, SV_k + h, rate(SV_k + h, SV_n, dt))
+            res = step_res(np.zeros_like(SV_k))
+            J = jac_colored(step_res, SV_k, nonzero, colors)
+            dSV = spsolve(J, -res)
+            if not np.all(np.isfinite(dSV)):
+                break
+            SV_k = SV_k + dSV
+            if wrms(dSV, SV_k) < 1e-3:
+                converged = True
+                break
+            
+        if not converged:
+            # Retry the step from the same state with a smaller time step
+            dt = dt/4
+            if dt < 1e-12:
+                raise RuntimeError('Steady state solve failed at t = ' + str(t))
+            continue
+        
+        t = t + dt
+        SV_dot_ptc.append(rate(SV_k, SV_n, dt))
+        SV = SV_k
+        t_ptc.append(t); SV_ptc.append(SV.copy())
+        
+        # Grow the step faster while Newton converges quickly
+        dt = dt*(4. if k < 3 else 1.5)
+    else:
+        raise RuntimeError('Steady state not reached in ' + str(max_steps) + ' steps')
+        
+    SV_dot_ptc[-1] = np.zeros_like(SV)
+    print('Steady state after', len(t_ptc) - 1, 'pseudo time steps, t =', t)
+    
+    return np.asarray(t_ptc), np.asarray(SV_ptc), np.asarray(SV_dot_ptc)
+
+"============================================================================="
+
+def discharge(cell, SV_0, SV_dot_0, resume=None):
+    """Constant current discharge at cell.inputs.C_rate from an equilibrated
+    state SV_0, SV_dot_0, or continued from the checkpoint resume. Returns t,
+    SV and SV_dot."""
+    print('Discharging...')
+    
+    t_dch, SV_dch, SV_dot_dch = run_stage(cell, cell.cathode.i_ext_amp, SV_0, 
+                                          SV_dot_0, 3600./cell.inputs.C_rate, maxh=5,
+                                          stage='discharge', resume=resume)
+    
+    return t_dch, SV_dch, SV_dot_dch
+
+"============================================================================="
+
+def resume(checkpoint=None, plot=True):
+    """Continue the run of main() saved in the checkpoint file (by default 
+    inputs.checkpoint_file). The cell is rebuilt from the overrides and rate
+    multipliers stored in the checkpoint, and the inputs and CTI file must
+    still give the same state key. Returns the same as main()."""
+    from li_s_battery_init import CellConfig, set_rate_multipliers
+    
+    state = load_checkpoint(checkpoint or inputs.checkpoint_file)
+    set_rate_multipliers(state['multipliers'])
+    resume_cell = CellConfig(**state['overrides'])
+    if cache.state_key(resume_cell, isothermal.multipliers) != state['key']:
+        raise ValueError('Inputs or CTI file changed since the checkpoint was written')
+    
+    print('\nResuming', state['stage'], 'at t =', state['t'][-1])
+    
+    return main(resume_cell, plot, resume=state)
+
 "=============================================================================" 
 "===========RESIDUAL CLASSES AND HELPER FUNCTIONS BEYOND THIS POINT==========="
 "============================================================================="
@@ -220,20 +427,438 @@ from li_s_battery_init import lithium_obj as lithium
 from li_s_battery_init import lithium_el_s as lithium_s
 from li_s_battery_init import conductor_obj as conductor
 from li_s_battery_init import elyte_obj as elyte
-from li_s_battery_functions import set_state
-from li_s_battery_functions import set_state_sep
+from li_s_battery_functions import StateView
 from li_s_battery_functions import dst
+from li_s_battery_functions import dst_jac
+from li_s_battery_functions import chain_fluxes
+from li_s_battery_functions import dst_faces
+from li_s_battery_init import kernel
+from li_s_battery_init import isothermal
+from li_s_battery_init import kernel_phase_rates
+from li_s_battery_kinetics import check_kernel
+from li_s_battery_profile import profiler, net_rates
 from math import pi
 
-class cc_cycling(Implicit_Problem):    
-    def res_fun(t, SV, SV_dot):
+def jac_pattern(cell, hold=False):
+    """Sparsity pattern of the residual Jacobian, worked out from the SV 
+    layout. Nodes are stored cathode -> separator -> anode and the residual of
+    each node only depends on its own variables and those of the nodes on 
+    either side of it. With hold, the entries coupling the current collector
+    nodes through the potentiostat of a voltage hold are added."""
+    cat, sep, an = cell.cathode, cell.sep, cell.anode
+    nodes = ([(o, cat.nVars) for o in cat.offsets] 
+             + [(o, sep.nVars) for o in sep.offsets]
+             + [(o, an.nVars) for o in an.offsets])
+    
+    rows = []; cols = []
+    for i, (offset, nVars) in enumerate(nodes):
+        for offset_nb, nVars_nb in nodes[max(i - 1, 0):i + 2]:
+            r, c = np.meshgrid(offset + np.arange(nVars), 
+                               offset_nb + np.arange(nVars_nb), indexing='ij')
+            rows.append(r.ravel()); cols.append(c.ravel())
+    if hold:
+        cols_V, _ = hold_current_jac(cell, hold)
+        for offset, nVars in [nodes[0], nodes[-1]]:
+            r, c = np.meshgrid(offset + np.arange(nVars), cols_V, indexing='ij')
+            rows.append(r.ravel()); cols.append(c.ravel())
+    rows = np.hstack(rows); cols = np.hstack(cols)
+    
+    nSV = cat.nSV + sep.nSV + an.nSV
+    return sparse.csc_matrix((np.ones(rows.size, dtype=bool), (rows, cols)), 
+                             shape=(nSV, nSV))
+    
+"========================================================================="
+
+def jac_bandwidth(pattern):
+    """Lower and upper bandwidth of a Jacobian sparsity pattern."""
+    rows, cols = pattern.nonzero()
+    
+    return int(max(rows - cols)), int(max(cols - rows))
+
+"========================================================================="
+
+def jac_colors(pattern):
+    """Greedy colouring of the Jacobian columns such that no two columns with
+    the same colour have an entry in the same row. For the nearest neighbour
+    node coupling this needs about 3*cathode.nVars colours for any number of
+    nodes."""
+    pattern = sparse.csc_matrix(pattern, dtype=int)
+    overlap = (pattern.T*pattern).tocsr()
+    
+    colors = -np.ones(pattern.shape[1], dtype=int)
+    for k in np.arange(0, pattern.shape[1]):
+        neighbors = overlap.indices[overlap.indptr[k]:overlap.indptr[k+1]]
+        used = set(colors[neighbors])
+        color = 0
+        while color in used:
+            color += 1
+        colors[k] = color
+        
+    return colors
+
+"========================================================================="
+
+def jac_colored(fun, SV, nonzero, colors):
+    """Finite difference Jacobian of a residual about SV with the column
+    colouring colors (jac_colors) of the pattern entries nonzero = (rows, 
+    cols). fun(h) is the residual with SV moved by h, so the caller decides
+    how SV_dot moves with it. Columns of the same colour are perturbed 
+    together and one call of fun fills all of them."""
+    rows, cols = nonzero
+    h = np.sqrt(np.finfo(float).eps)*np.maximum(np.abs(SV), 1e-6)
+    res_0 = fun(np.zeros_like(SV))
+    
+    vals = np.zeros(rows.size)
+    for color in np.arange(0, colors.max() + 1):
+        h_c = np.where(colors == color, h, 0.)
+        dres = fun(h_c) - res_0
+        
+        entries = colors[cols] == color
+        vals[entries] = dres[rows[entries]]/h[cols[entries]]
         
+    return sparse.csc_matrix((vals, (rows, cols)), shape=(SV.size, SV.size))
+
+"========================================================================="
+
+def jac_check(problem, c, t, SV, SV_dot):
+    """Self check of the Jacobians for small meshes. Builds the dense finite 
+    difference Jacobian one column at a time and prints the largest 
+    difference of the coloured and analytic Jacobians from it, relative to 
+    the largest entry of each row."""
+    h = np.sqrt(np.finfo(float).eps)*np.maximum(np.abs(SV), 1e-6)
+    res_0 = problem.res(t, SV, SV_dot)
+    
+    J_dense = np.zeros([SV.size, SV.size])
+    for k in np.arange(0, SV.size):
+        h_k = np.zeros_like(SV)
+        h_k[k] = h[k]
+        J_dense[:, k] = (problem.res(t, SV + h_k, SV_dot + c*h_k) - res_0)/h[k]
+        
+    row_max = np.maximum(np.abs(J_dense).max(axis=1), 1e-300)[:, None]
+    
+    errors = {}
+    errors['colored'] = np.max(np.abs(problem.jac_fd(c, t, SV, SV_dot).toarray() 
+                                      - J_dense)/row_max)
+    errors['analytic'] = np.max(np.abs(problem.jac_analytic(c, t, SV, SV_dot).toarray() 
+                                       - J_dense)/row_max)
+    
+    print('Jacobian check against dense finite differences:', errors)
+    
+    return errors
+
+"========================================================================="
+
+def res_check(cell, SV, SV_dot, rtol=1e-10):
+    """Self check of the residual forms on a 1-node cell: the node loop 
+    res_fun against res_fun_vec at SV, SV_dot, at zero and at the discharge 
+    current. Prints and returns the largest difference relative to the 
+    largest residual and raises if it exceeds rtol. The cell is left at zero
+    current. Cells with more nodes are skipped, the loop does not handle 
+    them."""
+    cat, sep, an = cell.cathode, cell.sep, cell.anode
+    if max(cat.npoints, sep.npoints, an.npoints) > 1:
+        return None
+    
+    error = 0.
+    try:
+        for i_ext in [0, cat.i_ext_amp]:
+            cat.set_i_ext(i_ext)
+            res_loop = cc_cycling.res_fun(0., SV, SV_dot, cell)
+            res_vec = cc_cycling.res_fun_vec(0., SV, SV_dot, cell)
+            error = max(error, np.max(np.abs(res_loop - res_vec))
+                        /max(np.max(np.abs(res_vec)), 1e-300))
+    finally:
+        cat.set_i_ext(0)
+    
+    print('Residual check, loop against vectorized:', error)
+    if error > rtol:
+        raise ValueError('res_fun and res_fun_vec differ by ' + str(error))
+    
+    return error
+
+"========================================================================="
+
+def linear_solver(cell):
+    """Linear solver for IDA from inputs.linear_solver, 'DENSE' by default.
+    With the opt-in 'AUTO' the dense solver is kept while the band of the 
+    Jacobian covers a large part of the matrix, and SPGMR with the sparse 
+    Jacobian product (cc_cycling.jacv) is used once the mesh makes the 
+    matrix mostly empty."""
+    lsolver = cell.inputs.linear_solver.upper()
+    if lsolver == 'AUTO':
+        pattern = jac_pattern(cell)
+        lband, uband = jac_bandwidth(pattern)
+        if lband + uband + 1 < pattern.shape[0]/4:
+            lsolver = 'SPGMR'
+        else:
+            lsolver = 'DENSE'
+            
+    return lsolver
+
+"========================================================================="
+
+def external_current(cell, SV):
+    """External current density at the cathode current collector. This is 
+    the set current of the cell, or under a voltage hold (cathode.V_hold) the
+    current of a potentiostat driving the cell voltage to V_hold."""
+    cat, an = cell.cathode, cell.anode
+    if cat.V_hold is None:
+        return cat.get_i_ext()
+    
+    V_cell = SV[cat.offsets[0] + cat.ptr['phi_ed']] - SV[an.offsets[-1] + an.ptr['phi_ed']]
+    
+    return cat.G_hold*(cat.V_hold - V_cell)
+
+"========================================================================="
+
+def hold_current_jac(cell, hold=None):
+    """SV columns and derivatives of external_current. Both are empty unless
+    the cell is under a voltage hold (or hold is given)."""
+    cat, an = cell.cathode, cell.anode
+    if hold is None:
+        hold = cat.V_hold is not None
+    if not hold:
+        return np.array([], dtype=int), np.array([])
+    
+    cols = np.array([cat.offsets[0] + cat.ptr['phi_ed'], an.offsets[-1] + an.ptr['phi_ed']])
+    
+    return cols, np.array([-1., 1.])*cat.G_hold
+
+"========================================================================="
+
+def cathode_kinetics(X_k, phi_ed, phi_el):
+    """Net production rates at the carbon, Li2S and sulfur interfaces for every
+    cathode node. X_k is (npoints, n_species), phi_ed and phi_el are
+    (npoints,). Cantera interfaces only hold one state at a time so this is
+    the one remaining loop over nodes in res_fun_vec, unless the generated
+    kinetics kernel is used."""
+    if inputs.flag_kin_kernel != 0:
+        sdot_C, sdot_L, sdot_S = [kernel_phase_rates(surf, X_k, phi_ed, phi_el)
+                                  for surf in [C_el_s, L_el_s, S_el_s]]
+        
+        return (sdot_C[inputs.elyte_phase], sdot_L[inputs.elyte_phase], 
+                sdot_S[inputs.elyte_phase], sdot_S[inputs.cat_phase1][:, 0],
+                sdot_L[inputs.cat_phase2][:, 0], sdot_C[inputs.metal_phase][:, 0])
+    
+    npoints = X_k.shape[0]
+    
+    sdot_C = np.zeros_like(X_k)
+    sdot_L = np.zeros_like(X_k)
+    sdot_S = np.zeros_like(X_k)
+    sdot_S8 = np.zeros([npoints])
+    sdot_Li2S = np.zeros([npoints])
+    sdot_Far = np.zeros([npoints])
+    
+    prof = profiler.active
+    for j in np.arange(0, npoints):
+        if prof:
+            t_0 = time.perf_counter()
+        carbon.electric_potential = phi_ed[j]
+        elyte.electric_potential = phi_el[j]
+        conductor.electric_potential = phi_ed[j]
+        
+        elyte.X = X_k[j]
+        if prof:
+            profiler.add_time('kinetics:set_state', time.perf_counter() - t_0)
+        
+        sdot_C[j] = net_rates(C_el_s, elyte)
+        sdot_L[j] = net_rates(L_el_s, elyte)
+        sdot_S[j] = net_rates(S_el_s, elyte)
+        sdot_Far[j] = net_rates(C_el_s, conductor)[0]
+        sdot_S8[j] = net_rates(S_el_s, sulfur)[0]
+        sdot_Li2S[j] = net_rates(L_el_s, Li2S)[0]
+        
+    return sdot_C, sdot_L, sdot_S, sdot_S8, sdot_Li2S, sdot_Far
+
+"========================================================================="
+
+def anode_kinetics(X_k, phi_ed, phi_el):
+    """Net production rates at the lithium/electrolyte interface for every
+    anode node, with the same array shapes as cathode_kinetics."""
+    if inputs.flag_kin_kernel != 0:
+        sdot = kernel_phase_rates(lithium_s, X_k, phi_ed, phi_el)
+        
+        return sdot[inputs.elyte_phase], sdot[inputs.metal_phase][:, 0]
+    
+    npoints = X_k.shape[0]
+    
+    sdot_Li = np.zeros_like(X_k)
+    sdot_Far = np.zeros([npoints])
+    
+    prof = profiler.active
+    for j in np.arange(0, npoints):
+        if prof:
+            t_0 = time.perf_counter()
+        elyte.X = X_k[j]
+        elyte.electric_potential = phi_el[j]
+        lithium.electric_potential = phi_ed[j]
+        conductor.electric_potential = phi_ed[j]
+        if prof:
+            profiler.add_time('kinetics:set_state', time.perf_counter() - t_0)
+        
+        sdot_Li[j] = net_rates(lithium_s, elyte)
+        sdot_Far[j] = net_rates(lithium_s, conductor)[0]
+        
+    return sdot_Li, sdot_Far
+
+"========================================================================="
+
+def kinetics_check(SV, cell):
+    """Compare the kinetics kernel with Cantera at the cathode and anode states
+    in SV. Raises if they differ by more than the kernel tolerance."""
+    cat, an = cell.cathode, cell.anode
+    SV_cat = SV[:cat.nSV].reshape(cat.npoints, cat.nVars)
+    SV_an = SV[an.offsets[0]:].reshape(-1, an.nVars)
+    
+    for SV_k, ptr, surfaces in [(SV_cat, cat.ptr, 
+                                 {S_el_s.name: (S_el_s, [sulfur, elyte, conductor]),
+                                  C_el_s.name: (C_el_s, [carbon, elyte, conductor]),
+                                  L_el_s.name: (L_el_s, [Li2S, elyte, conductor])}),
+                                (SV_an, an.ptr,
+                                 {lithium_s.name: (lithium_s, [lithium, elyte, conductor])})]:
+        C_k = SV_k[:, ptr['rho_k_el']]
+        phi_ed = SV_k[:, ptr['phi_ed']]
+        phi_el = phi_ed - SV_k[:, ptr['phi_dl']]
+        # Rate constants with the multipliers the Cantera interfaces use
+        check_kernel(kernel, surfaces, elyte, conductor, 
+                     C_k/C_k.sum(axis=1)[:, None], phi_el, phi_ed, 
+                     k=isothermal.update(elyte.T)[0])
+        
+    return
+
+"========================================================================="
+
+def kinetics_jac(kin_fun, C_k, phi_ed, phi_dl):
+    """Derivatives of the rates returned by kin_fun (cathode_kinetics or 
+    anode_kinetics) with respect to each node's kinetic variables 
+    u = [C_k, phi_ed, phi_dl]. Cantera does not provide rate derivatives, so
+    each interface is differenced directly. Nodes do not interact through the
+    kinetics, so every column of u is perturbed at all nodes in one call.
+    
+    Returns the unperturbed rates and, for each rate, an array with a trailing
+    axis of length n_species + 2 holding d(rate)/du."""
+    nsp = C_k.shape[1]
+    u = np.hstack((C_k, phi_ed[:, None], phi_dl[:, None]))
+    
+    def rates(u):
+        C = u[:, :nsp]
+        return kin_fun(C/C.sum(axis=1)[:, None], u[:, nsp], u[:, nsp] - u[:, nsp+1])
+    
+    sdot = rates(u)
+    dsdot = [np.zeros(r.shape + (u.shape[1],)) for r in sdot]
+    
+    for m in np.arange(0, u.shape[1]):
+        if m < nsp:
+            # The step must move the normalized mole fractions of the major
+            #   species by more than round-off, even for trace species
+            h = 1e-7*np.maximum(np.abs(u[:, m]), 1e-6*C_k.sum(axis=1))
+        else:
+            h = 1e-7*np.maximum(np.abs(u[:, m]), 1.)
+        u_h = u.copy()
+        u_h[:, m] += h
+        for r, r_h, dr in zip(sdot, rates(u_h), dsdot):
+            dr[..., m] = (r_h - r)/h.reshape((-1,) + (1,)*(r.ndim - 1))
+            
+    return sdot, dsdot
+
+"========================================================================="
+
+def sep_an_res(SV, SV_dot, res, N_io_m, i_io_m, i_ext, cell, faces=None):
+    """Separator and anode rows of the residual, for any number of nodes in
+    either. N_io_m and i_io_m are the species flux and ionic current entering
+    the separator from the cathode. faces holds the fluxes and currents of 
+    the faces after each separator and anode node but the last (dst_faces), 
+    when chain_fluxes has already computed them."""
+    sep, an = cell.sep, cell.anode
+    F = ct.faraday
+    n_sep = sep.npoints
+    
+    s_sep = StateView(SV, sep)
+    s_an = StateView(SV, an)
+    
+    # Internal faces of the separator -> anode part of the chain
+    if faces is None:
+        n_cat = cell.faces.n_cat
+        faces = dst_faces(np.concatenate((s_sep.C_k, s_an.C_k)), 
+                          np.concatenate((s_sep.phi_el, s_an.phi_el)),
+                          cell.faces.D_el[n_cat:], cell.faces.dyInv[n_cat:])
+    
+    # Fluxes through the faces on either side of every separator and anode 
+    #   node. Nothing leaves the electrolyte at the anode current collector
+    N_io = np.vstack((N_io_m, faces[0], np.zeros_like(faces[0][:1])))
+    i_io = np.hstack((i_io_m, faces[1], 0.))
+    
+    """=========================Separator nodes========================="""
+    
+    SV_dot_sep = SV_dot[sep.offsets[0]:sep.offsets[0] + sep.nSV].reshape(n_sep, sep.nVars)
+    res_sep = res[sep.offsets[0]:sep.offsets[0] + sep.nSV].reshape(n_sep, sep.nVars)
+    
+    res_sep[:, sep.ptr['rho_k_el']] = (SV_dot_sep[:, sep.ptr['rho_k_el']]
+        - (N_io[:n_sep] - N_io[1:n_sep + 1])*sep.dyInv/sep.epsilon_el)
+            
+    res_sep[:, sep.ptr['phi']] = i_io[:n_sep] - i_io[1:n_sep + 1]
+    
+    """===========================Anode nodes==========================="""
+    
+    N_io = N_io[n_sep:]; i_io = i_io[n_sep:]
+    SV_an = SV[an.offsets[0]:an.offsets[0] + an.nSV].reshape(an.npoints, an.nVars)
+    SV_dot_an = SV_dot[an.offsets[0]:an.offsets[0] + an.nSV].reshape(an.npoints, an.nVars)
+    res_an = res[an.offsets[0]:an.offsets[0] + an.nSV].reshape(an.npoints, an.nVars)
+    
+    sdot_Li, sdot_Far = anode_kinetics(s_an.X_k, s_an.phi_ed, s_an.phi_el)
+    
+    R_net = sdot_Li*an.A_Li
+    i_Far = sdot_Far*an.A_Li*F*an.dy
+    
+    # Electronic current leaves through the current collector (last face) and
+    #   cannot cross the separator face
+    i_el = np.zeros([an.npoints + 1])
+    i_el[1:-1] = an.sigma_eff*(s_an.phi_ed[:-1] - s_an.phi_ed[1:])*an.dyInv
+    i_el[-1] = i_ext
+    
+    res_an[:, an.ptr['rho_k_el']] = (SV_dot_an[:, an.ptr['rho_k_el']]
+        - (R_net + (N_io[:-1] - N_io[1:])*an.dyInv)/an.eps_el)
+    
+    res_an[:, an.ptr['phi_dl']] = (SV_dot_an[:, an.ptr['phi_dl']]
+        - (-i_Far + i_el[:-1] - i_el[1:])*an.dyInv/an.C_dl/an.A_Li)
+    
+    # Charge neutrality, except at the current collector node which sets the
+    #   reference potential
+    res_an[:-1, an.ptr['phi_ed']] = i_el[:-2] - i_el[1:-1] + i_io[:-2] - i_io[1:-1]
+    res_an[-1, an.ptr['phi_ed']] = SV_an[-1, an.ptr['phi_ed']]
+    
+    return res
+
+"========================================================================="
+
+class cc_cycling(Implicit_Problem):
+    def __init__(self, res_fun, SV_0, SV_dot_0, t_0, cell=cell):
+        # The residual functions take the cell explicitly, IDA calls res with
+        #   (t, SV, SV_dot) only
+        self.cell = cell
+        
+        # Steady state stop of the equilibration (steady_event), off unless
+        #   run_stage is asked for it
+        self.steady_stop = False
+        self.reset_steady()
+        
+        @profiler.timed('res_fun', outer=True)
+        def res(t, SV, SV_dot):
+            return res_fun(t, SV, SV_dot, cell)
+        
+        Implicit_Problem.__init__(self, res, SV_0, SV_dot_0, t_0)
+    
+    "========================================================================="
+    
+    def res_fun(t, SV, SV_dot, cell):
+        
+        cat, sep, an, inputs = cell.cathode, cell.sep, cell.anode, cell.inputs
         res = np.zeros_like(SV)
         ptr = cat.ptr; F = ct.faraday; R = ct.gas_constant; T = inputs.T
         """Cathode CC boundary"""
         j = 0; offset = cat.offsets[int(j)]
-        i_ext = cat.get_i_ext()
-        s2 = {}
+        i_ext = external_current(cell, SV)
+        s_cat = StateView(SV, cat); s_sep = StateView(SV, sep)
         
         # Set electronic current and ionic current boundary conditions
         i_el_p = i_ext
@@ -246,7 +871,6 @@ class cc_cycling(Implicit_Problem):
             i_el_m = i_el_p
             i_io_m = i_io_p
             N_io_m = N_io_p
-            s1 = dict(s2)
             
             # Update offset to current node
             offset = cat.offsets[int(j)]
@@ -266,9 +890,9 @@ class cc_cycling(Implicit_Problem):
             r_L = 3*eps_Li2S/A_L
             
             A_C = inputs.A_C_0 - (pi*np_S*r_S**2)/cat.V_0 - (pi*np_L*r_L**2)/cat.V_0
-
+            
             # Set states for THIS node
-            s1 = set_state(SV, offset, cat.ptr)
+            s1 = s_cat.node(j)
             
             carbon.electric_potential = s1['phi_ed']
             elyte.electric_potential = s1['phi_el'] 
@@ -278,21 +902,21 @@ class cc_cycling(Implicit_Problem):
             
             # Shift forward to NEXT node
             offset = sep.offsets[int(j)]
-            s2 = set_state_sep(SV, offset, sep.ptr)
+            s2 = s_sep.node(j)
             
-            dyInv_boundary = 1/(0.5*(cat.dy + sep.dy))
+            dyInv_boundary = 1/(0.5*(cat.dy_vec[j] + sep.dy))
             
             # Shift back to THIS node
             offset = cat.offsets[int(j)]
             
             D_el = cat.D_el*eps_el**(1.5)
-
+            
             # Current node plus face boundary fluxes
             i_el_p = 0
             N_io_p, i_io_p = dst(s1, s2, D_el, dyInv_boundary)
             
-            sdot_C = C_el_s.get_net_production_rates(elyte)
-            sdot_L = L_el_s.get_net_production_rates(elyte) 
+            sdot_C = net_rates(C_el_s, elyte)
+            sdot_L = net_rates(L_el_s, elyte) 
             
             # Calculate respective changes in species for each interface. This
             #   is done separately due to some species being produced/consumed
@@ -303,21 +927,21 @@ class cc_cycling(Implicit_Problem):
             R_L = sdot_L*A_L
             if SV[offset + ptr['eps_S8']] < 1e-25:
 #                sdot_S8 = 0*S_el_s.get_net_production_rates(sulfur)
-                sdot_S = 0*S_el_s.get_net_production_rates(elyte)
+                sdot_S = 0*net_rates(S_el_s, elyte)
                 R_S = sdot_S*A_S
             else:
 #                sdot_S8 = S_el_s.get_net_production_rates(sulfur)
-                sdot_S = S_el_s.get_net_production_rates(elyte)
+                sdot_S = net_rates(S_el_s, elyte)
                 R_S = sdot_S*A_S
                             
-            i_Far = C_el_s.get_net_production_rates(conductor)*F*A_C/cat.dyInv
+            i_Far = net_rates(C_el_s, conductor)*F*A_C*cat.dy_vec[j]
             
             # Net rate of formation
             R_net = R_C + R_S + R_L
             R_net[cat.ptr['iFar']] += (-i_Far + i_el_m - i_el_p)/cat.H/F
             
-            sdot_S8 = S_el_s.get_net_production_rates(sulfur)
-            sdot_Li2S = L_el_s.get_net_production_rates(Li2S)            
+            sdot_S8 = net_rates(S_el_s, sulfur)
+            sdot_Li2S = net_rates(L_el_s, Li2S)            
             
             """Calculate change in Sulfur"""                
             res[offset + ptr['eps_S8']] = (SV_dot[offset + ptr['eps_S8']] - sulfur.volume_mole*sdot_S8*A_S)
@@ -327,12 +951,12 @@ class cc_cycling(Implicit_Problem):
             
             """Calculate change in electrolyte"""
             res[offset + ptr['rho_k_el']] = (SV_dot[offset + ptr['rho_k_el']] - 
-            (R_net + (N_io_m - N_io_p)*cat.dyInv)/eps_el 
+            (R_net + (N_io_m - N_io_p)*cat.dyInv_vec[j])/eps_el 
             + SV[offset + ptr['rho_k_el']]*(- SV_dot[offset + ptr['eps_S8']] 
                                             - SV_dot[offset + ptr['eps_Li2S']])/eps_el)
             
             """Calculate change in delta-phi double layer"""
-            res[offset + ptr['phi_dl']] = SV_dot[offset + ptr['phi_dl']] - (-i_Far + i_el_m - i_el_p)*cat.dyInv/cat.C_dl/A_C
+            res[offset + ptr['phi_dl']] = SV_dot[offset + ptr['phi_dl']] - (-i_Far + i_el_m - i_el_p)*cat.dyInv_vec[j]/cat.C_dl/A_C
             
             """Algebraic expression for charge neutrality in all phases"""
             res[offset + ptr['phi_ed']] = i_el_m - i_el_p + i_io_m - i_io_p
@@ -343,71 +967,451 @@ class cc_cycling(Implicit_Problem):
             """Calculate change in Li2S nucleation sites"""
             res[offset + ptr['np_Li2S']] = SV_dot[offset + ptr['np_Li2S']]
         
-        """==================Separator boundary conditions=================="""
+        """==========Separator and anode boundary conditions==========="""
         
-        i_io_m = i_io_p
-        N_io_m = N_io_p
-        s1 = dict(s2)
+        res = sep_an_res(SV, SV_dot, res, N_io_p, i_io_p, i_ext, cell)
         
-        # Shift forward to NEXT node
-        j = 0; offset = an.offsets[int(j)]
-        s2 = set_state(SV, offset, an.ptr)
+#        print(res, '\n')
+#        print(SV, '\n')
+#        print(SV, '\n', res, '\n\n')
+#        print(t)
         
-        dyInv_boundary = 1/(0.5*(sep.dy + an.dy))
+        return res  
+      
+    "========================================================================="
+    
+    def res_fun_vec(t, SV, SV_dot, cell):
         
-        # Shift back to THIS node
-        offset = sep.offsets[int(j)]
+        cat, sep, an, inputs = cell.cathode, cell.sep, cell.anode, cell.inputs
+        res = np.zeros_like(SV)
+        ptr = cat.ptr; F = ct.faraday
+        i_ext = external_current(cell, SV)
         
-        D_el = sep.D_el 
+        # (npoints, nVars) views of the cathode block, one row per node
+        SV_cat = SV[cat.offsets[0]:cat.offsets[0] + cat.nSV].reshape(cat.npoints, cat.nVars)
+        SV_dot_cat = SV_dot[cat.offsets[0]:cat.offsets[0] + cat.nSV].reshape(cat.npoints, cat.nVars)
+        res_cat = res[cat.offsets[0]:cat.offsets[0] + cat.nSV].reshape(cat.npoints, cat.nVars)
         
-        # Current node plus face boundary conditions
-        N_io_p, i_io_p = dst(s1, s2, D_el, dyInv_boundary)
+        """Cathode node states"""
+        np_S = SV_cat[:, ptr['np_S8']]
+        np_L = SV_cat[:, ptr['np_Li2S']]
+        eps_S8 = np.maximum(SV_cat[:, ptr['eps_S8']], 1e-25)
+        eps_Li2S = np.maximum(SV_cat[:, ptr['eps_Li2S']], 1e-25)
+        eps_el = 1 - cat.eps_C_0 - eps_S8 - eps_Li2S
         
-        res[offset + sep.ptr['rho_k_el']] = (SV_dot[offset + sep.ptr['rho_k_el']]
-        - (N_io_m - N_io_p)*sep.dyInv/sep.epsilon_el)
-                
-        res[offset + sep.ptr['phi']] = i_io_m - i_io_p
+        s_cat = StateView(SV, cat)
+        C_k, C_tot, X_k = s_cat.C_k, s_cat.C_tot, s_cat.X_k
+        phi_ed, phi_el = s_cat.phi_ed, s_cat.phi_el
         
-        """====================Anode boundary conditions===================="""
-          
-        i_io_m = i_io_p
-        N_io_m = N_io_p
-        i_el_m = 0
-        s1 = dict(s2)
+        # Calculate new particle radii based on new volume fractions
+        A_S = 3*eps_S8**(2/3)/(3*cat.V_0/2/pi/np_S)**(1/3)
+        A_L = 3*eps_Li2S/(3*eps_Li2S*cat.V_0/2/pi/np_L)**(1/3)
         
-        j = 0
-        offset = an.offsets[int(j)]
+        r_S = 3*eps_S8/A_S
+        r_L = 3*eps_Li2S/A_L
         
-        i_el_p = i_ext
-        i_io_p = 0
-        N_io_p = 0
+        A_C = inputs.A_C_0 - (pi*np_S*r_S**2)/cat.V_0 - (pi*np_L*r_L**2)/cat.V_0
         
-        elyte.X = s1['X_k']
-        elyte.electric_potential = s1['phi_el']
-        lithium.electric_potential = s1['phi_ed']
-        conductor.electric_potential = s1['phi_ed']
+        """Face fluxes"""
+        # Electronic current enters at the current collector (face 0) and 
+        #   cannot leave through the separator face (face npoints)
+        i_el = np.zeros([cat.npoints + 1])
+        i_el[0] = i_ext
+        i_el[1:-1] = cat.sigma_eff*(phi_ed[:-1] - phi_ed[1:])*cat.dyInv_face
         
-        sdot_Li = lithium_s.get_net_production_rates(elyte)
-        sdot_Far = lithium_s.get_net_production_rates(conductor)
+        # Ionic fluxes across every face of the cathode -> separator -> anode
+        #   chain in one call. Cathode face 0 (current collector) has no flux
+        N_face, i_face = chain_fluxes(SV, cell, eps_el)
         
-        R_net = sdot_Li*an.A_Li
-        i_Far = sdot_Far*an.A_Li*F*an.dy
+        N_io = np.zeros([cat.npoints + 1, elyte.n_species])
+        i_io = np.zeros([cat.npoints + 1])
+        N_io[1:] = N_face[:cat.npoints]
+        i_io[1:] = i_face[:cat.npoints]
         
-        res[offset + an.ptr['rho_k_el']] = (SV_dot[offset + an.ptr['rho_k_el']]
-        - (R_net + (N_io_m - N_io_p)*an.dyInv)/an.eps_el)
-
-        res[offset + an.ptr['phi_dl']] = (SV_dot[offset + an.ptr['phi_dl']]
-        - (-i_Far + i_el_m - i_el_p)*an.dyInv/an.C_dl/an.A_Li) 
+        """Reaction rates"""
+        sdot_C, sdot_L, sdot_S, sdot_S8, sdot_Li2S, sdot_Far = \
+            cathode_kinetics(X_k, phi_ed, phi_el)
         
-        res[offset + an.ptr['phi_ed']] = SV[offset + an.ptr['phi_ed']]
+        # No sulfur dissolution once the solid sulfur is consumed
+        sdot_S = sdot_S*(SV_cat[:, ptr['eps_S8']] >= 1e-25)[:, None]
         
-#        print(res, '\n')
-#        print(SV, '\n')
-#        print(SV, '\n', res, '\n\n')
-#        print(t)
+        i_Far = sdot_Far*F*A_C*cat.dy_vec
+        i_dl = -i_Far + i_el[:-1] - i_el[1:]
         
-        return res  
-      
+        # Net rate of formation
+        R_net = sdot_C*A_C[:, None] + sdot_S*A_S[:, None] + sdot_L*A_L[:, None]
+        R_net[:, ptr['iFar']] += i_dl*cat.dyInv_vec/F
+        
+        """Calculate change in Sulfur"""
+        res_cat[:, ptr['eps_S8']] = (SV_dot_cat[:, ptr['eps_S8']] 
+                                     - sulfur.volume_mole*sdot_S8*A_S)
+        
+        """Calculate change in Li2S"""
+        res_cat[:, ptr['eps_Li2S']] = (SV_dot_cat[:, ptr['eps_Li2S']] 
+                                       - Li2S.volume_mole*sdot_Li2S*A_L)
+        
+        """Calculate change in electrolyte"""
+        eps_dot = SV_dot_cat[:, ptr['eps_S8']] + SV_dot_cat[:, ptr['eps_Li2S']]
+        res_cat[:, ptr['rho_k_el']] = (SV_dot_cat[:, ptr['rho_k_el']] 
+            - (R_net + (N_io[:-1] - N_io[1:])*cat.dyInv_vec[:, None])/eps_el[:, None]
+            - C_k*eps_dot[:, None]/eps_el[:, None])
+        
+        """Calculate change in delta-phi double layer"""
+        res_cat[:, ptr['phi_dl']] = (SV_dot_cat[:, ptr['phi_dl']] 
+                                     - i_dl*cat.dyInv_vec/cat.C_dl/A_C)
+        
+        """Algebraic expression for charge neutrality in all phases"""
+        res_cat[:, ptr['phi_ed']] = i_el[:-1] - i_el[1:] + i_io[:-1] - i_io[1:]
+        
+        """Calculate change in S8 and Li2S nucleation sites"""
+        res_cat[:, ptr['np_S8']] = SV_dot_cat[:, ptr['np_S8']]
+        res_cat[:, ptr['np_Li2S']] = SV_dot_cat[:, ptr['np_Li2S']]
+        
+        """==========Separator and anode boundary conditions==========="""
+        
+        res = sep_an_res(SV, SV_dot, res, N_io[-1], i_io[-1], i_ext, cell,
+                         (N_face[cat.npoints:], i_face[cat.npoints:]))
+        
+        return res
+    
+    "========================================================================="
+    
+    def handle_result(self, solver, t, SV, SV_dot):
+        """Solver output hook. Points go to the solver's own result lists, or
+        are streamed to self.sink when one is attached. With steady_stop the
+        accepted steps also track the window of steady_event."""
+        if self.steady_stop:
+            self.track_steady(t, SV, SV_dot)
+        
+        if getattr(self, 'sink', None) is None:
+            Implicit_Problem.handle_result(self, solver, t, SV, SV_dot)
+        else:
+            self.sink.append(t, SV, SV_dot)
+    
+    "========================================================================="
+    
+    def jac(self, c, t, SV, SV_dot):
+        """Jacobian of res_fun_vec for IDA's dense linear solver, 
+        dres/dSV + c*dres/dSV_dot."""
+        return self.jac_sparse(c, t, SV, SV_dot).toarray()
+    
+    "========================================================================="
+    
+    def jacv(self, t, SV, SV_dot, res, v, c):
+        """Jacobian times vector for IDA's SPGMR linear solver. The Krylov 
+        iterations of one Newton step share SV and c, so the sparse Jacobian 
+        is only rebuilt when either of them changes."""
+        cache = getattr(self, '_jacv_cache', None)
+        if (cache is None or cache[0] != c or not np.array_equal(cache[1], SV)
+            or not np.array_equal(cache[2], SV_dot)):
+            cache = (c, SV.copy(), SV_dot.copy(), self.jac_sparse(c, t, SV, SV_dot))
+            self._jacv_cache = cache
+            
+        return cache[3].dot(v)
+    
+    "========================================================================="
+    
+    @profiler.timed('jac', outer=True)
+    def jac_sparse(self, c, t, SV, SV_dot):
+        """dres/dSV + c*dres/dSV_dot as a sparse matrix, either analytic or
+        by coloured finite differences depending on inputs.flag_jac."""
+        if self.cell.inputs.flag_jac == 2:
+            return self.jac_fd(c, t, SV, SV_dot)
+        else:
+            return self.jac_analytic(c, t, SV, SV_dot)
+    
+    "========================================================================="
+    
+    def jac_fd(self, c, t, SV, SV_dot):
+        """Finite difference Jacobian of the problem residual using the column
+        colouring of jac_pattern. Columns of the same colour never touch the 
+        same row, so they are perturbed together and one residual call fills
+        all of them. Each perturbation moves SV by h and SV_dot by c*h, as in
+        IDA's own difference quotients."""
+        # One pattern and colouring with and one without a voltage hold
+        hold = self.cell.cathode.V_hold is not None
+        if getattr(self, '_fd_colors', None) is None:
+            self._fd_pattern = {}; self._fd_colors = {}
+        if hold not in self._fd_colors:
+            pattern = jac_pattern(self.cell, hold)
+            self._fd_pattern[hold] = pattern.nonzero()
+            self._fd_colors[hold] = jac_colors(pattern)
+            
+        return jac_colored(lambda h_c: self.res(t, SV + h_c, SV_dot + c*h_c), SV,
+                           self._fd_pattern[hold], self._fd_colors[hold])
+    
+    "========================================================================="
+    
+    def jac_analytic(self, c, t, SV, SV_dot):
+        """Jacobian of res_fun_vec, dres/dSV + c*dres/dSV_dot, as a sparse 
+        matrix. Nodes only interact with their neighbours through the face 
+        fluxes (dst and the electronic current), so only the block tridiagonal
+        entries in the cathode -> separator -> anode node order (jac_pattern)
+        are filled. All terms are analytic except the interface rates, which 
+        come from kinetics_jac."""
+        cat, sep, an, inputs = (self.cell.cathode, self.cell.sep, self.cell.anode, 
+                                self.cell.inputs)
+        J_rows = []; J_cols = []; J_vals = []
+        ptr = cat.ptr; F = ct.faraday; z_k = inputs.z_k_el
+        i_ext = external_current(self.cell, SV)
+        n = cat.npoints; offsets = cat.offsets; rho = ptr['rho_k_el']
+        
+        def add(rows, cols, block):
+            # Entries are kept in coordinate form; repeats are summed below
+            rows, cols = np.ix_(np.atleast_1d(rows), np.atleast_1d(cols))
+            rows, cols, block = np.broadcast_arrays(rows, cols, block)
+            J_rows.append(rows.ravel()); J_cols.append(cols.ravel())
+            J_vals.append(block.ravel())
+        
+        SV_cat = SV[offsets[0]:offsets[0] + cat.nSV].reshape(n, cat.nVars)
+        SV_dot_cat = SV_dot[offsets[0]:offsets[0] + cat.nSV].reshape(n, cat.nVars)
+        
+        """Cathode node states, same as res_fun_vec"""
+        np_S = SV_cat[:, ptr['np_S8']]
+        np_L = SV_cat[:, ptr['np_Li2S']]
+        eps_S8 = np.maximum(SV_cat[:, ptr['eps_S8']], 1e-25)
+        eps_Li2S = np.maximum(SV_cat[:, ptr['eps_Li2S']], 1e-25)
+        eps_el = 1 - cat.eps_C_0 - eps_S8 - eps_Li2S
+        
+        # Slopes of the 1e-25 floor on the volume fractions
+        m_S = (SV_cat[:, ptr['eps_S8']] > 1e-25)*1.
+        m_L = (SV_cat[:, ptr['eps_Li2S']] > 1e-25)*1.
+        g_S = (SV_cat[:, ptr['eps_S8']] >= 1e-25)*1.
+        
+        s_cat = StateView(SV, cat)
+        C_k, C_tot = s_cat.C_k, s_cat.C_tot
+        phi_ed, phi_dl, phi_el = s_cat.phi_ed, s_cat.phi_dl, s_cat.phi_el
+        
+        A_S = 3*eps_S8**(2/3)/(3*cat.V_0/2/pi/np_S)**(1/3)
+        A_L = 3*eps_Li2S/(3*eps_Li2S*cat.V_0/2/pi/np_L)**(1/3)
+        
+        r_S = 3*eps_S8/A_S
+        r_L = 3*eps_Li2S/A_L
+        
+        A_C = inputs.A_C_0 - (pi*np_S*r_S**2)/cat.V_0 - (pi*np_L*r_L**2)/cat.V_0
+        
+        # Area derivatives with respect to [eps_S8, eps_Li2S, np_S8, np_Li2S]
+        zero = np.zeros([n])
+        dA_S = np.column_stack((2/3*A_S/eps_S8*m_S, zero, A_S/3/np_S, zero))
+        dA_L = np.column_stack((zero, 2/3*A_L/eps_Li2S*m_L, zero, A_L/3/np_L))
+        dA_C = np.column_stack((-2/3*pi*np_S*r_S**2/cat.V_0/eps_S8*m_S,
+                                -2/3*pi*np_L*r_L**2/cat.V_0/eps_Li2S*m_L,
+                                -pi*r_S**2/3/cat.V_0, -pi*r_L**2/3/cat.V_0))
+        deps_el = np.column_stack((-m_S, -m_L, zero, zero))
+        
+        """Face fluxes and the columns of SV they depend on"""
+        i_el = np.zeros([n + 1])
+        i_el[0] = i_ext
+        i_el[1:-1] = cat.sigma_eff*(phi_ed[:-1] - phi_ed[1:])*cat.dyInv_face
+        
+        # Face 0 only depends on SV under a voltage hold, through the cell
+        #   voltage
+        el_faces = [hold_current_jac(self.cell)]
+        for f in np.arange(1, n):
+            el_faces.append((np.array([offsets[f-1], offsets[f]]) + ptr['phi_ed'], 
+                             np.array([1., -1.])*cat.sigma_eff*cat.dyInv_face[f-1]))
+        el_faces.append((np.array([], dtype=int), np.array([])))
+        
+        s_sep = StateView(SV, sep).node(0)
+        s1 = {'C_k': C_k, 'C_tot': C_tot, 'phi_el': phi_el[:, None]}
+        s2 = {'C_k': np.vstack((C_k[1:], s_sep['C_k'])), 
+              'C_tot': np.append(C_tot[1:], s_sep['C_tot']),
+              'phi_el': np.append(phi_el[1:], s_sep['phi_el'])[:, None]}
+        
+        eps_face = np.append(0.5*(eps_el[:-1] + eps_el[1:]), eps_el[-1])
+        D_el = cat.D_el*eps_face[:, None]**(1.5)
+        dyInv_face = self.cell.faces.dyInv[:n, None]
+        
+        N_io = np.zeros([n + 1, elyte.n_species])
+        N_io[1:] = chain_fluxes(SV, self.cell, eps_el)[0][:n]
+        dN_dC1, dN_dC2, dN_dphi1, dN_dphi2 = dst_jac(s1, s2, D_el, dyInv_face)
+        
+        # For each face, the SV columns of the nodes on either side and dN/dSV
+        #   for those columns. Face 0 (current collector) carries no flux.
+        node_cols = np.array([ptr['phi_ed'], ptr['phi_dl'], ptr['eps_S8'], ptr['eps_Li2S']])
+        ion_faces = [(np.array([], dtype=int), np.zeros([elyte.n_species, 0]))]
+        for f in np.arange(1, n + 1):
+            w = 0.5 if f < n else 1.
+            dN_deps = 1.5*N_io[f]/eps_face[f-1]
+            cols = [offsets[f-1] + rho, offsets[f-1] + node_cols]
+            block = [np.diag(dN_dC1[f-1]), 
+                     np.column_stack((dN_dphi1[f-1], -dN_dphi1[f-1], 
+                                      -w*m_S[f-1]*dN_deps, -w*m_L[f-1]*dN_deps))]
+            if f < n:
+                cols += [offsets[f] + rho, offsets[f] + node_cols]
+                block += [np.diag(dN_dC2[f-1]),
+                          np.column_stack((dN_dphi2[f-1], -dN_dphi2[f-1], 
+                                           -w*m_S[f]*dN_deps, -w*m_L[f]*dN_deps))]
+            else:
+                cols += [sep.offsets[0] + sep.ptr['rho_k_el'], 
+                         [sep.offsets[0] + sep.ptr['phi']]]
+                block += [np.diag(dN_dC2[f-1]), dN_dphi2[f-1][:, None]]
+            ion_faces.append((np.hstack(cols), np.hstack(block)))
+        
+        """Reaction rates and their derivatives"""
+        (sdot_C, sdot_L, sdot_S, sdot_S8, sdot_Li2S, sdot_Far), \
+        (dC_du, dL_du, dS_du, dS8_du, dLi2S_du, dFar_du) = \
+            kinetics_jac(cathode_kinetics, C_k, phi_ed, phi_dl)
+        
+        sdot_S = sdot_S*g_S[:, None]
+        dS_du = dS_du*g_S[:, None, None]
+        
+        i_Far = sdot_Far*F*A_C*cat.dy_vec
+        i_dl = -i_Far + i_el[:-1] - i_el[1:]
+        
+        R_net = sdot_C*A_C[:, None] + sdot_S*A_S[:, None] + sdot_L*A_L[:, None]
+        R_net[:, ptr['iFar']] += i_dl*cat.dyInv_vec/F
+        
+        eps_dot = SV_dot_cat[:, ptr['eps_S8']] + SV_dot_cat[:, ptr['eps_Li2S']]
+        Q = R_net + (N_io[:-1] - N_io[1:])*cat.dyInv_vec[:, None] + C_k*eps_dot[:, None]
+        
+        """Cathode rows"""
+        u_loc = np.hstack((rho, ptr['phi_ed'], ptr['phi_dl']))
+        g_loc = np.array([ptr['eps_S8'], ptr['eps_Li2S'], ptr['np_S8'], ptr['np_Li2S']])
+        I_k = np.eye(elyte.n_species)
+        for j in np.arange(0, n):
+            o = offsets[j]
+            u_cols = o + u_loc; g_cols = o + g_loc; rho_rows = o + rho
+            
+            # Net electronic and ionic flux into node j
+            el_cols = np.hstack((el_faces[j][0], el_faces[j+1][0]))
+            del_in = np.hstack((el_faces[j][1], -el_faces[j+1][1]))
+            ion_cols = np.hstack((ion_faces[j][0], ion_faces[j+1][0]))
+            dN_in = np.hstack((ion_faces[j][1], -ion_faces[j+1][1]))
+            
+            """Sulfur and Li2S volume fractions"""
+            r = o + ptr['eps_S8']
+            add(r, u_cols, -sulfur.volume_mole*A_S[j]*dS8_du[j][None, :])
+            add(r, g_cols, -sulfur.volume_mole*sdot_S8[j]*dA_S[j][None, :])
+            add(r, r, c)
+            
+            r = o + ptr['eps_Li2S']
+            add(r, u_cols, -Li2S.volume_mole*A_L[j]*dLi2S_du[j][None, :])
+            add(r, g_cols, -Li2S.volume_mole*sdot_Li2S[j]*dA_L[j][None, :])
+            add(r, r, c)
+            
+            """Electrolyte species"""
+            dQ_du = A_C[j]*dC_du[j] + A_S[j]*dS_du[j] + A_L[j]*dL_du[j]
+            dQ_du[ptr['iFar']] -= A_C[j]*dFar_du[j]
+            dQ_du[:, :elyte.n_species] += eps_dot[j]*I_k
+            
+            dQ_dg = (np.outer(sdot_C[j], dA_C[j]) + np.outer(sdot_S[j], dA_S[j]) 
+                     + np.outer(sdot_L[j], dA_L[j]))
+            dQ_dg[ptr['iFar']] -= sdot_Far[j]*dA_C[j]
+            
+            add(rho_rows, u_cols, -dQ_du/eps_el[j])
+            add(rho_rows, g_cols, -dQ_dg/eps_el[j] + np.outer(Q[j], deps_el[j])/eps_el[j]**2)
+            add(rho_rows[ptr['iFar']], el_cols, -del_in[None, :]*cat.dyInv_vec[j]/F/eps_el[j])
+            add(rho_rows, ion_cols, -dN_in*cat.dyInv_vec[j]/eps_el[j])
+            
+            add(rho_rows, rho_rows, c*I_k)
+            add(rho_rows, o + g_loc[:2], -c*np.outer(C_k[j], [1., 1.])/eps_el[j])
+            
+            """Double layer potential"""
+            r = o + ptr['phi_dl']
+            di_dl_du = -F*A_C[j]*dFar_du[j]/cat.dyInv_vec[j]
+            di_dl_dg = -F*sdot_Far[j]*dA_C[j]/cat.dyInv_vec[j]
+            add(r, u_cols, -cat.dyInv_vec[j]/cat.C_dl/A_C[j]*di_dl_du[None, :])
+            add(r, g_cols, -cat.dyInv_vec[j]/cat.C_dl*(di_dl_dg/A_C[j] 
+                           - i_dl[j]*dA_C[j]/A_C[j]**2)[None, :])
+            add(r, el_cols, -cat.dyInv_vec[j]/cat.C_dl/A_C[j]*del_in[None, :])
+            add(r, r, c)
+            
+            """Charge neutrality"""
+            r = o + ptr['phi_ed']
+            add(r, el_cols, del_in[None, :])
+            add(r, ion_cols, F*np.dot(z_k, dN_in)[None, :])
+            
+            """Nucleation sites"""
+            add(o + ptr['np_S8'], o + ptr['np_S8'], c)
+            add(o + ptr['np_Li2S'], o + ptr['np_Li2S'], c)
+        
+        """Separator and anode faces"""
+        # Each separator and anode node as (concentration columns, potential
+        #   columns, d(phi_el)/d(potentials)). phi_el is phi in the separator 
+        #   and phi_ed - phi_dl in the anode
+        chain = ([(o + sep.ptr['rho_k_el'], np.array([o + sep.ptr['phi']]), 
+                   np.array([1.])) for o in sep.offsets]
+                 + [(o + an.ptr['rho_k_el'], o + np.array([an.ptr['phi_ed'], an.ptr['phi_dl']]),
+                     np.array([1., -1.])) for o in an.offsets])
+        
+        s_sep = StateView(SV, sep); s_an = StateView(SV, an)
+        C_k = np.concatenate((s_sep.C_k, s_an.C_k))
+        phi_el = np.concatenate((s_sep.phi_el, s_an.phi_el))[:, None]
+        s1 = {'C_k': C_k[:-1], 'phi_el': phi_el[:-1]}
+        s2 = {'C_k': C_k[1:], 'phi_el': phi_el[1:]}
+        dN_dC1, dN_dC2, dN_dphi1, dN_dphi2 = dst_jac(s1, s2, 
+            self.cell.faces.D_el[n:], self.cell.faces.dyInv[n:, None])
+        
+        # Faces into each separator and anode node: the cathode/separator 
+        #   face, then the faces between the nodes of the chain. Nothing 
+        #   leaves through the anode current collector
+        chain_faces = [ion_faces[n]]
+        for f in np.arange(0, len(chain) - 1):
+            (rho_1, phi_1, g_1), (rho_2, phi_2, g_2) = chain[f], chain[f+1]
+            chain_faces.append((np.hstack((rho_1, phi_1, rho_2, phi_2)),
+                                np.hstack((np.diag(dN_dC1[f]), dN_dphi1[f][:, None]*g_1,
+                                           np.diag(dN_dC2[f]), dN_dphi2[f][:, None]*g_2))))
+        chain_faces.append((np.array([], dtype=int), np.zeros([elyte.n_species, 0])))
+        
+        """Separator rows"""
+        for j, o in enumerate(sep.offsets):
+            rho_sep = o + sep.ptr['rho_k_el']
+            f_in, f_out = chain_faces[j], chain_faces[j+1]
+            
+            add(rho_sep, f_in[0], -f_in[1]*sep.dyInv/sep.epsilon_el)
+            add(rho_sep, f_out[0], f_out[1]*sep.dyInv/sep.epsilon_el)
+            add(rho_sep, rho_sep, c*I_k)
+            
+            r = o + sep.ptr['phi']
+            add(r, f_in[0], F*np.dot(z_k, f_in[1])[None, :])
+            add(r, f_out[0], -F*np.dot(z_k, f_out[1])[None, :])
+        
+        """Anode rows"""
+        _, (dLi_du, dFar_du) = kinetics_jac(anode_kinetics, s_an.C_k, s_an.phi_ed, 
+                                            s_an.phi_dl)
+        
+        # Electronic faces of the anode: none through the separator face, 
+        #   the external current through the current collector face
+        an_el_faces = [(np.array([], dtype=int), np.array([]))]
+        for f in np.arange(1, an.npoints):
+            an_el_faces.append((np.array([an.offsets[f-1], an.offsets[f]]) + an.ptr['phi_ed'],
+                                np.array([1., -1.])*an.sigma_eff*an.dyInv))
+        an_el_faces.append(el_faces[0])
+        
+        for j, o in enumerate(an.offsets):
+            rho_an = o + an.ptr['rho_k_el']
+            u_cols = np.hstack((rho_an, o + an.ptr['phi_ed'], o + an.ptr['phi_dl']))
+            f_in, f_out = chain_faces[sep.npoints + j], chain_faces[sep.npoints + j + 1]
+            el_in, el_out = an_el_faces[j], an_el_faces[j+1]
+            
+            add(rho_an, u_cols, -an.A_Li*dLi_du[j]/an.eps_el)
+            add(rho_an, f_in[0], -f_in[1]*an.dyInv/an.eps_el)
+            add(rho_an, f_out[0], f_out[1]*an.dyInv/an.eps_el)
+            add(rho_an, rho_an, c*I_k)
+            
+            r = o + an.ptr['phi_dl']
+            add(r, u_cols, F*an.dy*dFar_du[j][None, :]*an.dyInv/an.C_dl)
+            add(r, el_in[0], -el_in[1][None, :]*an.dyInv/an.C_dl/an.A_Li)
+            add(r, el_out[0], el_out[1][None, :]*an.dyInv/an.C_dl/an.A_Li)
+            add(r, r, c)
+            
+            # Charge neutrality, or the reference potential at the current
+            #   collector node
+            r = o + an.ptr['phi_ed']
+            if j < an.npoints - 1:
+                add(r, el_in[0], el_in[1][None, :])
+                add(r, el_out[0], -el_out[1][None, :])
+                add(r, f_in[0], F*np.dot(z_k, f_in[1])[None, :])
+                add(r, f_out[0], -F*np.dot(z_k, f_out[1])[None, :])
+            else:
+                add(r, r, 1.)
+        
+        J = sparse.coo_matrix((np.hstack(J_vals), (np.hstack(J_rows), np.hstack(J_cols))),
+                              shape=(SV.size, SV.size))
+        
+        return J.tocsc()
+    
     "========================================================================="
     
     def set_state():
@@ -417,13 +1421,14 @@ class cc_cycling(Implicit_Problem):
     
     def state_events(self, t, y, yd, sw):
         
-        event1 = np.zeros([cat.npoints*int(y[cat.ptr_vec['np_S8']])])
-        event2 = np.zeros([cat.npoints*int(y[cat.ptr_vec['np_S8']])])
+        cat = self.cell.cathode
+        event1 = np.zeros([int(np.sum(y[cat.ptr_vec['np_S8']]))])
+        event2 = np.zeros([int(np.sum(y[cat.ptr_vec['np_S8']]))])
         event1 = 1 - y[cat.ptr_vec['eps_S8']]
 #        event2 = y[cat.ptr_vec['eps_S8']]
         
-        event3 = np.zeros([cat.npoints*int(y[cat.ptr_vec['np_Li2S']])])
-        event4 = np.zeros([cat.npoints*int(y[cat.ptr_vec['np_Li2S']])])
+        event3 = np.zeros([int(np.sum(y[cat.ptr_vec['np_Li2S']]))])
+        event4 = np.zeros([int(np.sum(y[cat.ptr_vec['np_Li2S']]))])
         event3 = 1 - y[cat.ptr_vec['eps_Li2S']]
         event4 = y[cat.ptr_vec['eps_Li2S']]
         
@@ -435,20 +1440,94 @@ class cc_cycling(Implicit_Problem):
         event7 = np.zeros([cat.npoints*elyte.n_species])
         event7 = y[cat.ptr_vec['rho_k_el']] - 1e-50
         
+        event8 = self.steady_event(t, y, yd)
+        
+        event9 = self.cutoff_event(y)
         
         events = np.concatenate((event1, event2, event3, event4, event5, event6,
-                                 event7))
-
+                                 event7, event9, event8))
+        
         return events
     
     "========================================================================="
     
+    def event_names(self, y):
+        """Name of each entry of state_events(t, y, ...), in the same order."""
+        cat = self.cell.cathode
+        nodes = [str(j + 1) for j in np.arange(0, cat.npoints)]
+        
+        return (['eps_S8 = 1 in node ' + j for j in nodes]
+                + ['unused'] * int(np.sum(y[cat.ptr_vec['np_S8']]))
+                + ['eps_Li2S = 1 in node ' + j for j in nodes]
+                + ['eps_Li2S = 0 in node ' + j for j in nodes]
+                + ['unused'] * cat.npoints
+                + ['phi_ed = 1.6 V in node ' + j for j in nodes]
+                + [k + ' depleted in node ' + j for j in nodes for k in elyte.species_names]
+                + ['lower voltage cutoff', 'upper voltage cutoff', 'steady state'])
+    
+    "========================================================================="
+    
+    def cutoff_event(self, y):
+        """Lower and upper cell voltage cutoffs of the current protocol step,
+        self.V_limits = (V_min, V_max). Either may be None."""
+        cat, an = self.cell.cathode, self.cell.anode
+        V_min, V_max = getattr(self, 'V_limits', (None, None))
+        V_cell = y[cat.offsets[0] + cat.ptr['phi_ed']] - y[an.offsets[-1] + an.ptr['phi_ed']]
+        
+        return np.array([1. if V_min is None else V_cell - V_min, 
+                         1. if V_max is None else V_max - V_cell])
+    
+    "========================================================================="
+    
+    def steady_event(self, t, y, yd):
+        """Convergence event for the equilibration, the last of state_events.
+        Positive while the cell settles and crosses zero once the weighted 
+        norm of the differential rates has stayed under inputs.eq_steady_tol
+        for inputs.eq_steady_window seconds. Only active with steady_stop, 
+        which run_stage sets for the equilibration. The window is tracked on
+        accepted steps (track_steady), so the root finder's trial points do
+        not change it."""
+        window = self.cell.inputs.eq_steady_window
+        if not self.steady_stop:
+            return np.ones(1)
+        if self.t_steady is None:
+            return np.array([window])
+        
+        return np.array([window - (t - self.t_steady)])
+    
+    "========================================================================="
+    
+    def track_steady(self, t, y, yd):
+        """Start of the current stretch of accepted steps with the weighted
+        norm of the differential rates under inputs.eq_steady_tol."""
+        inputs = self.cell.inputs
+        atol, rtol = tolerances(self.cell, y)
+        diff = self.cell.sol_init.algvar == 1
+        norm = np.sqrt(np.mean((yd[diff]/(rtol*np.abs(y[diff]) + atol[diff]))**2))
+        
+        if norm >= inputs.eq_steady_tol:
+            self.t_steady = None
+        elif self.t_steady is None:
+            self.t_steady = t
+    
+    def reset_steady(self):
+        """Forget the steady window, at the start of every stage or step."""
+        self.t_steady = None
+    
+    "========================================================================="
+    
     def handle_event(self, solver, event_info):
         
         state_info = event_info[0]
         
+        if state_info[-1]:
+            print('Steady state reached at t =', solver.t)
+            raise TerminateSimulation
+        
         if any(state_info):
-            print('shoulda stopped')
+            fired = [name for name, hit in zip(self.event_names(solver.y), state_info) 
+                     if hit]
+            print('Stopped at t =', solver.t, 'by', ', '.join(fired))
             raise TerminateSimulation
 #        while True:
 #            self.event_switch(solver, event_info)
@@ -482,7 +1561,24 @@ class cc_cycling(Implicit_Problem):
     
     
 if __name__ == "__main__":
-    SV_eq, SV_dch, tags = main()
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache', action='store_true',
+                        help='reuse and store equilibrated states (inputs.flag_eq_cache)')
+    parser.add_argument('--no-cache', action='store_true', 
+                        help='equilibrate even if a cached state exists')
+    parser.add_argument('--resume', nargs='?', const=inputs.checkpoint_file,
+                        help='continue from a checkpoint (inputs.checkpoint_file)')
+    args, unknown = parser.parse_known_args()
+    if args.cache:
+        inputs.flag_eq_cache = 1
+    if args.no_cache:
+        inputs.flag_eq_cache = 0
+        
+    if args.resume is not None:
+        SV_eq, SV_dch, tags = resume(args.resume)
+    else:
+        SV_eq, SV_dch, tags = main()
 #    SV_eq_df, SV_ch_df, SV_req_df = main()
 #    SV_eq, SV_ch, SV_req, SV_dch = main()
 
@@ -8,16 +8,24 @@ from li_s_battery_inputs import inputs
 from li_s_battery_init import anode
 from li_s_battery_init import cathode
 from li_s_battery_init import sep
+from li_s_battery_init import cell
 from li_s_battery_init import elyte_obj, sulfur_obj, Li2S_obj, carbon_obj, conductor_obj
 from li_s_battery_init import carbon_el_s, Li2S_el_s, sulfur_el_s
-from li_s_battery_functions import dst, set_state, set_state_sep
+from li_s_battery_init import cathode_faradaic
+from li_s_battery_functions import chain_fluxes, StateView, discharge_summary
 from matplotlib import pyplot as plt
 from math import pi
 import numpy as np
 import pandas as pd
 import cantera as ct
 
-def conservation_tests(SV, tags):
+def conservation_balances(SV, tags, cell=cell):
+    """Sulfur, lithium and charge balances of the trajectory SV at every time
+    point, as a dict of arrays, for conservation_tests to plot."""
+    # SV is a labeled DataFrame or a TrajectoryReader, which is read one 
+    #   chunk of rows at a time. All time points of a chunk are checked 
+    #   together with array operations
+    cathode, sep, anode, inputs = cell.cathode, cell.sep, cell.anode, cell.inputs
     F = ct.faraday
     flag_cat = 1
     flag_sep = 1
@@ -49,74 +57,80 @@ def conservation_tests(SV, tags):
     eps_Li2S_vec = np.zeros([len(SV.index)])
     eps_el_vec = np.zeros([len(SV.index)])
     eps_C_vec = np.zeros([len(SV.index)])
+    t_vec = np.zeros([len(SV.index)])
     
-    for i, state in SV.iterrows():
+    a = 0; t_prev = None
+    for state in iter_chunks(SV):
         # We will check several items to ensure conservation at each time step.
         # All quantities will be per cell area
         #   1. sulfur atoms in all phases
         #   2. lithium atoms in all phases
         #   3. charge neutrality in electrolyte and carbon
+        # Each is evaluated for all time points of the chunk at once, rows of
+        #   state are time points
+        rows = slice(a, a + state.shape[0])
+        a += state.shape[0]
         
         """1. Conservation of sulfur"""
-        np_S = state.iloc[cathode.ptr['np_S8']]
-        np_L = state.iloc[cathode.ptr['np_Li2S']]
-        
-        # Volume fractions at current state
-        eps_S8 = max(state.iloc[cathode.ptr['eps_S8']], 1e-25)
-        eps_Li2S = max(state.iloc[cathode.ptr['eps_Li2S']], 1e-25)
+        # Volume fractions at current state of every cathode node 
+        #   (n_times, npoints), weighted by the node thicknesses dy
+        dy = cathode.dy_vec
+        eps_S8 = np.maximum(state[:, cathode.ptr_vec['eps_S8']], 1e-25)
+        eps_Li2S = np.maximum(state[:, cathode.ptr_vec['eps_Li2S']], 1e-25)
         eps_el = 1 - eps_S8 - eps_Li2S - cathode.eps_C_0
         
-        eps_S_vec[i] = eps_S8
-        eps_Li2S_vec[i] = eps_Li2S
-        eps_el_vec[i] = eps_el
-        eps_C_vec[i] = 1 - eps_S8 - eps_Li2S - eps_el
-
-        # Concentration vector for all species in elyte at current state
-        rho_el_cat = state.iloc[cathode.ptr['rho_k_el']]
-        rho_el_sep = state.iloc[sep.offsets[int(0)]+sep.ptr['rho_k_el']]
-        rho_el_an = state.iloc[anode.offsets[int(0)]+anode.ptr['rho_k_el']]
+        # Cathode averages
+        eps_S_vec[rows] = eps_S8.dot(dy)/cathode.H
+        eps_Li2S_vec[rows] = eps_Li2S.dot(dy)/cathode.H
+        eps_el_vec[rows] = eps_el.dot(dy)/cathode.H
+        eps_C_vec[rows] = 1 - eps_S_vec[rows] - eps_Li2S_vec[rows] - eps_el_vec[rows]
+        
+        # Concentration vector for all species in elyte at current state, for
+        #   every node of each component (n_times, npoints, n_species)
+        s_cat = StateView(state, cathode)
+        rho_el_cat = s_cat.C_k
+        rho_el_sep = StateView(state, sep).C_k
+        rho_el_an = StateView(state, anode).C_k
         
         # Concentration of just sulfur containing species in electrolyte
-        rho_S_el_cat = state.iloc[cathode.ptr['rho_k_el'][cathode.i_S8:]]
-        rho_S_el_sep = state.iloc[sep.offsets[int(0)]+sep.ptr['rho_k_el'][cathode.i_S8:]]
-        rho_S_el_an = state.iloc[anode.offsets[int(0)]+anode.ptr['rho_k_el'][cathode.i_S8:]]
-
+        rho_S_el_cat = rho_el_cat[..., cathode.i_S8:]
+        rho_S_el_sep = rho_el_sep[..., cathode.i_S8:]
+        rho_S_el_an = rho_el_an[..., cathode.i_S8:]
+        
         # Number of moles of sulfur atoms in elyte of each component
-        n_S_cat[i] = eps_el*cathode.H*np.dot(cathode.n_S_atoms, rho_S_el_cat)
-        n_S_sep[i] = sep.epsilon_el*sep.H*np.dot(cathode.n_S_atoms, rho_S_el_sep)
-        n_S_an[i] = anode.eps_el*anode.H*np.dot(cathode.n_S_atoms, rho_S_el_an)
+        n_S_cat[rows] = (eps_el*dy*np.dot(rho_S_el_cat, cathode.n_S_atoms)).sum(axis=1)
+        n_S_sep[rows] = sep.epsilon_el*sep.dy*np.dot(rho_S_el_sep, cathode.n_S_atoms).sum(axis=1)
+        n_S_an[rows] = anode.eps_el*anode.dy*np.dot(rho_S_el_an, cathode.n_S_atoms).sum(axis=1)
         
         # Number of moles of sulfur atoms in solid phases
-        n_S_solid = 8*sulfur_obj.density_mole*eps_S8*cathode.H
-        n_S_Li2S = Li2S_obj.density_mole*eps_Li2S*cathode.H
+        n_S_solid_vec[rows] = 8*sulfur_obj.density_mole*eps_S8.dot(dy)
+        n_S_Li2S_vec[rows] = Li2S_obj.density_mole*eps_Li2S.dot(dy)
         
-        n_S_elyte[i] = n_S_cat[i] + n_S_sep[i] + n_S_an[i]
-        n_S_solid_vec[i] = n_S_solid
-        n_S_Li2S_vec[i] = n_S_Li2S
-        n_S_tot[i] = (n_S_cat[i] + n_S_solid + n_S_Li2S) + n_S_sep[i] + n_S_an[i]
+        n_S_elyte[rows] = n_S_cat[rows] + n_S_sep[rows] + n_S_an[rows]
+        n_S_tot[rows] = n_S_elyte[rows] + n_S_solid_vec[rows] + n_S_Li2S_vec[rows]
         
         """2. Conservation of lithium"""
-        offset1 = cathode.offsets[-1]
-        s1 = set_state(state.values, offset1, cathode.ptr)
-        offset2 = sep.offsets[0]
-        s2 = set_state_sep(state.values, offset2, sep.ptr)
-        dyInv = 1/(0.5*(cathode.dy + sep.dy))
-        D_el = cathode.D_el*eps_el**(1.5)
-        N_io_sep, i_io_sep = dst(s1, s2, D_el, dyInv)
-#        print(N_io_sep, '\n')
-        if i == 0:
-            dt = 0
-        else:
-            dt = SV.iloc[i, -1] - SV.iloc[i-1, -1]
+        # Flux from the last cathode node into the separator, from the fluxes
+        #   of all faces at all time points
+        N_io, i_io = chain_fluxes(state, cell, eps_el)
+        N_io_sep = N_io[:, cathode.npoints - 1]
+        i_io_sep = i_io[:, cathode.npoints - 1]
+        
+        # Time steps, zero for the first point of the run
+        t = state[:, -1]
+        dt = np.diff(t, prepend=t[0] if t_prev is None else t_prev)
+        t_prev = t[-1]
+        t_vec[rows] = t
             
-        """Cantera objects (to get faradaic current)"""
-        carbon_obj.electric_potential = s1['phi_ed']
-        elyte_obj.electric_potential = s1['phi_el'] 
-        conductor_obj.electric_potential = s1['phi_ed']
-        
-        elyte_obj.X = s1['X_k']
-        
-        # Calculate new particle radii based on new volume fractions
+        """Faradaic current of every cathode node for all time points at once"""
+        n_t, n_y = state.shape[0], cathode.npoints
+        sdot_Far = cathode_faradaic(s_cat.X_k.reshape(n_t*n_y, -1), 
+                                    s_cat.phi_ed.reshape(-1), 
+                                    s_cat.phi_el.reshape(-1)).reshape(n_t, n_y)
+        
+        # Particle radii and carbon area of every node (n_times, npoints)
+        np_S = state[:, cathode.ptr_vec['np_S8']]
+        np_L = state[:, cathode.ptr_vec['np_Li2S']]
         A_S = 3*eps_S8/(3*eps_S8*cathode.V_0/2/pi/np_S)**(1/3)
         A_L = 3*eps_Li2S/(3*eps_Li2S*cathode.V_0/2/pi/np_L)**(1/3)
         
@@ -125,29 +139,29 @@ def conservation_tests(SV, tags):
         
         A_C = inputs.A_C_0 - (pi*np_S*r_S**2)/cathode.V_0 - (pi*np_L*r_L**2)/cathode.V_0
         
-        i_Far = carbon_el_s.get_net_production_rates(conductor_obj)*F*A_C/cathode.dyInv
+        # Faradaic current of the whole cathode, summed over the nodes
+        i_Far = (sdot_Far*F*A_C).dot(dy)
             
         # Net rate of formation
         R_Li_dl = (-i_Far + i_ext - 0)/cathode.H/F
-#        print(R_Li_dl)
-        N_Li_dl[i] = dt*R_Li_dl*cathode.H
-
-        N_Li_sep[i] = N_io_sep[2]*dt
-        i_sep[i] = i_io_sep
-        i_cc[i] = i_ext
-        i_dl[i] = (-i_Far + i_ext - 0)
+        N_Li_dl[rows] = dt*R_Li_dl*cathode.H
+        
+        N_Li_sep[rows] = N_io_sep[:, 2]*dt
+        i_sep[rows] = i_io_sep
+        i_cc[rows] = i_ext
+        i_dl[rows] = (-i_Far + i_ext - 0)
         
-        rho_Li_el_cat = rho_el_cat[2]
-        n_Li_cat[i] = eps_el*cathode.H*(rho_Li_el_cat - inputs.C_k_el_0[2])
+        rho_Li_el_cat = rho_el_cat[..., 2]
+        n_Li_cat[rows] = (eps_el*dy*(rho_Li_el_cat - inputs.C_k_el_0[2])).sum(axis=1)
         
-        n_Li_Li2S[i] = 2*Li2S_obj.density_mole*(eps_Li2S - cathode.eps_L_0)*cathode.H
+        n_Li_Li2S[rows] = 2*Li2S_obj.density_mole*(eps_Li2S - cathode.eps_L_0).dot(dy)
         
-        n_Li_tot[i] = n_Li_cat[i] + n_Li_Li2S[i]
+        n_Li_tot[rows] = n_Li_cat[rows] + n_Li_Li2S[rows]
         
         """3. Charge neutrality"""
-        charge_el_cat[i] = eps_el*cathode.H*np.dot(inputs.z_k_el, rho_el_cat)
-        charge_el_sep[i] = sep.epsilon_el*sep.H*np.dot(inputs.z_k_el, rho_el_sep)
-        charge_el_an[i] = anode.eps_el*anode.H*np.dot(inputs.z_k_el, rho_el_an)
+        charge_el_cat[rows] = (eps_el*dy*np.dot(rho_el_cat, inputs.z_k_el)).sum(axis=1)
+        charge_el_sep[rows] = sep.epsilon_el*sep.dy*np.dot(rho_el_sep, inputs.z_k_el).sum(axis=1)
+        charge_el_an[rows] = anode.eps_el*anode.dy*np.dot(rho_el_an, inputs.z_k_el).sum(axis=1)
 #            C_S_anions_0 = inputs.C_k_el_0[5:]
 #            C_S_anions = SV[offset + ptr['rho_k_el'][5:]]
 #            
@@ -162,6 +176,34 @@ def conservation_tests(SV, tags):
     pct_error_Li = (N_Li_integral + n_Li_tot)
     
     test = (n_S_0 - n_S_tot[-1])
+    
+    return {'t': t_vec, 'n_S_0': n_S_0, 'n_S_tot': n_S_tot, 'n_S_solid': n_S_solid_vec,
+            'n_S_Li2S': n_S_Li2S_vec, 'n_S_cat': n_S_cat, 'n_S_sep': n_S_sep,
+            'n_S_an': n_S_an, 'pct_error_S': pct_error_S, 'charge_el_cat': charge_el_cat,
+            'charge_el_sep': charge_el_sep, 'charge_el_an': charge_el_an,
+            'i_sep': i_sep, 'i_cc': i_cc, 'N_Li_integral': N_Li_integral,
+            'N_Li_dl_integral': N_Li_dl_integral, 'n_Li_cat': n_Li_cat,
+            'n_Li_Li2S': n_Li_Li2S, 'n_Li_tot': n_Li_tot, 'pct_error_Li': pct_error_Li,
+            'eps_S': eps_S_vec, 'eps_Li2S': eps_Li2S_vec, 'eps_el': eps_el_vec,
+            'eps_C': eps_C_vec}
+
+"""========================================================================="""
+
+def conservation_tests(SV, tags, cell=cell):
+    """Plot the balances of conservation_balances."""
+    bal = conservation_balances(SV, tags, cell)
+    t_vec, n_S_0 = bal['t'], bal['n_S_0']
+    n_S_tot, n_S_solid_vec, n_S_Li2S_vec = bal['n_S_tot'], bal['n_S_solid'], bal['n_S_Li2S']
+    n_S_cat, n_S_sep, n_S_an = bal['n_S_cat'], bal['n_S_sep'], bal['n_S_an']
+    charge_el_cat, charge_el_sep = bal['charge_el_cat'], bal['charge_el_sep']
+    charge_el_an = bal['charge_el_an']
+    i_sep, i_cc = bal['i_sep'], bal['i_cc']
+    N_Li_integral, N_Li_dl_integral = bal['N_Li_integral'], bal['N_Li_dl_integral']
+    n_Li_cat, n_Li_Li2S, n_Li_tot = bal['n_Li_cat'], bal['n_Li_Li2S'], bal['n_Li_tot']
+    pct_error_S, pct_error_Li = bal['pct_error_S'], bal['pct_error_Li']
+    eps_S_vec, eps_Li2S_vec = bal['eps_S'], bal['eps_Li2S']
+    eps_el_vec, eps_C_vec = bal['eps_el'], bal['eps_C']
+    
     """---------------------------------------------------------------------"""
     """Plotting"""
     
@@ -182,14 +224,14 @@ def conservation_tests(SV, tags):
         tick.label1.set_fontsize(fs)
         tick.label1.set_fontname('Times New Roman')    
     
-    p1, = plt.plot(SV.loc[:, 'Time'], n_S_tot, 'k-', linewidth=lw)
-#    p2, = plt.plot(SV.loc[:, 'Time'], n_S_elyte, 'g-', linewidth=lw)
-    p3, = plt.plot(SV.loc[:, 'Time'], n_S_solid_vec, linewidth=lw)
-    p4, = plt.plot(SV.loc[:, 'Time'], n_S_Li2S_vec, linewidth=lw)
-    p5, = plt.plot(SV.loc[:, 'Time'], n_S_0*np.ones((len(n_S_tot))), 'k--', linewidth=lw)
-    p6, = plt.plot(SV.loc[:, 'Time'], n_S_cat, linewidth=lw)
-    p7, = plt.plot(SV.loc[:, 'Time'], n_S_sep, linewidth=lw)
-    p8, = plt.plot(SV.loc[:, 'Time'], n_S_an, linewidth=lw)
+    p1, = plt.plot(t_vec, n_S_tot, 'k-', linewidth=lw)
+#    p2, = plt.plot(t_vec, n_S_elyte, 'g-', linewidth=lw)
+    p3, = plt.plot(t_vec, n_S_solid_vec, linewidth=lw)
+    p4, = plt.plot(t_vec, n_S_Li2S_vec, linewidth=lw)
+    p5, = plt.plot(t_vec, n_S_0*np.ones((len(n_S_tot))), 'k--', linewidth=lw)
+    p6, = plt.plot(t_vec, n_S_cat, linewidth=lw)
+    p7, = plt.plot(t_vec, n_S_sep, linewidth=lw)
+    p8, = plt.plot(t_vec, n_S_an, linewidth=lw)
     plt.legend(['Total', 'S8', 'Li2S', 'Initial', 'Cathode elyte', 'Sep elyte', 'Anode elyte'])
 #    p1, = plt.plot(SV_df.loc[:, 'Time'], SV_df.loc[:, tags['phi_ed']], 'k-', linewidth=lw)
 #    plt.xlim((0, SV.loc[-1, 'Time']))
@@ -218,8 +260,8 @@ def conservation_tests(SV, tags):
         tick.label1.set_fontsize(fs)
         tick.label1.set_fontname('Times New Roman')    
     
-    p1, = plt.plot(SV.loc[:, 'Time'], pct_error_S, 'k-', linewidth=lw)
-    p2, = plt.plot(SV.loc[:, 'Time'], np.zeros_like(pct_error_S), 'k--', linewidth=lw)
+    p1, = plt.plot(t_vec, pct_error_S, 'k-', linewidth=lw)
+    p2, = plt.plot(t_vec, np.zeros_like(pct_error_S), 'k--', linewidth=lw)
 #    p1, = plt.plot(SV_df.loc[:, 'Time'], SV_df.loc[:, tags['phi_ed']], 'k-', linewidth=lw)
 #    plt.xlim((0, SV.loc[-1, 'Time']))
 #    plt.xticks([0, 250, 500, 750, 1000, 1250, 1500, 1750])
@@ -251,14 +293,14 @@ def conservation_tests(SV, tags):
         tick.label1.set_fontname('Times New Roman')    
     
     plt.sca(ax)
-    p1, = plt.plot(SV.loc[:, 'Time'], charge_el_cat, 'k-', linewidth=lw)
-    p2, = plt.plot(SV.loc[:, 'Time'], np.zeros_like(charge_el_cat), 'k--', linewidth=lw)
+    p1, = plt.plot(t_vec, charge_el_cat, 'k-', linewidth=lw)
+    p2, = plt.plot(t_vec, np.zeros_like(charge_el_cat), 'k--', linewidth=lw)
     plt.sca(ax2)
-    p3, = plt.plot(SV.loc[:, 'Time'], charge_el_sep, 'k-', linewidth=lw)
-    p4, = plt.plot(SV.loc[:, 'Time'], np.zeros_like(charge_el_sep), 'k--', linewidth=lw)
+    p3, = plt.plot(t_vec, charge_el_sep, 'k-', linewidth=lw)
+    p4, = plt.plot(t_vec, np.zeros_like(charge_el_sep), 'k--', linewidth=lw)
     plt.sca(ax3)
-    p5, = plt.plot(SV.loc[:, 'Time'], charge_el_an, 'k-', linewidth=lw)
-    p6, = plt.plot(SV.loc[:, 'Time'], np.zeros_like(charge_el_an), 'k--', linewidth=lw)
+    p5, = plt.plot(t_vec, charge_el_an, 'k-', linewidth=lw)
+    p6, = plt.plot(t_vec, np.zeros_like(charge_el_an), 'k--', linewidth=lw)
 #    p1, = plt.plot(SV_df.loc[:, 'Time'], SV_df.loc[:, tags['phi_ed']], 'k-', linewidth=lw)
 #    plt.xlim((0, SV.loc[-1, 'Time']))
 #    plt.xticks([0, 250, 500, 750, 1000, 1250, 1500, 1750])
@@ -285,9 +327,9 @@ def conservation_tests(SV, tags):
         tick.label1.set_fontsize(fs)
         tick.label1.set_fontname('Times New Roman')    
         
-    p1, = plt.plot(SV.loc[:, 'Time'], -i_sep, 'k-', linewidth=lw)
-    p2, = plt.plot(SV.loc[:, 'Time'], i_cc, 'g-', linewidth=lw)
-    p3, = plt.plot(SV.loc[:, 'Time'], i_cc - i_sep, linewidth=lw)
+    p1, = plt.plot(t_vec, -i_sep, 'k-', linewidth=lw)
+    p2, = plt.plot(t_vec, i_cc, 'g-', linewidth=lw)
+    p3, = plt.plot(t_vec, i_cc - i_sep, linewidth=lw)
     plt.legend(['Separator', 'External', 'Net'])
     
     "-----Plot lithium balance in cathode-----"
@@ -306,11 +348,11 @@ def conservation_tests(SV, tags):
         tick.label1.set_fontname('Times New Roman')    
         
     N_Li_flux_in = -N_Li_integral + N_Li_dl_integral
-    p1, = plt.plot(SV.loc[:, 'Time'], N_Li_flux_in, 'k-', linewidth=lw)
-    p2, = plt.plot(SV.loc[:, 'Time'], n_Li_cat, 'g-', linewidth=lw)
-    p3, = plt.plot(SV.loc[:, 'Time'], n_Li_Li2S, linewidth=lw)
-    p4, = plt.plot(SV.loc[:, 'Time'], n_Li_tot, linewidth=lw)
-#    p5, = plt.plot(SV.loc[:, 'Time'], N_Li_dl_integral, linewidth=lw)
+    p1, = plt.plot(t_vec, N_Li_flux_in, 'k-', linewidth=lw)
+    p2, = plt.plot(t_vec, n_Li_cat, 'g-', linewidth=lw)
+    p3, = plt.plot(t_vec, n_Li_Li2S, linewidth=lw)
+    p4, = plt.plot(t_vec, n_Li_tot, linewidth=lw)
+#    p5, = plt.plot(t_vec, N_Li_dl_integral, linewidth=lw)
     plt.legend(['Lithium from separator and double layer', 'Change in elyte', 'Change in solid', 'Total change'])
     plt.xticks([0, 30000, 60000, 90000, 120000, 150000, 180000])
     
@@ -329,11 +371,11 @@ def conservation_tests(SV, tags):
         tick.label1.set_fontsize(fs)
         tick.label1.set_fontname('Times New Roman')    
         
-    p1, = plt.plot(SV.loc[:, 'Time'], pct_error_Li, 'k-', linewidth=lw)
+    p1, = plt.plot(t_vec, pct_error_Li, 'k-', linewidth=lw)
     plt.xticks([0, 30000, 60000, 90000, 120000, 150000, 180000])
-#    p2, = plt.plot(SV.loc[:, 'Time'], n_Li_cat, 'g-', linewidth=lw)
-#    p3, = plt.plot(SV.loc[:, 'Time'], n_Li_Li2S, linewidth=lw)
-#    p4, = plt.plot(SV.loc[:, 'Time'], n_Li_tot, linewidth=lw)
+#    p2, = plt.plot(t_vec, n_Li_cat, 'g-', linewidth=lw)
+#    p3, = plt.plot(t_vec, n_Li_Li2S, linewidth=lw)
+#    p4, = plt.plot(t_vec, n_Li_tot, linewidth=lw)
 #    plt.legend(['Lithium from separator', 'Change in elyte', 'Change in solid', 'Total change'])
     
     fig=plt.figure(7)
@@ -350,10 +392,10 @@ def conservation_tests(SV, tags):
         tick.label1.set_fontsize(fs)
         tick.label1.set_fontname('Times New Roman')    
         
-    p1, = plt.plot(SV.loc[:, 'Time'], eps_S_vec, 'k-', linewidth=lw)
-    p2, = plt.plot(SV.loc[:, 'Time'], eps_Li2S_vec, linewidth=lw)
-    p3, = plt.plot(SV.loc[:, 'Time'], eps_el_vec, linewidth=lw)
-    p4, = plt.plot(SV.loc[:, 'Time'], eps_C_vec, linewidth=lw)
+    p1, = plt.plot(t_vec, eps_S_vec, 'k-', linewidth=lw)
+    p2, = plt.plot(t_vec, eps_Li2S_vec, linewidth=lw)
+    p3, = plt.plot(t_vec, eps_el_vec, linewidth=lw)
+    p4, = plt.plot(t_vec, eps_C_vec, linewidth=lw)
     plt.legend(['S8', 'Li2S', 'Elyte', 'C'])
     plt.xticks([0, 30000, 60000, 90000, 120000, 150000, 180000])
     
@@ -361,7 +403,9 @@ def conservation_tests(SV, tags):
 
 """========================================================================="""
 
-def plot_sim(tags, SV_df_stage, stage, yax, fig, axes):
+def plot_sim(tags, SV_df_stage, stage, yax, fig, axes, cell=cell):
+    
+    cathode, sep, anode, inputs = cell.cathode, cell.sep, cell.anode, cell.inputs
     
     if stage == 'Discharging':
         showlegend = 1
@@ -375,7 +419,7 @@ def plot_sim(tags, SV_df_stage, stage, yax, fig, axes):
 #    phi = tags['phi_dl'] + tags['phi_ed']
     phi = tags['phi_ed']
     fontsize = 18
-    SV_df = SV_df_stage.copy()
+    SV_df = select_columns(SV_df_stage, ['Time'] + phi + vol_fracs + tags['rho_el'][4:])
     SV_df.loc[:, 'Time'] *= -cathode.i_ext_amp*inputs.A_cat/3600/(cathode.m_S_0 + cathode.m_S_el)
     print(SV_df.iloc[-1, -1])
     t = SV_df['Time']
@@ -443,15 +487,15 @@ def plot_sim(tags, SV_df_stage, stage, yax, fig, axes):
 
 "============================================================================="
 
-def plot_meanPS(SV, tags):
+def plot_meanPS(SV, tags, cell=cell):
     
-    SV_df = SV.copy()
+    cathode, sep, anode, inputs = cell.cathode, cell.sep, cell.anode, cell.inputs
+    
+    SV_df = select_columns(SV, ['Time'] + tags['rho_el'][cathode.i_S8:-2])
     SV_df.loc[:, 'Time'] *= -cathode.i_ext_amp*inputs.A_cat/3600/(cathode.m_S_0 + cathode.m_S_el)
     
-    C_k = SV_df[tags['rho_el'][cathode.i_S8:-2]].copy()
-    meanPS = np.zeros([len(C_k.index)])
-    for j in np.arange(len(C_k.index)):
-        meanPS[j] = sum(cathode.n_S_atoms[0:-2]*C_k.iloc[j, :])/sum(C_k.iloc[j, :])
+    C_k = SV_df[tags['rho_el'][cathode.i_S8:-2]].values
+    meanPS = np.dot(C_k, cathode.n_S_atoms[0:-2])/C_k.sum(axis=1)
       
         
         
@@ -480,174 +524,62 @@ def plot_meanPS(SV, tags):
     plt.yticks([2, 3, 4, 5, 6, 7, 8])
     plt.ylabel('Mean PS order', fontstyle='normal', fontname='Times new Roman', fontsize=fs+2, labelpad=5.0)
     plt.xlabel(r'Capacity $[\mathrm{Ah} \hspace{0.5} \mathrm{kg}^{-1}_{\mathrm{sulfur}}]$', fontstyle='normal', fontname='Times new Roman', fontsize=fs+2, labelpad=5.0)
-        
+    
     return
 
-def label_columns(t, SV, an_np, sep_np, cat_np):
-    
-    # Convert t and SV arrays into pandas data frames
-    t_df = pd.DataFrame(t)
-    SV_df = pd.DataFrame(SV)
-    
-    # Set the column label for the t data frame to the number of columns in SV
-    newcols_t = {0: SV_df.shape[1]}
-    t_df.rename(columns = newcols_t, inplace = True)
-    
-    # Concatenate t_df onto end of SV_df by columns (axis = 1)
-    SV_df = pd.concat((SV_df, t_df), axis = 1)
-    
-    """Label anode points"""
-    newcols = {}
-    for j in np.arange(0, an_np):
-        offset = anode.offsets[j]  # Set node offset value for loop
-        
-#        # Loop over number of shells in anode
-#        for k in np.arange(0, anode.nshells):
-#            newcols_an = {k + offset: 'X_an'+str(j+1)+str(k+1)}
-#            newcols.update(newcols_an)
-            
-        # Loop over number of species in electrolyte
-        for k in np.arange(0, elyte_obj.n_species):
-            species = elyte_obj.species_names[k]
-            newcols_el = {k + offset: 'rho_'+species+'_an'+str(j+1)}
-            newcols.update(newcols_el)
-            
-        # Add tags for electrod and double layer potentials
-        newcols_phi = {0+elyte_obj.n_species+offset: 'Phi_an_dl'+str(j+1),
-                       1+elyte_obj.n_species+offset: 'Phi_an'+str(j+1)}
-        newcols.update(newcols_phi)
-        
-        SV_df.rename(columns=newcols, inplace = True)
-        
-        """Label separator points"""
-        newcols = {}
-    for j in np.arange(0, sep_np):
-        offset = sep.offsets[j] # Set node offset value for loop
-        
-        # Loop over number of species in electrolyte
-        for k in np.arange(0, elyte_obj.n_species):
-            species = elyte_obj.species_names[k]
-            newcols_el = {k + offset: 'rho_'+species+'_sep'+str(j+1)}
-            newcols.update(newcols_el)
-            
-        # Add tag for electrolyte potential
-        newcols_phi = {0+elyte_obj.n_species+offset: 'Phi_sep'+str(j+1)}
-        newcols.update(newcols_phi)
-        
-        SV_df.rename(columns=newcols, inplace = True)
-        
-    """Label cathode points"""
-    newcols = {}
-    for j in np.arange(0, cat_np):
-        offset = cathode.offsets[j]  # Set node offset value for loop
-        
-        # Add tags for particle radius of Li2S and S8
-        newcols_r = {0+offset: 'eps_S8'+str(j+1),
-                     1+offset: 'eps_Li2S'  +str(j+1)}
-        newcols.update(newcols_r)
-        
-        # Loop over number of species in electrolyte
-        for k in np.arange(0, elyte_obj.n_species):
-            spec = elyte_obj.species_names[k]
-            newcols_el = {2 + k + offset: 'rho_'+spec+'_cat'+str(j+1)}
-            newcols.update(newcols_el)
-            
-        # Add tags for double layer and electrolyte potentials
-        newcols_phi = {2 + elyte_obj.n_species + offset: 'Phi_dl'+str(j+1),
-                       3 + elyte_obj.n_species + offset: 'Phi_ed'+str(j+1)}
-        newcols.update(newcols_phi)
-        
-        SV_df.rename(columns = newcols, inplace = True)
-        
-        # Add tag for number of nucleation sites
-        newcols_nucl = {4 + elyte_obj.n_species + offset: 'np_S8'+str(j+1),
-                        5 + elyte_obj.n_species + offset: 'np_Li2S'+str(j+1)}
-        newcols.update(newcols_nucl)
-        
-        SV_df.rename(columns = newcols, inplace = True)
-        
-    newcols_time = {SV_df.shape[1]-1: 'Time'}
-    SV_df.rename(columns = newcols_time, inplace = True)
-    
-    return SV_df
+"============================================================================="
+
+def column_names(an_np, sep_np, cat_np, cell=cell):
+    """Names of the SV columns in SV order, followed by 'Time', from the 
+    layout registry of the cell."""
+    npoints = (cell.anode.npoints, cell.sep.npoints, cell.cathode.npoints)
+    if (an_np, sep_np, cat_np) != npoints:
+        raise ValueError('Node counts ' + str((an_np, sep_np, cat_np)) 
+                         + ' do not match the cell mesh ' + str(npoints))
+    
+    return cell.layout.columns.tolist()
 
 "============================================================================="
 
-def tag_strings(SV):
-    
-    SV_labels = SV.columns.values.tolist()
-    
-    r_Li2S = np.array([])
-    r_S8 = np.array([])
-    rho_el = []
-    phi_dl = np.array([])
-    phi_ed = np.array([])
-    np_S8 = np.array([])
-    np_Li2S = np.array([])
-    
-    rho_el_sep = []
-    phi_sep = np.array([])
-    
-    rho_el_an = []
-    phi_dl_an = np.array([])
-    phi_an = np.array([])
-    
-    ptr = cathode.ptr
-    for j in np.arange(0, cathode.npoints):
-        offset = int(cathode.offsets[j])
-        
-        r_Li2S = np.append(r_Li2S, SV_labels[ptr['eps_Li2S'] + offset])
-        r_S8 = np.append(r_S8, SV_labels[ptr['eps_S8'] + offset])
-        
-        rho_el[0 + offset:elyte_obj.n_species + offset] = \
-            SV_labels[ptr['rho_k_el'][0]+offset:ptr['rho_k_el'][-1]+offset+1]
-            
-        phi_dl = np.append(phi_dl, SV_labels[ptr['phi_dl'] + offset])
-        phi_ed = np.append(phi_ed, SV_labels[ptr['phi_ed'] + offset])
-        np_S8 = np.append(np_S8, SV_labels[ptr['np_S8'] + offset])
-        np_Li2S = np.append(np_Li2S, SV_labels[ptr['np_Li2S'] + offset])
-        
-    ptr = sep.ptr
-    for j in np.arange(0, sep.npoints):
-        offset = int(sep.offsets[j])
-        
-        rho_el_sep[0 + offset:elyte_obj.n_species + offset] = \
-            SV_labels[ptr['rho_k_el'][0]+offset:ptr['rho_k_el'][-1]+offset+1]
-            
-        phi_sep = np.append(phi_sep, SV_labels[ptr['phi'] + offset])
-        
-    ptr = anode.ptr
-    for j in np.arange(0, anode.npoints):
-        offset = int(anode.offsets[j])
-        
-        rho_el_an[0 + offset:elyte_obj.n_species + offset] = \
-            SV_labels[ptr['rho_k_el'][0]+offset:ptr['rho_k_el'][-1]+offset+1]
-            
-        phi_dl_an = np.append(phi_dl_an, SV_labels[ptr['phi_dl'] + offset])
-        phi_an = np.append(phi_an, SV_labels[ptr['phi_ed'] + offset])
-        
-    phi_sep = phi_sep.tolist()
-    phi_dl_an = phi_dl_an.tolist()
-    phi_an = phi_an.tolist()
-        
-    r_Li2S = r_Li2S.tolist()
-    r_S8 = r_S8.tolist()
-    phi_dl = phi_dl.tolist()
-    phi_ed = phi_ed.tolist()
-    np_S8 = np_S8.tolist()
-    np_Li2S = np_Li2S.tolist()
+def iter_chunks(SV):
+    """Blocks of rows (n_times, n_columns) of a labeled DataFrame, which is
+    one block, or of a TrajectoryReader read one chunk at a time."""
+    chunks = [SV] if isinstance(SV, pd.DataFrame) else SV.chunks()
+    for chunk in chunks:
+        yield chunk.values
+
+"============================================================================="
+
+def select_columns(SV, names):
+    """Copy of the named columns of a labeled DataFrame or a TrajectoryReader
+    as a DataFrame. Only these columns are read from a reader."""
+    if isinstance(SV, pd.DataFrame):
+        return SV.loc[:, names].copy()
     
-    tags = {}
-    tags['eps_Li2S'] = r_Li2S; tags['eps_S8'] = r_S8; tags['rho_el'] = rho_el
-    tags['phi_dl'] = phi_dl; tags['phi_ed'] = phi_ed; tags['np_S8'] = np_S8
-    tags['np_Li2S'] = np_Li2S; tags['rho_el_sep'] = rho_el_sep; tags['phi_sep'] = phi_sep
-    tags['rho_el_an'] = rho_el_an; tags['phi_dl_an'] = phi_dl_an; tags['phi_an'] = phi_an
+    return SV.select(names)
+
+"============================================================================="
+
+def label_columns(t, SV, an_np, sep_np, cat_np, cell=cell):
     
-    return tags
+    # [SV, t] is written once into one array, which the DataFrame wraps 
+    #   without copying, labeled with the registry columns
+    column_names(an_np, sep_np, cat_np, cell)
+    data = np.empty([np.shape(SV)[0], cell.layout.columns.size])
+    data[:, :-1] = SV
+    data[:, -1] = t
     
+    return pd.DataFrame(data, columns=cell.layout.columns, copy=False)
+
+"============================================================================="
 
+def tag_strings(SV, cell=cell):
     
+    # Column names of each variable at every node, from the layout registry.
+    #   Lists are copied so callers can change them
+    return {tag: list(names) for tag, names in cell.layout.tags.items()}
     
+
 if __name__ == "__main__":
     conservation_tests(SV_dch, tags)
     
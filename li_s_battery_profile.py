@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Counters and timers of a run, enabled with inputs.flag_profile. The model
+reports to the module level profiler:
+    res_fun, jac    - calls and time of the residual and Jacobian as IDA
+                      calls them (finite difference residuals included)
+    kinetics        - time in the rate calls of each interface, Cantera's
+                      get_net_production_rates or the generated kernel, and
+                      in setting the Cantera phase states
+    dst             - time in the species flux functions, only when 
+                      inputs.flag_profile is set as the model is imported
+    solver          - IDA statistics, summed over every simulate() call,
+                      and the simulated time
+Python bookkeeping is the time in res_fun and jac that is neither kinetics
+nor dst, and the solver time is the rest of the wall time. record() gives
+all of it as one flat dict, write() stores it as JSON or CSV:
+
+    profiler.start()
+    ... run ...
+    profiler.write('li_s_profile.json')
+"""
+
+import numpy as np
+import functools
+import json
+import time
+
+from li_s_battery_inputs import inputs
+
+"============================================================================="
+
+class Profiler():
+    """Counters and timers of one run. The timed functions only check
+    enabled when the profiler is off. Kinetics and dst are only timed in
+    calls from res_fun and jac (active), so that post-processing does not
+    count as model time."""
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+    
+    def reset(self):
+        self.counts = {}
+        self.times = {}
+        self.solver = {}
+        self.t_sim = 0.
+        self._depth = 0
+        self._t_start = time.perf_counter()
+        self._t_stop = None
+    
+    def start(self):
+        """Clear the counters and start timing the run."""
+        self.reset()
+        self.enabled = True
+    
+    def stop(self):
+        self._t_stop = time.perf_counter()
+        self.enabled = False
+    
+    @property
+    def active(self):
+        """Enabled and inside res_fun or jac."""
+        return self.enabled and self._depth > 0
+    
+    def add_time(self, name, dt, n=1):
+        self.times[name] = self.times.get(name, 0.) + dt
+        self.counts[name] = self.counts.get(name, 0) + n
+    
+    def timed(self, name, outer=False):
+        """Decorator counting and timing the calls of a function as name.
+        outer marks the model entry points (res_fun, jac), whose calls
+        outside one another make up the model time. Other functions are only
+        wrapped with inputs.flag_profile set when they are decorated, so the
+        per-face calls of the residual carry no wrapper in plain runs; a 
+        run profiled through a cell override is timed at the res_fun and jac
+        level only."""
+        def wrap(fun):
+            if not outer and inputs.flag_profile != 1:
+                return fun
+            
+            @functools.wraps(fun)
+            def timed_fun(*args, **kwargs):
+                if not (self.enabled if outer else self.active):
+                    return fun(*args, **kwargs)
+                
+                t_0 = time.perf_counter()
+                self._depth += outer
+                try:
+                    return fun(*args, **kwargs)
+                finally:
+                    dt = time.perf_counter() - t_0
+                    self._depth -= outer
+                    self.add_time(name, dt)
+                    if outer and self._depth == 0:
+                        self.times['model'] = self.times.get('model', 0.) + dt
+            
+            return timed_fun
+        
+        return wrap
+    
+    def add_solver(self, sim, t_sim):
+        """Add the statistics of the last simulate() call of the IDA instance
+        sim and the t_sim seconds it integrated."""
+        if not self.enabled:
+            return
+        
+        self.t_sim += t_sim
+        stats = getattr(sim, 'statistics', None)
+        if stats is None:
+            return
+        for key in stats.keys():
+            value = stats[key]
+            if np.isscalar(value):
+                self.solver[key] = self.solver.get(key, 0) + value
+    
+    def record(self):
+        """Counters and times of the run as a flat dict."""
+        t_stop = self._t_stop if self._t_stop is not None else time.perf_counter()
+        wall = t_stop - self._t_start
+        model = self.times.get('model', 0.)
+        
+        kinetics = {name: dt for name, dt in self.times.items()
+                    if name.startswith('kinetics:')}
+        dst = sum(dt for name, dt in self.times.items() if name.startswith('dst'))
+        
+        # Direct linear solvers take one solve per Newton iteration
+        nniters = self.solver.get('nniters', 0)
+        
+        rec = {'res_fun_calls': self.counts.get('res_fun', 0),
+               'jac_evals': self.counts.get('jac', 0),
+               'nonlinear_iters': nniters,
+               'linear_iters': self.solver.get('nliters', nniters),
+               'error_test_fails': self.solver.get('nerrfails', 0),
+               'steps': self.solver.get('nsteps', 0),
+               't_sim': self.t_sim, 't_wall': wall,
+               'sim_per_wall': self.t_sim/wall if wall > 0 else np.nan,
+               'time_res_fun': self.times.get('res_fun', 0.),
+               'time_jac': self.times.get('jac', 0.),
+               'time_kinetics': sum(kinetics.values()),
+               'time_dst': dst,
+               'time_python': model - sum(kinetics.values()) - dst,
+               'time_solver': wall - model}
+        for name, dt in sorted(kinetics.items()):
+            rec['time_' + name.replace(':', '_')] = dt
+        for key, value in sorted(self.solver.items()):
+            rec['ida_' + key] = value
+        
+        return {key: value.item() if isinstance(value, np.generic) else value
+                for key, value in rec.items()}
+    
+    def write(self, path):
+        """Write record() to path, as CSV (header and one row) for a .csv
+        path and as JSON otherwise. Returns the record."""
+        rec = self.record()
+        if path.endswith('.csv'):
+            with open(path, 'w') as f:
+                f.write(','.join(rec.keys()) + '\n')
+                f.write(','.join(repr(value) for value in rec.values()) + '\n')
+        else:
+            with open(path, 'w') as f:
+                json.dump(rec, f, indent=1)
+        
+        return rec
+    
+    def summary(self):
+        """Printable summary of record()."""
+        rec = self.record()
+        
+        return ('res_fun calls: ' + str(rec['res_fun_calls'])
+                + ', Jacobians: ' + str(rec['jac_evals'])
+                + ', Newton iterations: ' + str(rec['nonlinear_iters'])
+                + ', error test fails: ' + str(rec['error_test_fails'])
+                + '\nt_wall = {:.3g} s: solver {:.3g}, kinetics {:.3g}, dst {:.3g}, '
+                'python {:.3g}; t_sim/t_wall = {:.3g}'.format(
+                    rec['t_wall'], rec['time_solver'], rec['time_kinetics'],
+                    rec['time_dst'], rec['time_python'], rec['sim_per_wall']))
+
+profiler = Profiler()
+
+"============================================================================="
+
+def net_rates(surf, phase):
+    """surf.get_net_production_rates(phase), timed per interface."""
+    if not profiler.active:
+        return surf.get_net_production_rates(phase)
+    
+    t_0 = time.perf_counter()
+    rates = surf.get_net_production_rates(phase)
+    profiler.add_time('kinetics:' + surf.name, time.perf_counter() - t_0)
+    
+    return rates
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-stage cycling protocols. A protocol is a list of steps built with the
+functions below (rest, cc_discharge, cc_charge, cv_hold, pulse), e.g.
+
+    steps = [rest(3600), cc_discharge(0.1, V_min=1.8), rest(1800),
+             cc_charge(0.1, V_max=2.8), cv_hold(2.8, 3600)]
+    results = run_protocol(steps, cycles=100)
+
+All steps run on one cc_cycling problem and one IDA instance. Between steps
+the external current (or held voltage) is switched, the solver is
+re-initialized at the last state and the algebraic variables are made
+consistent, so the solver memory and the cached Jacobian pattern and
+colouring are kept. The solution is appended to one ResultStore, which only
+builds a labeled DataFrame on request, or for long runs streamed to disk:
+
+    with TrajectoryWriter('run_200', column_names(1, 1, 1)) as sink:
+        run_protocol(steps, cycles=200, sink=sink)
+"""
+
+import numpy as np
+import time
+import os
+
+from assimulo.solvers import IDA
+
+from li_s_battery_init import cell
+from li_s_battery_post import label_columns
+from li_s_battery_profile import profiler
+
+"============================================================================="
+
+def rest(t):
+    """Open circuit for t seconds."""
+    return {'mode': 'rest', 't': t}
+
+def cc_discharge(C_rate, t=None, V_min=None):
+    """Constant current discharge at C_rate for t seconds (3600/C_rate by
+    default) or until the cell voltage falls to V_min."""
+    return {'mode': 'cc', 'C_rate': C_rate, 't': t, 'V_min': V_min}
+
+def cc_charge(C_rate, t=None, V_max=None):
+    """Constant current charge at C_rate for t seconds (3600/C_rate by
+    default) or until the cell voltage rises to V_max."""
+    return {'mode': 'cc', 'C_rate': -C_rate, 't': t, 'V_max': V_max}
+
+def cv_hold(V, t):
+    """Hold the cell voltage at V for t seconds."""
+    return {'mode': 'cv', 'V': V, 't': t}
+
+def pulse(C_rate, t_on, t_off, n=1):
+    """n current pulses at C_rate (negative to charge) of t_on seconds, each
+    followed by t_off seconds of rest."""
+    return {'mode': 'pulse', 'C_rate': C_rate, 't_on': t_on, 't_off': t_off, 'n': n}
+
+"============================================================================="
+
+def expand(steps, cycles=1):
+    """The protocol as a flat list of rest, cc and cv steps, with pulses
+    split into their on and off parts, repeated cycles times."""
+    flat = []
+    for step in steps:
+        if step['mode'] == 'pulse':
+            for k in np.arange(0, step['n']):
+                flat.append({'mode': 'cc', 'C_rate': step['C_rate'], 't': step['t_on']})
+                flat.append(rest(step['t_off']))
+        else:
+            flat.append(step)
+    
+    return flat*cycles
+
+"============================================================================="
+
+class ResultStore():
+    """Growing store of a protocol solution, attached to the problem as its
+    result sink (cc_cycling.handle_result) like a TrajectoryWriter, so the
+    solver keeps no history of its own. Rows are kept in preallocated arrays
+    that double in size when full, so appending a point does not copy the
+    earlier steps. Each row carries the index of its protocol step (started
+    with mark_step) and the external current, which set_i_ext fills in."""
+    def __init__(self, nSV, size=1024):
+        self.n = 0
+        self.steps = []
+        self._t = np.zeros([size])
+        self._SV = np.zeros([size, nSV])
+        self._SV_dot = np.zeros([size, nSV])
+        self._step = np.zeros([size], dtype=int)
+        self._i_ext = np.zeros([size])
+    
+    def append(self, t, SV, SV_dot):
+        """Add one time point (t scalar, SV 1-D) or a block of them to the
+        current step."""
+        t = np.atleast_1d(t); SV = np.atleast_2d(SV); SV_dot = np.atleast_2d(SV_dot)
+        m = len(t)
+        if self.n + m > self._t.size:
+            size = max(2*self._t.size, self.n + m)
+            for name in ['_t', '_SV', '_SV_dot', '_step', '_i_ext']:
+                old = getattr(self, name)
+                new = np.zeros((size,) + old.shape[1:], dtype=old.dtype)
+                new[:self.n] = old[:self.n]
+                setattr(self, name, new)
+        
+        rows = slice(self.n, self.n + m)
+        self._t[rows] = t
+        self._SV[rows] = SV
+        self._SV_dot[rows] = SV_dot
+        self._step[rows] = len(self.steps) - 1
+        self.n += m
+    
+    def mark_step(self):
+        """Start a new protocol step at the next row."""
+        self.steps.append(self.n)
+    
+    def set_i_ext(self, cell):
+        """External current of the rows of the current step, with the cell
+        still switched to that step."""
+        from li_s_battery_model import external_current
+        rows = slice(self.steps[-1], self.n)
+        self._i_ext[rows] = [external_current(cell, SV) for SV in self._SV[rows]]
+    
+    @property
+    def last(self):
+        """Last state, for the solver to continue from."""
+        return self.t[-1:].copy(), self.SV[-1:].copy(), self.SV_dot[-1:].copy()
+    
+    # Views of the filled rows
+    t = property(lambda self: self._t[:self.n])
+    SV = property(lambda self: self._SV[:self.n])
+    SV_dot = property(lambda self: self._SV_dot[:self.n])
+    step = property(lambda self: self._step[:self.n])
+    i_ext = property(lambda self: self._i_ext[:self.n])
+    
+    def df(self, cell=cell, steps=None):
+        """Labeled DataFrame (label_columns) of all rows, or of the rows of
+        the listed step indices."""
+        rows = slice(None) if steps is None else np.isin(self.step, steps)
+        
+        return label_columns(self.t[rows], self.SV[rows], cell.anode.npoints,
+                             cell.sep.npoints, cell.cathode.npoints, cell)
+
+"============================================================================="
+
+def run_protocol(steps, cell=cell, SV_0=None, SV_dot_0=None, cycles=1, sink=None):
+    """Run the protocol steps (repeated cycles times) from SV_0, the initial
+    state of the cell by default. Returns a ResultStore with the solution and
+    the index of the step each row belongs to. With a sink 
+    (li_s_battery_store.TrajectoryWriter) every point is streamed to it
+    instead, the start of each step is marked in it and it is returned. With
+    inputs.flag_profile the run is profiled (li_s_battery_profile) and the
+    record written to inputs.profile_file, or to profile.json in the 
+    directory of the sink."""
+    flat = expand(steps, cycles)
+    if not flat:
+        raise ValueError('Empty protocol: ' + str(len(steps)) + ' steps, '
+                         + str(cycles) + ' cycles')
+    
+    from li_s_battery_model import problem, tolerances, linear_solver
+    cat, inputs = cell.cathode, cell.inputs
+    t_count = time.time()
+    if inputs.flag_profile == 1:
+        profiler.start()
+    
+    if SV_0 is None:
+        SV_0 = cell.sol_init.SV_0
+    if SV_dot_0 is None:
+        SV_dot_0 = np.zeros_like(SV_0)
+    
+    # One problem and solver for the whole protocol. The points go to the
+    #   store or sink as they are accepted, so the solver keeps none of them
+    out = ResultStore(SV_0.size) if sink is None else sink
+    cat.set_i_ext(0); cat.set_v_hold(None)
+    bat = problem(cell, SV_0, SV_dot_0)
+    bat.sink = out
+    sim = IDA(bat)
+    sim.report_continuously = True
+    sim.atol, sim.rtol = tolerances(cell, SV_0)
+    sim.usejac = inputs.flag_jac != 0
+    sim.linear_solver = linear_solver(cell)
+    sim.verbosity = 50
+    
+    t_0 = 0.; SV = SV_0; SV_dot = SV_dot_0
+    for step in flat:
+        # Switch the cell to this step's current or voltage
+        if step['mode'] == 'cv':
+            cat.set_i_ext(0); cat.set_v_hold(step['V'])
+        elif step['mode'] == 'cc':
+            cat.set_i_ext(step['C_rate']/inputs.C_rate*cat.i_ext_amp)
+            cat.set_v_hold(None)
+        else:
+            cat.set_i_ext(0); cat.set_v_hold(None)
+        bat.V_limits = (step.get('V_min'), step.get('V_max'))
+        
+        t_step = step['t']
+        if t_step is None:
+            t_step = 3600./abs(step['C_rate'])
+        
+        sim.re_init(t_0, SV, SV_dot)
+        bat.reset_steady()
+        sim.make_consistent('IDA_YA_YDP_INIT')
+        out.mark_step()
+        sim.simulate(t_0 + t_step)
+        if sink is None:
+            out.set_i_ext(cell)
+        
+        t, SV, SV_dot = out.last
+        profiler.add_solver(sim, t[-1] - t_0)
+        t_0 = t[-1]; SV = SV[-1]; SV_dot = SV_dot[-1]
+    
+    cat.set_i_ext(0); cat.set_v_hold(None)
+    print('Protocol of', len(flat), 'steps done, t_cpu=', time.time() - t_count, '\n')
+    
+    # The profile is stored with a streamed trajectory
+    if inputs.flag_profile == 1:
+        profiler.stop()
+        profiler.write(inputs.profile_file if sink is None 
+                       else os.path.join(sink.path, 'profile.json'))
+        print(profiler.summary(), '\n')
+    
+    if sink is not None:
+        sink.flush()
+    
+    return out
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk trajectory store. A trajectory is a directory holding
+    data.f8     - rows of float64 values appended as the solver reports them
+    meta.json   - column names, number of rows and the first row of each
+                  protocol step
+The columns are those of label_columns (the SV variables, then 'Time'), so a
+stored run has the same layout as the DataFrames of li_s_battery_post.
+TrajectoryWriter is attached to a problem as its result sink (cc_cycling.
+handle_result) and buffers rows in a fixed size chunk, so memory use does
+not grow with the length of the run. TrajectoryReader maps a stored run with
+numpy.memmap and reads it by column or in chunks of rows for post-processing
+that does not fit in memory.
+"""
+
+import numpy as np
+import pandas as pd
+import json
+import os
+
+"============================================================================="
+
+class TrajectoryWriter():
+    """Streams rows [SV, t] to the trajectory directory path. Rows are kept
+    in a chunk of chunk_rows rows and appended to data.f8 when it is full,
+    and meta.json is rewritten on every flush so a stopped run can be read up
+    to its last flush."""
+    def __init__(self, path, columns, chunk_rows=4096):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.columns = list(columns)
+        self.n_rows = 0
+        self.steps = []
+        self.last = None
+        
+        self._chunk = np.zeros([chunk_rows, len(self.columns)])
+        self._n_chunk = 0
+        
+        # Start a new trajectory
+        open(os.path.join(path, 'data.f8'), 'wb').close()
+        self.write_meta()
+    
+    def append(self, t, SV, SV_dot=None):
+        """Add one time point (t scalar, SV 1-D) or a block of them."""
+        t = np.atleast_1d(t); SV = np.atleast_2d(SV)
+        rows = np.column_stack((SV, t))
+        
+        while rows.shape[0] > 0:
+            m = min(rows.shape[0], self._chunk.shape[0] - self._n_chunk)
+            self._chunk[self._n_chunk:self._n_chunk + m] = rows[:m]
+            self._n_chunk += m
+            rows = rows[m:]
+            if self._n_chunk == self._chunk.shape[0]:
+                self.flush()
+        
+        # Last state, for the solver to continue from
+        self.last = (t[-1:].copy(), SV[-1:].copy(),
+                     None if SV_dot is None else np.atleast_2d(SV_dot)[-1:].copy())
+    
+    def mark_step(self):
+        """Start a new protocol step at the next row."""
+        self.steps.append(self.n_rows + self._n_chunk)
+    
+    def flush(self):
+        with open(os.path.join(self.path, 'data.f8'), 'ab') as f:
+            f.write(self._chunk[:self._n_chunk].tobytes())
+        self.n_rows += self._n_chunk
+        self._n_chunk = 0
+        self.write_meta()
+    
+    def write_meta(self):
+        meta = {'columns': self.columns, 'n_rows': self.n_rows, 'dtype': '<f8',
+                'steps': self.steps}
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+    
+    def close(self):
+        self.flush()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+"============================================================================="
+
+class TrajectoryReader():
+    """Read-only view of a stored trajectory. Columns are accessed by name as
+    in the labeled DataFrames (reader['Time'], reader[tags['phi_ed']]), 
+    chunks() yields the rows as DataFrames of chunk_rows rows, and only the
+    pages that are read are loaded from disk."""
+    def __init__(self, path, chunk_rows=4096):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.path = path
+        self.columns = pd.Index(meta['columns'])
+        self.steps = meta['steps']
+        self.chunk_rows = chunk_rows
+        
+        shape = (meta['n_rows'], len(self.columns))
+        if meta['n_rows'] > 0:
+            self.data = np.memmap(os.path.join(path, 'data.f8'), dtype=meta['dtype'],
+                                  mode='r', shape=shape)
+        else:
+            self.data = np.zeros(shape)
+        self.index = pd.RangeIndex(shape[0])
+    
+    def __len__(self):
+        return self.data.shape[0]
+    
+    def __getitem__(self, key):
+        """A named column as a Series, or a list of names as a DataFrame."""
+        if isinstance(key, str):
+            return pd.Series(np.asarray(self.data[:, self.columns.get_loc(key)]), name=key)
+        
+        return self.select(key)
+    
+    def select(self, names, rows=None):
+        """DataFrame of the named columns, for all rows or a slice of rows, 
+        copied from the file one chunk at a time."""
+        cols = self.columns.get_indexer(names)
+        if np.any(cols < 0):
+            raise KeyError([name for name, c in zip(names, cols) if c < 0])
+        rows = range(len(self))[rows if rows is not None else slice(None)]
+        
+        out = np.zeros([len(rows), len(cols)])
+        for a in np.arange(0, len(rows), self.chunk_rows):
+            chunk = rows[a:a + self.chunk_rows]
+            out[a:a + len(chunk)] = self.data[chunk.start:chunk.stop:chunk.step][:, cols]
+        
+        return pd.DataFrame(out, columns=list(names), index=pd.Index(rows))
+    
+    def chunks(self, names=None):
+        """Labeled DataFrames of consecutive chunks of rows, indexed by row 
+        number in the whole run. names limits the columns."""
+        for a in np.arange(0, len(self), self.chunk_rows):
+            b = min(a + self.chunk_rows, len(self))
+            if names is None:
+                yield pd.DataFrame(np.array(self.data[a:b]), columns=self.columns,
+                                   index=pd.RangeIndex(a, b))
+            else:
+                yield self.select(names, slice(a, b))
+    
+    def step(self, k):
+        """Rows of protocol step k as a slice."""
+        stop = self.steps[k + 1] if k + 1 < len(self.steps) else len(self)
+        
+        return slice(self.steps[k], stop)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps over cell designs. Each case is a dict of overrides for
+inputs (C_rate, m_S_0, pct_w_S8_0, H_cat, A_C_0, D_Li_el, ...) and may also
+hold 'rate_multipliers', a dict of {reaction id: factor} that scales CTI rate
+constants. Cases run the full main() pipeline in a process pool, or with
+rate_capability, discharges at many C-rates from one equilibration. Every
+worker builds the Cantera objects once when it imports the model and reuses
+them for all of its cases, and each case returns a compact summary:
+
+    results = sweep(grid(C_rate=[0.05, 0.1, 0.5], H_cat=[40e-6, 80e-6]))
+"""
+
+import numpy as np
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+"============================================================================="
+
+def grid(**params):
+    """All combinations of the listed parameter values, as a list of override
+    dicts, e.g. grid(C_rate=[0.1, 0.5], m_S_0=[1e-6, 2e-6]) gives 4 cases."""
+    keys = list(params.keys())
+    
+    return [dict(zip(keys, values)) for values in itertools.product(*params.values())]
+
+"============================================================================="
+
+def init_worker():
+    # Import the model once per worker so the Cantera objects and kinetics
+    #   kernel are built once, and keep matplotlib off screen
+    import matplotlib
+    matplotlib.use('Agg')
+    import li_s_battery_model
+
+"============================================================================="
+
+def run_case(case, eq_state=None):
+    """Run one set of overrides and summarize the discharge. Without eq_state
+    this is the full main() pipeline, with eq_state = (SV_eq, SV_dot_eq) the
+    discharge starts from that equilibrated state. Errors are returned in the
+    summary so one failed design does not stop a sweep."""
+    from li_s_battery_init import CellConfig, set_rate_multipliers
+    from li_s_battery_model import main, discharge
+    from li_s_battery_post import discharge_summary, label_columns, tag_strings
+    from li_s_battery_profile import profiler
+    
+    overrides = dict(case)
+    multipliers = overrides.pop('rate_multipliers', {})
+    
+    summary = {'case': case}
+    t_cpu = time.process_time()
+    try:
+        set_rate_multipliers(multipliers)
+        cell = CellConfig(**overrides)
+        if eq_state is None:
+            SV_eq_df, SV_dch_df, tags = main(cell, plot=False)
+        else:
+            t_dch, SV_dch, SV_dot_dch = discharge(cell, *eq_state)
+            SV_dch_df = label_columns(t_dch, SV_dch, cell.anode.npoints, 
+                                      cell.sep.npoints, cell.cathode.npoints, cell)
+            tags = tag_strings(SV_dch_df, cell)
+        summary.update(discharge_summary(SV_dch_df, tags, cell))
+        if cell.inputs.flag_profile == 1:
+            summary['profile'] = profiler.record()
+    except Exception as e:
+        summary['error'] = repr(e)
+    finally:
+        set_rate_multipliers({})
+    summary['t_cpu'] = time.process_time() - t_cpu
+    
+    return summary
+
+"============================================================================="
+
+def run_discharge(args):
+    # Process pool entry point for rate_capability
+    return run_case(*args)
+
+"============================================================================="
+
+def sweep(cases, max_workers=None):
+    """Run every case (a list of override dicts, or a dict of value lists that
+    is expanded with grid) on a process pool with max_workers processes, one
+    per core by default. Returns the summaries in the order of the cases."""
+    if isinstance(cases, dict):
+        cases = grid(**cases)
+    
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker) as pool:
+        summaries = list(pool.map(run_case, cases))
+    
+    return summaries
+
+"============================================================================="
+
+def rate_capability(C_rates, max_workers=None, **overrides):
+    """Equilibrate one design (inputs plus overrides) once and discharge it
+    from that shared state at every C-rate. The equilibration does not depend
+    on the current, so it is not repeated per rate. max_workers=1 runs the
+    discharges serially in this process, otherwise on a process pool."""
+    from li_s_battery_init import CellConfig, set_rate_multipliers
+    from li_s_battery_model import equilibrate
+    
+    cell_overrides = dict(overrides)
+    set_rate_multipliers(cell_overrides.pop('rate_multipliers', {}))
+    try:
+        t_eq, SV_eq, SV_dot_eq = equilibrate(CellConfig(**cell_overrides))
+    finally:
+        set_rate_multipliers({})
+    eq_state = (SV_eq[-1, :], SV_dot_eq[-1, :])
+    
+    cases = [(dict(overrides, C_rate=C_rate), eq_state) for C_rate in C_rates]
+    if max_workers == 1:
+        return [run_discharge(case) for case in cases]
+    
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker) as pool:
+        summaries = list(pool.map(run_discharge, cases))
+        
+    return summaries
+
+"============================================================================="
+
+if __name__ == "__main__":
+    # Rate capability of the design in li_s_battery_inputs.py
+    t_count = time.time()
+    summaries = rate_capability([0.02, 0.05, 0.1, 0.2, 0.5, 1.0])
+    
+    # Errors are strings and profiles dicts, only numbers are rounded
+    for summary in summaries:
+        print(summary['case'], ' '.join(k + '=' + ('{:.4g}'.format(v) 
+              if np.isscalar(v) and not isinstance(v, str) else str(v))
+              for k, v in summary.items() if k not in ['case', 'profile']))
+        if 'profile' in summary:
+            print('  profile:', summary['profile'])
+    print('t_wall=', time.time() - t_count, '\n')
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Equilibrium cache: the key changes with the physics of a cell and only with
+it, and the least recently used states are evicted first.
+"""
+
+import numpy as np
+import os
+
+import li_s_battery_cache as cache
+
+"============================================================================="
+
+def test_state_key(make_cell):
+    key = cache.state_key(make_cell())
+    assert key == cache.state_key(make_cell())
+    
+    # Physical inputs, the mesh and rate multipliers are part of the key
+    assert key != cache.state_key(make_cell(C_rate=0.2))
+    assert key != cache.state_key(make_cell(npoints_cathode=2))
+    assert key != cache.state_key(make_cell(), {'C-E-1': 2.})
+    
+    # and so is the kinetics form, until the kernel is verified against Cantera
+    assert key != cache.state_key(make_cell(flag_kin_kernel=1))
+    
+    # Solver settings and file names are not
+    assert key == cache.state_key(make_cell(flag_jac=1, linear_solver='SPGMR',
+                                            cache_dir='elsewhere'))
+
+def test_save_load(tmp_path):
+    t, SV, SV_dot = np.arange(3.), np.ones([3, 4]), np.zeros([3, 4])
+    cache.save_state('a', t, SV, SV_dot, str(tmp_path), 1e6)
+    
+    t_c, SV_c, SV_dot_c = cache.load_state('a', str(tmp_path))
+    assert np.array_equal(t_c, t) and np.array_equal(SV_c, SV)
+    assert np.array_equal(SV_dot_c, SV_dot)
+    assert cache.load_state('b', str(tmp_path)) is None
+    
+    # No temporary files are left behind
+    assert os.listdir(str(tmp_path)) == ['a.npz']
+
+def test_evict_least_recently_used(tmp_path):
+    path = str(tmp_path)
+    SV = np.zeros([100, 10])
+    for n, key in enumerate(['a', 'b', 'c']):
+        cache.save_state(key, np.zeros([1]), SV, SV, path, 1e9)
+        os.utime(os.path.join(path, key + '.npz'), (1000. + n, 1000. + n))
+    size = os.path.getsize(os.path.join(path, 'a.npz'))
+    
+    # Reading 'a' makes 'b' the oldest entry
+    cache.load_state('a', path)
+    total = cache.evict(path, 2*size)
+    
+    assert sorted(os.listdir(path)) == ['a.npz', 'c.npz']
+    assert total <= 2*size
+    
+    cache.clear(path)
+    assert os.listdir(path) == []
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints are written as .npz files with the dict fields as JSON, and read
+back without pickle.
+"""
+
+import numpy as np
+import os
+import pytest
+
+from li_s_battery_checkpoint import save_checkpoint, load_checkpoint
+
+"============================================================================="
+
+def test_round_trip(tmp_path):
+    path = os.path.join(str(tmp_path), 'run', 'checkpoint.npz')
+    t = np.linspace(0., 10., 5)
+    SV = np.random.RandomState(0).rand(5, 7)
+    overrides = {'C_rate': 0.5, 'cathode_dy': (0.25, 0.75), 'A_C_0': np.float64(2e4),
+                 'C_k_el_0': np.array([1., 2., 3.])}
+    save_checkpoint(path, t=t, SV=SV, SV_dot=0*SV, stage='discharge', i_ext=-1.5,
+                    overrides=overrides, multipliers={'C-E-1': 2.})
+    
+    fields = load_checkpoint(path)
+    assert np.array_equal(fields['t'], t) and np.array_equal(fields['SV'], SV)
+    assert fields['stage'] == 'discharge' and fields['i_ext'] == -1.5
+    assert fields['multipliers'] == {'C-E-1': 2.}
+    
+    # Arrays in dicts come back as arrays, tuples as lists
+    restored = fields['overrides']
+    assert isinstance(restored['C_k_el_0'], np.ndarray)
+    assert np.array_equal(restored['C_k_el_0'], overrides['C_k_el_0'])
+    assert restored['cathode_dy'] == [0.25, 0.75]
+    assert restored['A_C_0'] == 2e4
+    
+    # Only the checkpoint is left in the directory
+    assert os.listdir(os.path.dirname(path)) == ['checkpoint.npz']
+
+def test_no_pickle(tmp_path):
+    path = os.path.join(str(tmp_path), 'old.npz')
+    np.savez(path, overrides=np.array([{'C_rate': 0.1}], dtype=object))
+    
+    with pytest.raises(ValueError, match='pickled'):
+        load_checkpoint(path)
+
+def test_unstorable_field(tmp_path):
+    with pytest.raises(TypeError):
+        save_checkpoint(os.path.join(str(tmp_path), 'c.npz'), overrides={'f': object()})
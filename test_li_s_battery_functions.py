@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Layout registry, state views, face fluxes and the discharge summary of
+li_s_battery_functions, on the stand-in cells of conftest.py. Only NumPy and
+pandas are needed.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import species
+from li_s_battery_functions import (layout_config, StateView, dst, dst_faces,
+                                    discharge_summary)
+
+"============================================================================="
+
+@pytest.mark.parametrize('npoints', [(1, 1, 1), (3, 2, 2)])
+def test_layout_order(make_cell, npoints):
+    cell = make_cell(*npoints)
+    cat, sep, an = cell.cathode, cell.sep, cell.anode
+    layout = layout_config(cat, sep, an, species)
+    nSV = cat.nSV + sep.nSV + an.nSV
+    
+    # Every SV position has one name, in SV order, and 'Time' comes last
+    assert len(layout.names) == nSV and None not in layout.names
+    assert len(set(layout.names)) == nSV
+    assert layout.columns.tolist() == layout.names + ['Time']
+    assert all(layout.index[name] == i for i, name in enumerate(layout.columns))
+    
+    # Names sit at the positions of the ptr and offsets tables
+    for j in range(cat.npoints):
+        assert layout.names[cat.offsets[j] + cat.ptr['phi_ed']] == 'Phi_ed' + str(j+1)
+        assert (layout.names[cat.offsets[j] + cat.ptr['rho_k_el'][2]]
+                == 'rho_Li+(e)_cat' + str(j+1))
+    assert layout.names[sep.offsets[-1] + sep.ptr['phi']] == 'Phi_sep' + str(sep.npoints)
+    assert layout.names[-1] == 'Phi_an' + str(an.npoints)
+    
+    # Fields list the nodes in order, and tags are their names
+    assert np.array_equal(layout.fields['eps_S8'], cat.offsets + cat.ptr['eps_S8'])
+    assert np.array_equal(layout.fields['rho_el_sep'],
+                          (sep.offsets[:, None] + sep.ptr['rho_k_el']).ravel())
+    for tag, fields in layout.fields.items():
+        assert layout.tags[tag] == [layout.names[i] for i in fields]
+
+"============================================================================="
+
+@pytest.fixture
+def states(make_cell):
+    """Meshed cell and random rows of states (n_times, nSV)."""
+    cell = make_cell(3, 2, 2)
+    nSV = cell.cathode.nSV + cell.sep.nSV + cell.anode.nSV
+    
+    return cell, 1 + np.random.RandomState(0).rand(4, nSV)
+
+def test_state_view(states):
+    cell, SV = states
+    cat, sep = cell.cathode, cell.sep
+    s_cat = StateView(SV, cat)
+    
+    assert s_cat.C_k.shape == (4, 3, len(species))
+    assert s_cat.phi_ed.shape == s_cat.phi_dl.shape == (4, 3)
+    
+    # Stored fields are views into SV, not copies
+    for field in [s_cat.C_k, s_cat.phi_ed, s_cat.phi_dl]:
+        assert np.shares_memory(field, SV)
+    assert s_cat.C_k[2, 1, 4] == SV[2, cat.offsets[1] + cat.ptr['rho_k_el'][4]]
+    assert np.array_equal(s_cat.phi_ed, SV[:, cat.offsets + cat.ptr['phi_ed']])
+    
+    assert np.allclose(s_cat.X_k.sum(axis=-1), 1.)
+    assert np.array_equal(s_cat.phi_el, s_cat.phi_ed - s_cat.phi_dl)
+    assert s_cat['C_tot'] is s_cat.C_tot
+    
+    # The separator has no electrode
+    s_sep = StateView(SV, sep)
+    assert s_sep.phi_ed is None and s_sep.phi_dl is None
+    assert np.array_equal(s_sep.phi_el, SV[:, sep.offsets + sep.ptr['phi']])
+
+def test_state_view_node(states):
+    cell, SV = states
+    cat = cell.cathode
+    s_cat = StateView(SV, cat)
+    
+    # One state gives the fields of one row
+    s_1 = StateView(SV[1], cat)
+    assert np.array_equal(s_1.C_k, s_cat.C_k[1])
+    assert np.shares_memory(s_1.C_k, SV)
+    
+    node = s_cat.node(-1)
+    assert node.C_k.shape == (4, len(species)) and node.phi_el.shape == (4,)
+    assert np.array_equal(node.X_k, s_cat.X_k[:, -1])
+    assert np.array_equal(node['phi_dl'], SV[:, cat.offsets[-1] + cat.ptr['phi_dl']])
+    assert np.shares_memory(node.C_k, SV)
+    assert StateView(SV, cell.sep).node(0).phi_ed is None
+
+"============================================================================="
+
+def test_dst_faces(states):
+    cell, SV = states
+    s_cat = StateView(SV, cell.cathode)
+    C_k, phi_el = s_cat.C_k, 0.01*s_cat.phi_el
+    rs = np.random.RandomState(1)
+    D_eff = 1e-10*(1 + rs.rand(4, 2, len(species)))
+    dyInv = 1/(1e-5*(1 + rs.rand(2)))
+    
+    N_io, i_io = dst_faces(C_k, phi_el, D_eff, dyInv)
+    assert N_io.shape == (4, 2, len(species)) and i_io.shape == (4, 2)
+    
+    # Every face of every row as dst gives it, face f between nodes f and f+1
+    for t in range(4):
+        for f in range(2):
+            s1 = {'C_k': C_k[t, f], 'phi_el': phi_el[t, f]}
+            s2 = {'C_k': C_k[t, f+1], 'phi_el': phi_el[t, f+1]}
+            N_f, i_f = dst(s1, s2, D_eff[t, f], dyInv[f])
+            assert np.allclose(N_io[t, f], N_f, rtol=1e-12, atol=0.)
+            assert np.isclose(i_io[t, f], i_f, rtol=1e-12, atol=1e-12*np.abs(i_io).max())
+
+"============================================================================="
+
+def test_discharge_summary(make_cell):
+    cell = make_cell()
+    cell.cathode.i_ext_amp, cell.cathode.m_S_0, cell.cathode.m_S_el = -1., 1/7200, 1/7200
+    cell.inputs.A_cat = 1.
+    tags = {'phi_ed': ['Phi_ed1'], 'phi_an': ['Phi_an1']}
+    
+    # One Ah/kg_sulfur per second, and a cell voltage falling linearly with
+    #   capacity so the plateau means are exact
+    t = np.arange(0., 801.)
+    V = 2.5 - 5e-4*t
+    SV_df = pd.DataFrame({'Phi_an1': 0.1 + 0*t, 'Phi_ed1': 0.1 + V, 'Time': t})
+    summary = discharge_summary(SV_df, tags, cell)
+    
+    assert summary['capacity'] == 800. and summary['t_end'] == 800.
+    assert np.isclose(summary['V_end'], 2.1)
+    assert np.isclose(summary['V_mean'], 2.3)
+    assert np.isclose(summary['V_upper'], 2.5 - 5e-4*209)
+    assert np.isclose(summary['V_lower'], 2.5 - 5e-4*609.5)
+    
+    # A discharge that ends on the upper plateau has no lower mean
+    summary = discharge_summary(SV_df.iloc[:400], tags, cell)
+    assert np.isclose(summary['V_mean'], summary['V_upper'])
+    assert np.isnan(summary['V_lower'])
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Golden trajectory comparison on synthetic discharge curves: compare passes
+a run within the tolerances of its reference, also across a small capacity
+shift, and fails offsets and missing curves. Only NumPy is needed.
+"""
+
+import numpy as np
+import os
+
+from li_s_battery_golden import compare, save, load, tolerances, dq
+
+"============================================================================="
+
+def discharge(stretch=1.):
+    """Curves of a discharge with a steep plateau transition at 400 Ah/kg,
+    stretched in capacity by stretch."""
+    q = np.linspace(0., 1000., 501)
+    
+    return {'capacity': stretch*q, 'voltage': 2.2 - 0.2*np.tanh((q - 400.)/5.),
+            'eps_S8': 0.2*(1 - q/1000.), 'eps_Li2S': 0.1*q/1000.,
+            'C_Li+(e)': 1. + 0.5*np.exp(-q/200.)}
+
+def test_identical():
+    ref = discharge()
+    errors = compare(ref, discharge())
+    
+    assert set(errors) == set(ref)
+    assert all(err == 0. for err in errors.values())
+
+def test_voltage_offset():
+    ref, new = discharge(), discharge()
+    new['voltage'] = new['voltage'] + 1.5*tolerances['voltage'][0]
+    errors = compare(ref, new)
+    
+    assert np.isclose(errors['voltage'], 1.5)
+    assert max(err for name, err in errors.items() if name != 'voltage') == 0.
+
+def test_capacity_shift():
+    ref = discharge()
+    
+    # Half of dq moves the transition by far more than the voltage tolerance
+    #   point by point, but stays within the band of the shifted reference
+    new = discharge(1 + 0.5*dq)
+    assert np.abs(np.interp(ref['capacity'], new['capacity'], new['voltage'])
+                  - ref['voltage']).max() > tolerances['voltage'][0]
+    errors = compare(ref, new)
+    assert max(errors.values()) <= 1
+    
+    # Beyond dq it fails
+    errors = compare(ref, discharge(1 + 3*dq))
+    assert errors['voltage'] > 1 and errors['capacity'] > 1
+
+def test_missing_curve():
+    ref, new = discharge(), discharge()
+    del new['eps_Li2S']
+    new['C_S8(e)'] = np.zeros_like(new['capacity'])
+    errors = compare(ref, new)
+    
+    assert errors['eps_Li2S'] == np.inf and errors['C_S8(e)'] == np.inf
+    assert errors['voltage'] == 0.
+
+def test_save_load(tmp_path):
+    path = os.path.join(str(tmp_path), 'cat1_0.1C.npz')
+    ref = discharge()
+    save(path, ref, {'C_rate': 0.1, 'flag_res_vec': 0})
+    
+    ref_l, overrides = load(path)
+    assert overrides == {'C_rate': 0.1, 'flag_res_vec': 0}
+    assert set(ref_l) == set(ref)
+    assert all(np.array_equal(ref_l[name], ref[name]) for name in ref)
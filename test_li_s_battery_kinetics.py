@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Kinetics kernel generated from the shipped CTI file. Only NumPy is needed,
+the comparison with Cantera itself is kinetics_check in the model.
+"""
+
+import numpy as np
+import pytest
+
+from li_s_battery_kinetics import (parse_equation, read_cti, generate_kernel, load_kernel,
+                                   isothermal)
+
+ctifile = 'sulfur_cathode_prelim.cti'
+interfaces = ['sulfur_surf', 'carbon_surf', 'lithium_sulfide_surf', 'lithium_surf']
+
+"============================================================================="
+
+def test_parse_equation():
+    reac, prod = parse_equation('1.5 S8-(e) + electron <=> 2 S6-(e)')
+    assert reac == {'S8-(e)': 1.5, 'electron': 1.}
+    assert prod == {'S6-(e)': 2.}
+    
+    # Repeated species are summed, one way reactions are read as well
+    reac, prod = parse_equation('Li+(e) + Li+(e) + S-(e) => Li2S')
+    assert reac == {'Li+(e)': 2., 'S-(e)': 1.}
+    assert prod == {'Li2S': 1.}
+
+def test_generate_kernel_compiles():
+    src = generate_kernel(ctifile, interfaces)
+    namespace = {}
+    exec(compile(src, ctifile + ' kernel', 'exec'), namespace)
+    
+    assert namespace['INTERFACES'] == tuple(interfaces)
+    for interface in interfaces:
+        assert callable(namespace[interface])
+    
+    # One rate constant of each kind for every reaction of the interface
+    k = namespace['rate_constants'](298.15)
+    for interface in interfaces:
+        k_f, k_r = k[interface]
+        assert k_f.shape == k_r.shape == (len(namespace['REACTIONS'][interface]),)
+        assert np.all(k_f > 0) and np.all(k_r > 0)
+
+# delta_standard_gibbs [J/kmol] and equilibrium_constants of the Cantera
+#   interfaces at 298.15 K and 1 atm, for the shipped CTI file converted
+#   with cti2yaml
+cantera_298 = {'S-E-1': (17599100., 8.25603e-4),
+               'C-E-1': (-65799550., 3.36963e11),
+               'C-E-2': (-120200000., 1.14322e21),
+               'C-E-3': (-51650000., 1.11864e9),
+               'C-E-4': (-49250000., 4.24841e8),
+               'C-E-5': (-36400000., 2.38234e6),
+               'L-E-1': (-131129580., 9.39525e22),
+               'Anode-1': (-282485210., 3.08509e49)}
+
+def test_kernel_thermo_matches_cantera():
+    kernel = load_kernel(ctifile, interfaces)
+    dG = kernel.standard_gibbs(298.15)
+    k_f, k_r = kernel.rate_constants(298.15)['sulfur_surf']
+    
+    for interface in interfaces:
+        for rxn, dG_r in zip(kernel.REACTIONS[interface], dG[interface]):
+            dG_ct, K_c_ct = cantera_298[rxn]
+            assert np.isclose(dG_r, dG_ct, rtol=1e-9, atol=0.), rxn
+            assert np.isclose(np.exp(-dG_r/kernel.R/298.15), K_c_ct, rtol=1e-5), rxn
+    
+    # Metal phases have zero standard chemical potentials, so S8(s) adds
+    #   nothing to the reverse rate of S-E-1
+    assert np.isclose(k_r[0], k_f[0]/cantera_298['S-E-1'][1], rtol=1e-5)
+
+def test_isothermal(monkeypatch):
+    kernel = load_kernel(ctifile, interfaces)
+    for name, value in [('kernel', kernel), ('T', None), ('multipliers', {}),
+                        ('_multipliers', None)]:
+        monkeypatch.setattr(isothermal, name, value)
+    
+    def expected(T, multipliers={}):
+        k = kernel.rate_constants(T, kernel.standard_gibbs(T))
+        for interface, (k_f, k_r) in k.items():
+            m = np.array([multipliers.get(r, 1.) for r in kernel.REACTIONS[interface]])
+            k[interface] = (k_f*m, k_r*m)
+        return k
+    
+    def assert_constants(k, k_ref):
+        for interface in interfaces:
+            for k_i, k_ref_i in zip(k[interface], k_ref[interface]):
+                assert np.allclose(k_i, k_ref_i, rtol=1e-14, atol=0.), interface
+    
+    k, FRT = isothermal.update(298.15)
+    assert_constants(k, expected(298.15))
+    assert FRT == kernel.F/kernel.R/298.15
+    
+    # Recomputed for a new temperature, and for new multipliers
+    assert_constants(isothermal.update(320.)[0], expected(320.))
+    isothermal.multipliers = {'C-E-1': 2.}
+    assert_constants(isothermal.update(320.)[0], expected(320., {'C-E-1': 2.}))
+    isothermal.multipliers = {}
+    assert_constants(isothermal.update(320.)[0], expected(320.))
+    
+    # and not otherwise
+    k = isothermal.update(320.)[0]
+    assert isothermal.update(320.)[0] is k
+
+@pytest.fixture
+def states():
+    """Random electrolyte states and potentials of a few nodes."""
+    rs = np.random.RandomState(0)
+    cti = read_cti(ctifile)
+    n_species = len(cti['phases']['electrolyte'].species)
+    X = rs.rand(6, n_species)
+    
+    return {'X_electrolyte': X/X.sum(axis=1)[:, None],
+            'phi_electrolyte': 0.1*rs.rand(6), 'phi_electron': 2. + 0.5*rs.rand(6)}
+
+def test_kernel_conserves_charge(states):
+    cti = read_cti(ctifile)
+    kernel = load_kernel(ctifile, interfaces)
+    k = kernel.rate_constants(298.15)
+    FRT = kernel.F/kernel.R/298.15
+    
+    for interface in interfaces:
+        args = [states[name] for name in kernel.ARGS[interface][:-3]]
+        rates = getattr(kernel, interface)(*(args + list(k[interface]) + [FRT]))
+        charge = np.zeros([6])
+        for phase, sdot in zip(kernel.PHASES[interface], rates):
+            z = np.array([cti['species'][sp]['charge']
+                          for sp in cti['phases'][phase].species])
+            charge += sdot.dot(z)
+        scale = max(max(np.abs(sdot).max() for sdot in rates), 1e-300)
+        assert np.allclose(charge/scale, 0., atol=1e-12), interface
+
+def test_kernel_rows_are_independent(states):
+    kernel = load_kernel(ctifile, interfaces)
+    k = kernel.rate_constants(298.15)
+    FRT = kernel.F/kernel.R/298.15
+    
+    # All nodes at once give the rates of each node alone
+    for interface in interfaces:
+        names = kernel.ARGS[interface][:-3]
+        rates = getattr(kernel, interface)(*([states[name] for name in names]
+                                              + list(k[interface]) + [FRT]))
+        for j in range(6):
+            rates_j = getattr(kernel, interface)(*([states[name][j:j+1] for name in names]
+                                                   + list(k[interface]) + [FRT]))
+            for sdot, sdot_j in zip(rates, rates_j):
+                assert np.allclose(sdot[j:j+1], sdot_j, rtol=1e-14, atol=0.)
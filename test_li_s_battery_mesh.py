@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive cathode mesh: refine splits and merges nodes within the node limits
+and keeps the cathode thickness, transfer keeps the solid phases and the
+electrolyte species.
+"""
+
+import numpy as np
+
+from li_s_battery_mesh import refine, transfer
+
+"============================================================================="
+
+def test_refine_merge(make_cell):
+    cell = make_cell(4)
+    H = cell.cathode.dy_vec.sum()
+    
+    # Faces well below mesh_tol merge pairs of nodes
+    dy = refine(cell, np.zeros([4]))
+    assert np.allclose(dy, 2*cell.cathode.dy_vec[:2])
+    
+    # but not below npoints_cathode_min
+    dy = refine(make_cell(4, npoints_cathode_min=4), np.zeros([4]))
+    assert np.allclose(dy, cell.cathode.dy_vec)
+    assert np.isclose(dy.sum(), H)
+
+def test_refine_split(make_cell):
+    cell = make_cell(4)
+    dy_0 = cell.cathode.dy_vec[0]
+    
+    # The nodes on either side of the first face are split, the quiet
+    #   nodes at the separator merged
+    dy = refine(cell, np.array([0.1, 0., 0., 0.]))
+    assert np.allclose(dy, dy_0*np.array([0.5, 0.5, 0.5, 0.5, 2.]))
+    
+    # Splits stop at npoints_cathode_max, the largest errors first. Both
+    #   nodes next to a face share its error
+    cell = make_cell(4, npoints_cathode_max=6)
+    dy = refine(cell, np.array([0.06, 0.2, 0.06, 0.06]))
+    assert dy.size == 6
+    assert np.allclose(dy, dy_0*np.array([1., 0.5, 0.5, 0.5, 0.5, 1.]))
+    assert np.isclose(dy.sum(), cell.cathode.dy_vec.sum())
+
+def test_transfer_conserves(make_cell):
+    cell_old = make_cell(3)
+    cat_old = cell_old.cathode
+    cat_old.dy_vec = cat_old.H*np.array([0.2, 0.3, 0.5])
+    cell_new = make_cell(4)
+    cat_new = cell_new.cathode
+    cat_new.dy_vec = cat_new.H*np.array([0.1, 0.1, 0.3, 0.5])
+    
+    nSV = cat_old.nSV + cell_old.sep.nSV + cell_old.anode.nSV
+    rs = np.random.RandomState(0)
+    SV = 1 + rs.rand(nSV)
+    SV[cat_old.offsets + cat_old.ptr['eps_S8']] = 0.3*rs.rand(3)
+    SV[cat_old.offsets + cat_old.ptr['eps_Li2S']] = 0.1*rs.rand(3)
+    
+    SV_new = transfer(cell_old, cell_new, SV)
+    assert SV_new.size == cat_new.nSV + cell_new.sep.nSV + cell_new.anode.nSV
+    
+    # Separator and anode are copied
+    assert np.array_equal(SV_new[cat_new.nSV:], SV[cat_old.nSV:])
+    
+    def inventory(cat, SV):
+        SV_cat = SV[:cat.nSV].reshape(cat.npoints, cat.nVars)
+        eps_S8, eps_Li2S = SV_cat[:, cat.ptr['eps_S8']], SV_cat[:, cat.ptr['eps_Li2S']]
+        eps_el = 1 - cat.eps_C_0 - eps_S8 - eps_Li2S
+        rho = SV_cat[:, cat.ptr['rho_k_el']]
+        
+        return eps_S8.dot(cat.dy_vec), eps_Li2S.dot(cat.dy_vec), (eps_el*cat.dy_vec).dot(rho)
+    
+    for before, after in zip(inventory(cat_old, SV), inventory(cat_new, SV_new)):
+        assert np.allclose(before, after, rtol=1e-12, atol=0.)
+    
+    # A node inside one old node takes its state
+    assert np.allclose(SV_new[:cat_new.nVars], SV[:cat_old.nVars], rtol=1e-12)
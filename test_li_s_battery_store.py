@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Trajectory store. TrajectoryReader gives back what TrajectoryWriter wrote,
+by column and in chunks of rows, with NumPy and pandas alone.
+
+Streaming of the solution to a TrajectoryWriter: the rows must reach the sink
+while the solver integrates, not all at once when simulate() returns, or the
+solver holds the whole stage or step in memory. These tests need Cantera and
+Assimulo.
+"""
+
+import numpy as np
+import pytest
+
+from li_s_battery_store import TrajectoryWriter, TrajectoryReader
+
+"============================================================================="
+
+columns = ['a', 'b', 'c', 'Time']
+
+def write(path, n_rows, chunk_rows=4, steps=()):
+    """Rows [i, 10*i, 100*i, t_i] of n_rows time points, with a protocol step 
+    starting at each row in steps."""
+    rows = np.arange(n_rows)[:, None]*np.array([1., 10., 100., 0.5])
+    writer = TrajectoryWriter(path, columns, chunk_rows)
+    for i, row in enumerate(rows):
+        if i in steps:
+            writer.mark_step()
+        writer.append(row[-1], row[:-1])
+    
+    return writer, rows
+
+def test_reader_columns(tmp_path):
+    writer, rows = write(str(tmp_path), 10, steps=(0, 6))
+    writer.close()
+    
+    reader = TrajectoryReader(str(tmp_path))
+    assert len(reader) == 10
+    assert isinstance(reader.data, np.memmap)
+    assert np.array_equal(reader['Time'].values, rows[:, -1])
+    assert np.array_equal(reader[['c', 'a']].values, rows[:, [2, 0]])
+    assert np.array_equal(reader.select(['b'], slice(3, 8)).values, rows[3:8, [1]])
+    
+    # Protocol steps as slices of rows
+    assert reader.step(0) == slice(0, 6) and reader.step(1) == slice(6, 10)
+    
+    with pytest.raises(KeyError):
+        reader.select(['a', 'd'])
+
+def test_reader_chunks(tmp_path):
+    writer, rows = write(str(tmp_path), 10)
+    writer.close()
+    
+    # Chunks are indexed by row number in the run and cover it once
+    reader = TrajectoryReader(str(tmp_path), chunk_rows=3)
+    chunks = list(reader.chunks())
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+    assert list(chunks[1].index) == [3, 4, 5]
+    assert np.array_equal(np.vstack([chunk.values for chunk in chunks]), rows)
+    
+    chunks = list(reader.chunks(['Time']))
+    assert np.array_equal(np.hstack([chunk['Time'].values for chunk in chunks]), 
+                          rows[:, -1])
+
+def test_reader_before_close(tmp_path):
+    # An unfinished run can be read up to its last flush
+    writer, rows = write(str(tmp_path), 10, chunk_rows=4)
+    assert len(TrajectoryReader(str(tmp_path))) == 8
+    assert writer.last[0][0] == rows[-1, -1]
+    
+    writer.close()
+    assert len(TrajectoryReader(str(tmp_path))) == 10
+    
+    # and a run with no rows yet as empty
+    TrajectoryWriter(str(tmp_path / 'empty'), columns)
+    assert len(TrajectoryReader(str(tmp_path / 'empty'))) == 0
+
+"============================================================================="
+
+@pytest.fixture
+def model():
+    """The model, which needs Cantera and Assimulo."""
+    pytest.importorskip('cantera')
+    pytest.importorskip('assimulo')
+    import li_s_battery_model
+    
+    return li_s_battery_model
+
+class RecordingWriter(TrajectoryWriter):
+    """TrajectoryWriter noting the number of residual calls so far at each
+    append."""
+    def __init__(self, path, calls):
+        from li_s_battery_init import cell
+        from li_s_battery_post import column_names
+        TrajectoryWriter.__init__(self, path, column_names(cell.anode.npoints,
+                                  cell.sep.npoints, cell.cathode.npoints, cell))
+        self.calls = calls
+        self.at_append = []
+    
+    def append(self, t, SV, SV_dot=None):
+        self.at_append.append(self.calls[0])
+        TrajectoryWriter.append(self, t, SV, SV_dot)
+
+@pytest.fixture
+def calls(monkeypatch, model):
+    """Counter of the residual calls, res_fun and res_fun_vec alike."""
+    cc_cycling = model.cc_cycling
+    calls = [0]
+    for name in ['res_fun', 'res_fun_vec']:
+        def counted(t, SV, SV_dot, cell, fun=getattr(cc_cycling, name)):
+            calls[0] += 1
+            return fun(t, SV, SV_dot, cell)
+        monkeypatch.setattr(cc_cycling, name, counted)
+    
+    return calls
+
+"============================================================================="
+
+def test_run_stage_streams(tmp_path, calls, model):
+    sink = RecordingWriter(str(tmp_path), calls)
+    SV_0 = model.cell.sol_init.SV_0
+    t, SV, SV_dot = model.run_stage(model.cell, 0., SV_0, np.zeros_like(SV_0), 60., 
+                                    sink=sink)
+    sink.close()
+    
+    # Rows handed over after simulate() all see the final count
+    assert len(sink.at_append) > 1
+    assert sink.at_append[0] < calls[0]
+    assert len(TrajectoryReader(str(tmp_path))) == len(sink.at_append)
+    assert t[-1] == 60.
+
+def test_run_protocol_streams(tmp_path, calls, model):
+    from li_s_battery_protocol import run_protocol, rest
+    sink = RecordingWriter(str(tmp_path), calls)
+    run_protocol([rest(30.), rest(30.)], model.cell, sink=sink)
+    
+    assert len(sink.steps) == 2
+    assert sink.at_append[0] < calls[0]
+    
+    # The second step is streamed as well, not only the first
+    first = sink.at_append[sink.steps[1]]
+    assert first < calls[0]
+    assert len(TrajectoryReader(str(tmp_path))) == len(sink.at_append)